@@ -0,0 +1,411 @@
+# ----------------------------------------------------------------------------#
+# JSON API, version 1.
+#
+# Serves the data of the venue, artist and show pages as JSON under /api/v1.
+#
+#   ?fields=id,name,...   sparse fieldsets, only the listed fields are
+#                         serialized (and only the queries they need run)
+#   ?cursor=&limit=       keyset pagination of the list endpoints, follow
+#                         "next" until it is null
+#
+# POST /api/v1/shows schedules many shows at once from CSV or JSON, the
+# /calendar of a venue or an artist lists when it is busy and free.
+#
+# Responses are gzip or brotli (when the brotli package is installed)
+# compressed according to Accept-Encoding.
+# ----------------------------------------------------------------------------#
+import gzip
+import zlib
+from datetime import datetime, timedelta
+
+from flask import Blueprint, Response, abort, current_app, jsonify, request, stream_with_context, url_for
+from sqlalchemy.orm import selectinload
+
+from calendars import DEFAULT_MAX_DAYS, calendar, month_of, next_month
+from models import db, Artist, Venue, naive_utc
+from export import EXPORT_FORMATS, EXPORT_KINDS, stream_export
+from replicas import mark_primary_write, replica_reads
+from scheduling import (
+    DEFAULT_BATCH_SIZE, DEFAULT_MAX_ROWS, ScheduleError, invalidate_scheduled_pages, read_show_records, schedule_shows,
+)
+from services import entities_page, load_artist_with_shows, load_venue_with_shows, shows_page
+
+try:
+    import brotli
+except ImportError:
+    # Optional, responses fall back to gzip without it
+    brotli = None
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# Content types accepted by POST /shows
+SCHEDULE_MIMETYPES = {'text/csv': 'csv', 'application/json': 'json'}
+
+
+# ----------------------------------------------------------------------------#
+# Serialization.
+# ----------------------------------------------------------------------------#
+
+def _shows_of(shows, counterpart):
+    return [{
+        f'{counterpart}_id': getattr(show, f'{counterpart}_id'),
+        f'{counterpart}_name': getattr(show, f'{counterpart}_name'),
+        f'{counterpart}_image_link': getattr(show, f'{counterpart}_image_link'),
+        'start_time': show.start_time.isoformat(),
+    } for show in shows]
+
+
+# field -> function(entity, past shows, upcoming shows), shows are None unless a show field was requested
+VENUE_FIELDS = {
+    'id': lambda venue, past, upcoming: venue.id,
+    'name': lambda venue, past, upcoming: venue.name,
+    'genres': lambda venue, past, upcoming: [genre.name for genre in venue.genres],
+    'address': lambda venue, past, upcoming: venue.address,
+    'city': lambda venue, past, upcoming: venue.city,
+    'state': lambda venue, past, upcoming: venue.state,
+    'phone': lambda venue, past, upcoming: venue.phone,
+    'website_link': lambda venue, past, upcoming: venue.website_link,
+    'facebook_link': lambda venue, past, upcoming: venue.facebook_link,
+    'seeking_talent': lambda venue, past, upcoming: venue.seeking_talent,
+    'seeking_description': lambda venue, past, upcoming: venue.seeking_description,
+    'image_link': lambda venue, past, upcoming: venue.image_link,
+    'past_shows_count': lambda venue, past, upcoming: venue.past_shows_count,
+    'upcoming_shows_count': lambda venue, past, upcoming: venue.upcoming_shows_count,
+    'past_shows': lambda venue, past, upcoming: _shows_of(past, 'artist'),
+    'upcoming_shows': lambda venue, past, upcoming: _shows_of(upcoming, 'artist'),
+}
+
+ARTIST_FIELDS = {
+    'id': lambda artist, past, upcoming: artist.id,
+    'name': lambda artist, past, upcoming: artist.name,
+    'genres': lambda artist, past, upcoming: [genre.name for genre in artist.genres],
+    'city': lambda artist, past, upcoming: artist.city,
+    'state': lambda artist, past, upcoming: artist.state,
+    'phone': lambda artist, past, upcoming: artist.phone,
+    'website_link': lambda artist, past, upcoming: artist.website_link,
+    'facebook_link': lambda artist, past, upcoming: artist.facebook_link,
+    'seeking_venue': lambda artist, past, upcoming: artist.seeking_venue,
+    'seeking_description': lambda artist, past, upcoming: artist.seeking_description,
+    'image_link': lambda artist, past, upcoming: artist.image_link,
+    'past_shows_count': lambda artist, past, upcoming: artist.past_shows_count,
+    'upcoming_shows_count': lambda artist, past, upcoming: artist.upcoming_shows_count,
+    'past_shows': lambda artist, past, upcoming: _shows_of(past, 'venue'),
+    'upcoming_shows': lambda artist, past, upcoming: _shows_of(upcoming, 'venue'),
+}
+
+SHOW_FIELDS = {
+    'id': lambda show: show.id,
+    'start_time': lambda show: show.start_time.isoformat(),
+    'end_time': lambda show: show.end_time.isoformat(),
+    'venue_id': lambda show: show.venue.id,
+    'venue_name': lambda show: show.venue.name,
+    'artist_id': lambda show: show.artist.id,
+    'artist_name': lambda show: show.artist.name,
+    'artist_image_link': lambda show: show.artist.image_link,
+}
+
+# Fields holding show lists, only served by the detail endpoints
+SHOW_LIST_FIELDS = ('past_shows', 'upcoming_shows')
+
+
+def requested_fields(available, default=None):
+    """Fields listed in ?fields=, or default (every available field)
+
+    Aborts with 400 when a field doesn't exist.
+    """
+    raw = request.args.get('fields')
+    if not raw:
+        return list(default or available)
+
+    fields = list(dict.fromkeys(field.strip() for field in raw.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        abort(400, description=f'Unknown fields: {", ".join(unknown)}')
+    return fields
+
+
+def serialize(fields, serializers, *args):
+    return {field: serializers[field](*args) for field in fields}
+
+
+def page_size():
+    size = request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int)
+    return max(min(size, current_app.config['API_MAX_PAGE_SIZE']), 1)
+
+
+def page_response(data, next_cursor):
+    next_url = None
+    if next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = next_cursor
+        next_url = url_for(request.endpoint, _external=True, **args)
+    return jsonify(data=data, next_cursor=next_cursor, next=next_url)
+
+
+# ----------------------------------------------------------------------------#
+# Endpoints.
+# ----------------------------------------------------------------------------#
+
+def _list_entities(model, serializers, default_fields):
+    available = [field for field in serializers if field not in SHOW_LIST_FIELDS]
+    fields = requested_fields(available, default=default_fields)
+    page = entities_page(
+        model,
+        cursor=request.args.get('cursor'),
+        page_size=page_size(),
+        city=request.args.get('city', '').strip(),
+        state=request.args.get('state', '').strip(),
+        with_genres='genres' in fields,
+    )
+    data = [serialize(fields, serializers, entity, None, None) for entity in page.items]
+    return page_response(data, page.next_cursor)
+
+
+def _show_entity(model, loader, serializers, entity_id):
+    fields = requested_fields(serializers)
+    if any(field in SHOW_LIST_FIELDS for field in fields):
+        # Entity, genres and shows with their counterpart columns, three queries
+        loaded = loader(entity_id)
+    else:
+        query = model.query.options(selectinload(model.genres)) if 'genres' in fields else model.query
+        entity = query.get(entity_id)
+        loaded = (entity, None, None) if entity else None
+    if not loaded:
+        abort(404)
+    return jsonify(data=serialize(fields, serializers, *loaded))
+
+
+@api.route('/venues')
+@replica_reads
+def venues():
+    """Venues in id order, filterable with ?city= and ?state="""
+    return _list_entities(Venue, VENUE_FIELDS,
+                          ('id', 'name', 'city', 'state', 'upcoming_shows_count'))
+
+
+@api.route('/venues/<int:venue_id>')
+@replica_reads
+def show_venue(venue_id):
+    return _show_entity(Venue, load_venue_with_shows, VENUE_FIELDS, venue_id)
+
+
+@api.route('/artists')
+@replica_reads
+def artists():
+    """Artists in id order, filterable with ?city= and ?state="""
+    return _list_entities(Artist, ARTIST_FIELDS,
+                          ('id', 'name', 'city', 'state', 'upcoming_shows_count'))
+
+
+@api.route('/artists/<int:artist_id>')
+@replica_reads
+def show_artist(artist_id):
+    return _show_entity(Artist, load_artist_with_shows, ARTIST_FIELDS, artist_id)
+
+
+@api.route('/shows')
+@replica_reads
+def shows():
+    """Shows in (start_time, id) order, accepts ?when=upcoming|past and ?from= / ?to= dates like /shows"""
+    fields = requested_fields(SHOW_FIELDS)
+    when = request.args.get('when')
+    start = request.args.get('from', type=naive_utc)
+    end = request.args.get('to', type=naive_utc)
+
+    page = shows_page(
+        cursor=request.args.get('cursor'),
+        page_size=page_size(),
+        when=when if when in ('upcoming', 'past') else None,
+        start=start,
+        end=end,
+    )
+    data = [serialize(fields, SHOW_FIELDS, show) for show in page.shows]
+    return page_response(data, page.next_cursor)
+
+
+@api.route('/shows', methods=['POST'])
+def schedule():
+    """Create many shows from a CSV (Content-Type: text/csv) or JSON body, see scheduling.py
+
+    All or nothing: 422 with the errors of every invalid row and nothing
+    created, unless ?skip_invalid=1 creates the valid rows anyway.
+    """
+    schedule_format = SCHEDULE_MIMETYPES.get(request.mimetype)
+    if schedule_format is None:
+        abort(415, description=f'Send the shows as {" or ".join(SCHEDULE_MIMETYPES)}')
+    try:
+        records = read_show_records(
+            request.get_data(as_text=True),
+            schedule_format,
+            max_rows=current_app.config.get('SCHEDULE_MAX_ROWS', DEFAULT_MAX_ROWS),
+        )
+    except ScheduleError as error:
+        abort(400, description=str(error))
+
+    skip_invalid = request.args.get('skip_invalid') in ('1', 'true')
+    try:
+        result = schedule_shows(
+            db.session.connection(),
+            records,
+            batch_size=current_app.config.get('SCHEDULE_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+            skip_invalid=skip_invalid,
+        )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    mark_primary_write()
+    invalidate_scheduled_pages(result)
+
+    errors = [{'row': error.row, 'errors': error.errors} for error in result.errors]
+    status = 422 if errors and not skip_invalid else 201
+    return jsonify(created=result.created, errors=errors), status
+
+
+def _calendar_time(name):
+    raw = request.args.get(name)
+    if not raw:
+        return None
+    try:
+        return naive_utc(raw)
+    except ValueError:
+        abort(400, description=f'?{name}= must be an ISO 8601 date or date and time')
+
+
+def _calendar(kind, entity_id):
+    """Busy and free times from ?from= (default: the start of this month) to ?to= (default: the next month)"""
+    start = _calendar_time('from') or month_of(datetime.utcnow())
+    end = _calendar_time('to') or next_month(month_of(start))
+    if end <= start:
+        abort(400, description='?to= must be after ?from=')
+    max_days = current_app.config.get('CALENDAR_MAX_DAYS', DEFAULT_MAX_DAYS)
+    if end - start > timedelta(days=max_days):
+        abort(400, description=f'Calendars span at most {max_days} days')
+
+    found = calendar(kind, entity_id, start, end)
+    if found is None:
+        abort(404)
+    counterpart = 'artist_id' if kind == 'venue' else 'venue_id'
+    return jsonify(data={
+        f'{kind}_id': entity_id,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'busy': [{
+            'show_id': booking.show_id,
+            counterpart: booking.counterpart_id,
+            'start_time': booking.start_time.isoformat(),
+            'end_time': booking.end_time.isoformat(),
+        } for booking in found.busy],
+        'free': [{'start_time': free_start.isoformat(), 'end_time': free_end.isoformat()}
+                 for free_start, free_end in found.free],
+    })
+
+
+@api.route('/venues/<int:venue_id>/calendar')
+@replica_reads
+def venue_calendar(venue_id):
+    return _calendar('venue', venue_id)
+
+
+@api.route('/artists/<int:artist_id>/calendar')
+@replica_reads
+def artist_calendar(artist_id):
+    return _calendar('artist', artist_id)
+
+
+@api.route('/export/<kind>')
+@replica_reads
+def export(kind):
+    """Stream every row of shows, venues or artists as ?format=ndjson (default) or csv
+
+    ?from= / ?to= bound the show start times (venue and artist creation
+    dates), ?city= narrows to a venue or artist city.
+    """
+    export_format = request.args.get('format', 'ndjson')
+    if kind not in EXPORT_KINDS:
+        abort(404)
+    if export_format not in EXPORT_FORMATS:
+        abort(400, description=f'Unknown format {export_format!r}, use one of {", ".join(EXPORT_FORMATS)}')
+
+    chunks = stream_export(
+        kind,
+        export_format,
+        start=request.args.get('from', type=naive_utc),
+        end=request.args.get('to', type=naive_utc),
+        city=request.args.get('city', '').strip(),
+    )
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename={kind}.{export_format}'
+    return response
+
+
+def json_error(error):
+    response = jsonify(error={'status': error.code, 'message': error.description})
+    response.status_code = error.code
+    if getattr(error, 'valid_methods', None):
+        response.headers['Allow'] = ', '.join(error.valid_methods)
+    return response
+
+
+def is_api_request():
+    return request.path.startswith(api.url_prefix + '/')
+
+
+# Registered per code, the application's own 404 / 500 pages would win over a HTTPException handler.
+# Errors raised while matching the URL (unknown paths, 405) come before any blueprint and reach the
+# application's handlers, which answer them with json_error() when is_api_request()
+for code in (400, 404, 413, 415, 500):
+    api.register_error_handler(code, json_error)
+
+
+# ----------------------------------------------------------------------------#
+# Compression.
+# ----------------------------------------------------------------------------#
+
+def _compressors():
+    compressors = {'gzip': lambda data, level: gzip.compress(data, compresslevel=level)}
+    if brotli is not None:
+        # Brotli quality runs 0-11, map the shared 1-9 level onto it
+        compressors['br'] = lambda data, level: brotli.compress(data, quality=min(level + 2, 11))
+    return compressors
+
+
+def gzip_stream(chunks, level):
+    """Gzip a streamed body chunk by chunk, without buffering it"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@api.after_request
+def compress(response):
+    """Compress JSON bodies above API_COMPRESS_MIN_SIZE with the best encoding the client accepts
+
+    Streamed bodies are gzipped on the fly regardless of size.
+    """
+    response.vary.add('Accept-Encoding')
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+
+    if response.is_streamed:
+        if request.accept_encodings.best_match(['gzip']):
+            response.response = gzip_stream(response.response, current_app.config['API_COMPRESS_LEVEL'])
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config['API_COMPRESS_MIN_SIZE']:
+        return response
+
+    compressors = _compressors()
+    # Prefer brotli when the client weighs both equally, it is smaller for JSON
+    encoding = request.accept_encodings.best_match(sorted(compressors, key=lambda name: name != 'br'))
+    if encoding is None:
+        return response
+
+    response.set_data(compressors[encoding](data, current_app.config['API_COMPRESS_LEVEL']))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -3,17 +3,38 @@
 # ----------------------------------------------------------------------------#
 
 import os
-import dateutil.parser
-import babel
 from flask import Flask, render_template, request, flash, redirect, url_for, abort, jsonify
 from flask_moment import Moment
 from flask_migrate import Migrate
 from sqlalchemy import desc
-import logging
-from logging import Formatter, FileHandler
 from forms import *
 
-from models import db, Artist, Venue, Show, Genre
+from models import db, Artist, Venue, Show, naive_utc
+from services import (
+    venue_directory_rows,
+    group_venues_by_area,
+    upcoming_show_counts_by_venue,
+    upcoming_show_counts_by_artist,
+    search_results,
+    shows_page,
+    load_venue_with_shows,
+    load_artist_with_shows,
+    venue_page_validators,
+    artist_page_validators,
+)
+from search import search_names, full_text_search
+from cache import ResponseCache, conditional
+from counters import counters_cli
+from api import api, is_api_request, json_error
+from export import export_command
+from profiling import RequestProfiler
+from pool import render_pool_metrics
+from replicas import ReplicaRouter, mark_primary_write, replica_reads
+from logs import LogPipeline
+from calendars import calendar_tag
+from formatting import format_datetime, format_datetimes
+from genres import genre_catalog
+from scheduling import invalidate_scheduled_pages, schedule_command, schedule_shows
 
 # ----------------------------------------------------------------------------#
 # App Config.
@@ -25,22 +46,53 @@ app.config.from_object('config')
 
 db.init_app(app)
 migrate = Migrate(app, db)
+replica_router = ReplicaRouter(app, db)
+response_cache = ResponseCache(app)
+app.cli.add_command(counters_cli)
+app.register_blueprint(api)
+app.cli.add_command(export_command)
+app.cli.add_command(schedule_command)
+profiler = RequestProfiler(app)
+profiler.add_collector(lambda: render_pool_metrics(database_pools()))
+log_pipeline = LogPipeline()
+if not app.debug:
+    log_pipeline.init_app(app)
+profiler.add_collector(log_pipeline.render_metrics)
+
+
+def database_pools():
+    """{bind name: pool} of the primary and the read replicas"""
+    pools = {'primary': db.engine.pool}
+    pools.update((bind, db.get_engine(app, bind).pool) for bind in replica_router.binds)
+    return pools
 
 
 # ----------------------------------------------------------------------------#
 # Filters.
 # ----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format, locale='en')
+app.jinja_env.filters['datetime'] = format_datetime
 
 
-app.jinja_env.filters['datetime'] = format_datetime
+# ----------------------------------------------------------------------------#
+# Cache invalidation.
+# ----------------------------------------------------------------------------#
+
+def invalidate_venue_pages(venue_id):
+    """Drop every cached page that shows data of the venue"""
+    # Artist pages list the names and images of the venues they play at
+    artist_ids = [artist_id for (artist_id,) in
+                  db.session.query(Show.artist_id).filter(Show.venue_id == venue_id).distinct()]
+    response_cache.invalidate('home', 'venues', 'shows', f'venue:{venue_id}',
+                              *[f'artist:{artist_id}' for artist_id in artist_ids])
+
+
+def invalidate_artist_pages(artist_id):
+    """Drop every cached page that shows data of the artist"""
+    venue_ids = [venue_id for (venue_id,) in
+                 db.session.query(Show.venue_id).filter(Show.artist_id == artist_id).distinct()]
+    response_cache.invalidate('home', 'artists', 'shows', f'artist:{artist_id}',
+                              *[f'venue:{venue_id}' for venue_id in venue_ids])
 
 
 # ----------------------------------------------------------------------------#
@@ -48,6 +100,8 @@ app.jinja_env.filters['datetime'] = format_datetime
 # ----------------------------------------------------------------------------#
 
 @app.route('/')
+@replica_reads
+@response_cache.cached(tags=['home'])
 def index():
     venues = Venue.query.order_by(desc(Venue.created_date)).limit(10).all()
     artists = Artist.query.order_by(desc(Artist.created_date)).limit(10).all()
@@ -58,91 +112,75 @@ def index():
 #  ----------------------------------------------------------------
 
 @app.route('/venues')
+@replica_reads
+@response_cache.cached(tags=['venues'])
 def venues():
-    """Get a list of all venues"""
-    venues = Venue.query.all()
-
-    venue_data = {}
-
-    for venue in venues:
-        # For each venue, calculate the number of upcoming shows
-        upcoming_shows = Show.query.filter(Show.venue_id == venue.id).filter(Show.start_time > datetime.now()).count()
-
-        key = (venue.city, venue.state)
-        if key not in venue_data:
-            venue_data[key] = {
-                "city": venue.city,
-                "state": venue.state,
-                "venues": []
-            }
+    """Get a list of all venues, optionally narrowed down with ?city= and ?state="""
+    city = request.args.get('city', '').strip()
+    state = request.args.get('state', '').strip()
 
-        venue_data[key]["venues"].append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": upcoming_shows
-        })
+    # One grouped query returns every venue with its upcoming show count,
+    # ordered so the areas can be grouped while the template iterates
+    rows = venue_directory_rows(city=city, state=state)
 
-    # Convert the dictionary to a list for the template
-    data = [value for key, value in venue_data.items()]
-
-    return render_template('pages/venues.html', areas=data)
+    return render_template('pages/venues.html', areas=group_venues_by_area(rows))
 
 
 @app.route('/venues/search', methods=['POST'])
+@replica_reads
 def search_venues():
     # seach for Hop should return "The Musical Hop".
     # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
     # Get the search term from the form
     search_term = request.form.get('search_term', '')
 
-    # Perform a case-insensitive search using ilike
-    matching_venues = Venue.query.filter(Venue.name.ilike(f"%{search_term}%")).all()
-
-    # Prepare the data for the response
-    data = []
-    for venue in matching_venues:
-        num_upcoming_shows = Show.query.filter_by(venue_id=venue.id).filter(Show.start_time > datetime.now()).count()
-        data.append({
-            "id": venue.id,
-            "name": venue.name,
-            "num_upcoming_shows": num_upcoming_shows
-        })
-
-    response = {
-        "count": len(data),
-        "data": data
-    }
+    # Ranked, limited substring search backed by the trigram indexes
+    matching_venues = search_names(Venue, search_term)
+
+    # Fetch the upcoming show counts of every match in one batched query
+    counts = upcoming_show_counts_by_venue(venue.id for venue in matching_venues)
+    response = search_results(matching_venues, counts)
 
     return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
+@app.route('/search')
+@replica_reads
+def search():
+    """Search venues and artists by name, genre, city, state and seeking description"""
+    search_term = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+
+    results = full_text_search(search_term, page=page)
+
+    return render_template('pages/search.html', results=results, search_term=search_term)
+
+
 @app.route('/venues/<int:venue_id>')
+@replica_reads
+@conditional(lambda venue_id: venue_page_validators(venue_id, salt=app.config['PAGE_VERSION']))
+@response_cache.cached(tags=lambda venue_id: [f'venue:{venue_id}'])
 def show_venue(venue_id):
     # shows the venue page with the given venue_id
-    # Fetch the venue data using venue_id
-    venue = Venue.query.get(venue_id)
-    if not venue:
+    # Fetch the venue, its genres and its shows split around a single "now"
+    loaded = load_venue_with_shows(venue_id)
+    if not loaded:
         # Render a 404 page if the venue is not found
         abort(404)
-
-    # Fetch past shows and upcoming shows for the venue
-    past_shows_query = db.session.query(Show).join(Artist).filter(Show.venue_id == venue_id).filter(
-        Show.start_time < datetime.now()).all()
-    upcoming_shows_query = db.session.query(Show).join(Artist).filter(Show.venue_id == venue_id).filter(
-        Show.start_time > datetime.now()).all()
+    venue, past_shows_query, upcoming_shows_query = loaded
 
     past_shows = [{
-        "artist_id": show.artist.id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        "start_time": str(show.start_time)
+        "artist_id": show.artist_id,
+        "artist_name": show.artist_name,
+        "artist_image_link": show.artist_image_link,
+        "start_time": show.start_time
     } for show in past_shows_query]
 
     upcoming_shows = [{
-        "artist_id": show.artist.id,
-        "artist_name": show.artist.name,
-        "artist_image_link": show.artist.image_link,
-        "start_time": str(show.start_time)
+        "artist_id": show.artist_id,
+        "artist_name": show.artist_name,
+        "artist_image_link": show.artist_image_link,
+        "start_time": show.start_time
     } for show in upcoming_shows_query]
 
     # Construct the data dictionary for the venue
@@ -182,10 +220,9 @@ def create_venue_submission():
     try:
         form = VenueForm(request.form)
         if form.validate():
-            genre_names = form.genres.data  # Assuming this is a list of genre names
             new_venue = Venue(
                 name=request.form['name'],
-                genres=Genre.query.filter(Genre.name.in_(genre_names)).all(),
+                genres=form.genre_catalog.instances(db.session, form.genres.data),
                 address=request.form['address'],
                 city=request.form['city'],
                 state=request.form['state'],
@@ -199,18 +236,16 @@ def create_venue_submission():
 
             db.session.add(new_venue)
             db.session.commit()
+            response_cache.invalidate('home', 'venues')
             flash('Venue ' + request.form['name'] + ' was successfully listed!')
         else:
             flash('An error occurred. Venue could not be listed. Check form data.')
 
     except Exception as e:
         db.session.rollback()
-        print("Error: ", str(e))  # Debugging
+        app.logger.exception('Could not create venue %r', request.form.get('name'))
         flash('An error occurred. Venue could not be listed. Error: ' + str(e))
 
-    finally:
-        db.session.close()
-
     return render_template('pages/home.html')
 
 
@@ -225,11 +260,17 @@ def delete_venue(venue_id):
             flash(f'No venue found with id {venue_id}')
             return jsonify({'success': False}), 404
 
+        # Find the artist pages to drop from the cache while the venue's shows still exist
+        artist_ids = [show.artist_id for show in venue_to_delete.shows]
+
         # Delete the venue
         db.session.delete(venue_to_delete)
 
         # Commit the changes to the database
         db.session.commit()
+        response_cache.invalidate('home', 'venues', 'shows', f'venue:{venue_id}', calendar_tag('venue', venue_id),
+                                  *[f'artist:{artist_id}' for artist_id in artist_ids],
+                                  *[calendar_tag('artist', artist_id) for artist_id in artist_ids])
 
         # Flash a success message
         flash('Venue was successfully deleted!')
@@ -241,17 +282,15 @@ def delete_venue(venue_id):
         # Flash an error message
         flash('An error occurred. Venue could not be deleted.')
 
-    finally:
-        # Close the session
-        db.session.close()
-
-        # Redirect the user to the homepage (for the bonus challenge)
+    # Redirect the user to the homepage (for the bonus challenge)
     return redirect(url_for('index'))
 
 
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists')
+@replica_reads
+@response_cache.cached(tags=['artists'])
 def artists():
     artists = Artist.query.all()
     data = [{
@@ -264,52 +303,43 @@ def artists():
 
 
 @app.route('/artists/search', methods=['POST'])
+@replica_reads
 def search_artists():
     search_term = request.form.get('search_term', '')
 
-    # Using ilike for case-insensitive search
-    matching_artists = Artist.query.filter(Artist.name.ilike(f"%{search_term}%")).all()
-
-    response = {
-        "count": len(matching_artists),
-        "data": [{
-            "id": artist.id,
-            "name": artist.name,
-            # Assuming you have a method or property to get the number of upcoming shows for an artist
-            "num_upcoming_shows": artist.num_upcoming_shows,
-        } for artist in matching_artists]
-    }
+    matching_artists = search_names(Artist, search_term)
+
+    counts = upcoming_show_counts_by_artist(artist.id for artist in matching_artists)
+    response = search_results(matching_artists, counts)
 
     return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 
 @app.route('/artists/<int:artist_id>')
+@replica_reads
+@conditional(lambda artist_id: artist_page_validators(artist_id, salt=app.config['PAGE_VERSION']))
+@response_cache.cached(tags=lambda artist_id: [f'artist:{artist_id}'])
 def show_artist(artist_id):
     # shows the artist page with the given artist_id
-    # Fetch the artist data using artist_id
-    artist = Artist.query.get(artist_id)
-    if not artist:
+    # Fetch the artist, its genres and its shows split around a single "now"
+    loaded = load_artist_with_shows(artist_id)
+    if not loaded:
         # Render a 404 page if the artist is not found
         abort(404)
-
-    # Fetch past shows and upcoming shows for the artist
-    past_shows_query = db.session.query(Show).join(Venue).filter(Show.artist_id == artist_id).filter(
-        Show.start_time < datetime.now()).all()
-    upcoming_shows_query = db.session.query(Show).join(Venue).filter(Show.artist_id == artist_id).filter(
-        Show.start_time > datetime.now()).all()
+    artist, past_shows_query, upcoming_shows_query = loaded
 
     past_shows = [{
-        "venue_id": show.venue.id,
-        "venue_name": show.venue.name,
-        "venue_image_link": show.venue.image_link,
-        "start_time": str(show.start_time)
+        "venue_id": show.venue_id,
+        "venue_name": show.venue_name,
+        "venue_image_link": show.venue_image_link,
+        "start_time": show.start_time
     } for show in past_shows_query]
 
     upcoming_shows = [{
-        "venue_id": show.venue.id,
-        "venue_name": show.venue.name,
-        "venue_image_link": show.venue.image_link,
-        "start_time": str(show.start_time)
+        "venue_id": show.venue_id,
+        "venue_name": show.venue_name,
+        "venue_image_link": show.venue_image_link,
+        "start_time": show.start_time
     } for show in upcoming_shows_query]
 
     # Construct the data dictionary for the artist
@@ -347,7 +377,7 @@ def edit_artist(artist_id):
     if artist_query:
         # Populate the form with values from the artist
         form.name.data = artist_query.name
-        form.genres.data = artist_query.genres
+        form.genres.data = [genre.name for genre in artist_query.genres]
         form.city.data = artist_query.city
         form.state.data = artist_query.state
         form.phone.data = artist_query.phone
@@ -361,7 +391,7 @@ def edit_artist(artist_id):
         artist = {
             "id": artist_query.id,
             "name": artist_query.name,
-            "genres": artist_query.genres,
+            "genres": form.genres.data,
             "city": artist_query.city,
             "state": artist_query.state,
             "phone": artist_query.phone,
@@ -387,13 +417,22 @@ def edit_artist_submission(artist_id):
         flash('Artist with ID {} not found.'.format(artist_id))
         return redirect(url_for('index'))
 
+    # instances() only knows the catalog's genres, reject anything else before changing the artist
+    catalog = genre_catalog()
+    genres = request.form.getlist('genres')
+    unknown_genres = catalog.unknown(genres)
+    if unknown_genres:
+        flash('Invalid genre(s): {}. Artist {} could not be updated.'.format(
+            ', '.join(sorted(unknown_genres)), artist.name))
+        return redirect(url_for('edit_artist', artist_id=artist_id))
+
     try:
         # Update the artist's attributes with values from the form
         artist.name = request.form['name']
         artist.city = request.form['city']
         artist.state = request.form['state']
         artist.phone = request.form['phone']
-        artist.genres = request.form.getlist('genres')
+        artist.genres = catalog.instances(db.session, genres)
         artist.facebook_link = request.form['facebook_link']
         artist.image_link = request.form['image_link']
         artist.website_link = request.form['website_link']
@@ -402,13 +441,12 @@ def edit_artist_submission(artist_id):
 
         # Commit the changes to the database
         db.session.commit()
+        invalidate_artist_pages(artist_id)
         flash('Artist {} was successfully updated!'.format(artist.name))
 
     except Exception:
         db.session.rollback()
         flash('An error occurred. Artist {} could not be updated.'.format(artist.name))
-    finally:
-        db.session.close()
 
     return redirect(url_for('show_artist', artist_id=artist_id))
 
@@ -424,7 +462,7 @@ def edit_venue(venue_id):
     if venue_query:
         # Populate the form with values from the venue
         form.name.data = venue_query.name
-        form.genres.data = venue_query.genres
+        form.genres.data = [genre.name for genre in venue_query.genres]
         form.address.data = venue_query.address
         form.city.data = venue_query.city
         form.state.data = venue_query.state
@@ -439,7 +477,7 @@ def edit_venue(venue_id):
         venue = {
             "id": venue_query.id,
             "name": venue_query.name,
-            "genres": venue_query.genres,
+            "genres": form.genres.data,
             "address": venue_query.address,
             "city": venue_query.city,
             "state": venue_query.state,
@@ -466,10 +504,19 @@ def edit_venue_submission(venue_id):
         flash(f'Error: Venue with ID {venue_id} not found.')
         return redirect(url_for('index'))
 
+    # instances() only knows the catalog's genres, reject anything else before changing the venue
+    catalog = genre_catalog()
+    genres = request.form.getlist('genres')
+    unknown_genres = catalog.unknown(genres)
+    if unknown_genres:
+        flash(f'Invalid genre(s): {", ".join(sorted(unknown_genres))}. '
+              f'Venue {venue_to_update.name} could not be updated.')
+        return redirect(url_for('edit_venue', venue_id=venue_id))
+
     try:
         # Update the venue's attributes with the form data
         venue_to_update.name = request.form['name']
-        venue_to_update.genres = request.form.getlist('genres')
+        venue_to_update.genres = catalog.instances(db.session, genres)
         venue_to_update.address = request.form['address']
         venue_to_update.city = request.form['city']
         venue_to_update.state = request.form['state']
@@ -482,6 +529,7 @@ def edit_venue_submission(venue_id):
 
         # Commit the changes to the database
         db.session.commit()
+        invalidate_venue_pages(venue_id)
 
         flash(f'Venue {venue_to_update.name} was successfully updated!')
 
@@ -490,9 +538,6 @@ def edit_venue_submission(venue_id):
         db.session.rollback()
         flash(f'An error occurred. Venue {venue_to_update.name} could not be updated.')
 
-    finally:
-        db.session.close()
-
     return redirect(url_for('show_venue', venue_id=venue_id))
 
 
@@ -508,20 +553,16 @@ def create_artist_form():
 @app.route('/artists/create', methods=['POST'])
 def create_artist_submission():
     form = ArtistForm(request.form)  # Create an instance of ArtistForm with form data
-    print('Form submitted:', form.is_submitted())
-    print('Form validated:', form.validate())
-    print('Form errors:', form.errors)
 
     if form.validate_on_submit():  # Validate the form data
         try:
             # Create a new Artist object using the validated data
-            genre_names = form.genres.data  # Assuming this is a list of genre names
             new_artist = Artist(
                 name=request.form['name'],
                 city=request.form['city'],
                 state=request.form['state'],
                 phone=request.form['phone'],
-                genres=Genre.query.filter(Genre.name.in_(genre_names)).all(),
+                genres=form.genre_catalog.instances(db.session, form.genres.data),
                 facebook_link=request.form['facebook_link'],
                 image_link=request.form['image_link'],
                 website_link=request.form['website_link'],
@@ -530,13 +571,14 @@ def create_artist_submission():
             )
             db.session.add(new_artist)
             db.session.commit()
+            response_cache.invalidate('home', 'artists')
             flash('Artist ' + form.name.data + ' was successfully listed!')
         except Exception as e:
             db.session.rollback()
+            app.logger.exception('Could not create artist %r', form.name.data)
             flash('An error occurred. Artist ' + form.name.data + ' could not be listed. Error: ' + str(e))
-        finally:
-            db.session.close()
     else:
+        app.logger.info('Invalid artist form: %s', form.errors)
         flash('An error occurred. Check your form inputs.')
 
     return render_template('pages/home.html', form=form)
@@ -546,22 +588,50 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows')
+@replica_reads
+@response_cache.cached(tags=['shows'])
 def shows():
-    # displays list of shows at /shows
-    # Query all shows from the database
-    shows_query = Show.query.all()
+    """List shows one keyset page at a time
+
+    Accepts ?cursor= from the previous page, ?limit=, ?when=upcoming|past
+    and ?from= / ?to= dates.
+    """
+    page_size = min(
+        request.args.get('limit', app.config['SHOWS_PAGE_SIZE'], type=int),
+        app.config['SHOWS_MAX_PAGE_SIZE']
+    )
+    when = request.args.get('when')
+    # Offsets are converted, show times are naive UTC
+    start = request.args.get('from', type=naive_utc)
+    end = request.args.get('to', type=naive_utc)
+
+    page = shows_page(
+        cursor=request.args.get('cursor'),
+        page_size=max(page_size, 1),
+        when=when if when in ('upcoming', 'past') else None,
+        start=start,
+        end=end,
+    )
 
-    # Construct the data for each show
+    # Venue and artist columns were eager loaded with the page, no lazy loads here
     data = [{
         "venue_id": show.venue.id,
         "venue_name": show.venue.name,
         "artist_id": show.artist.id,
         "artist_name": show.artist.name,
         "artist_image_link": show.artist.image_link,
-        "start_time": str(show.start_time)
-    } for show in shows_query]
+        "start_time": show.start_time
+    } for show in page.shows]
+    for show, label in zip(data, format_datetimes([show["start_time"] for show in data], 'full')):
+        show["start_time_label"] = label
+
+    next_url = None
+    if page.next_cursor:
+        args = request.args.to_dict()
+        args['cursor'] = page.next_cursor
+        next_url = url_for('shows', **args)
 
-    return render_template('pages/shows.html', shows=data)
+    return render_template('pages/shows.html', shows=data, next_url=next_url)
 
 
 @app.route('/shows/create')
@@ -577,21 +647,26 @@ def create_show_submission():
 
     if form.validate_on_submit():  # Validate the form data
         try:
-            # Create a new Show object using the validated data
-            new_show = Show(
-                venue_id=request.form['venue_id'],
-                artist_id=request.form['artist_id'],
-                start_time=request.form['start_time'],
-            )
-            db.session.add(new_show)
-            db.session.commit()
-            flash('Show was successfully listed!')
+            # Same checks as a bulk upload: the venue and artist must exist
+            result = schedule_shows(db.session.connection(), [{
+                'venue_id': form.venue_id.data,
+                'artist_id': form.artist_id.data,
+                'start_time': form.start_time.data,
+            }])
+            if result.errors:
+                db.session.rollback()
+                messages = '; '.join(f'{field} {message}' for field, message in result.errors[0].errors.items())
+                flash('An error occurred. Show could not be listed: ' + messages)
+            else:
+                db.session.commit()
+                mark_primary_write()
+                invalidate_scheduled_pages(result)
+                flash('Show was successfully listed!')
         except Exception as e:
             db.session.rollback()
             flash('An error occurred. Show could not be listed. Error: ' + str(e))
-        finally:
-            db.session.close()
     else:
+        app.logger.info('Invalid show form: %s', form.errors)
         flash('An error occurred. Check your form inputs.')
 
     return render_template('pages/home.html', form=form)  # Ensure the correct template is used
@@ -599,24 +674,23 @@ def create_show_submission():
 
 @app.errorhandler(404)
 def not_found_error(error):
+    if is_api_request():
+        return json_error(error)
     return render_template('errors/404.html'), 404
 
 
+@app.errorhandler(405)
+def method_not_allowed_error(error):
+    if is_api_request():
+        return json_error(error)
+    return error
+
+
 @app.errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
 
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter('%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 # ----------------------------------------------------------------------------#
 # Launch.
 # ----------------------------------------------------------------------------#
@@ -0,0 +1,92 @@
+# ----------------------------------------------------------------------------#
+# Datetime filter microbenchmark.
+#
+# Formats the start times of a synthetic show list (see generate_data.py)
+# the way the pages used to, str() then dateutil and Babel on every call,
+# and with formatting.py: the filter on datetimes with a cold and a warm
+# cache, and format_datetimes() for the whole list.
+#
+#   python -m benchmarks.datetime_filter --shows 10000
+#
+# Every variant must produce the same strings, the run fails otherwise.
+# ----------------------------------------------------------------------------#
+import argparse
+import sys
+import time
+from datetime import datetime
+
+import babel.dates
+import dateutil.parser
+
+from benchmarks.generate_data import generate_records, parse_size
+from formatting import datetime_formatter, format_datetime, format_datetimes
+
+
+def legacy_format_datetime(value, format='medium'):
+    """The filter before formatting.py, kept as the baseline"""
+    date = dateutil.parser.parse(value)
+    if format == 'full':
+        format = "EEEE MMMM, d, y 'at' h:mma"
+    elif format == 'medium':
+        format = "EE MM, dd, y h:mma"
+    return babel.dates.format_datetime(date, format, locale='en')
+
+
+def show_start_times(shows, seed):
+    return [
+        datetime.strptime(record['start_time'], '%Y-%m-%dT%H:%M:%S.000Z')
+        for section, record in generate_records(shows, seed=seed)
+        if section == 'shows'
+    ]
+
+
+def best_of(repeat, function, setup=None):
+    """Fastest of repeat runs of function() in seconds, and its result"""
+    best, result = None, None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the old and the cached datetime filter.')
+    parser.add_argument('--shows', type=parse_size, default='10000',
+                        help='number of show start times to format, or a preset: 1k, 100k, 1m (default: 10000)')
+    parser.add_argument('--format', default='full', help='filter format (default: full)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per variant, the fastest counts (default: 5)')
+    args = parser.parse_args()
+
+    values = show_start_times(args.shows, args.seed)
+    strings = [str(value) for value in values]
+    print(f'{len(values)} start times, {len(set(values))} distinct, format {args.format!r}')
+
+    variants = [
+        ('legacy filter on str()', lambda: [legacy_format_datetime(value, args.format) for value in strings], None),
+        ('filter, cold cache', lambda: [format_datetime(value, args.format) for value in values],
+         datetime_formatter.cache_clear),
+        ('filter, warm cache', lambda: [format_datetime(value, args.format) for value in values], None),
+        ('format_datetimes, cold cache', lambda: format_datetimes(values, args.format),
+         datetime_formatter.cache_clear),
+    ]
+
+    expected = None
+    baseline = None
+    print(f'{"variant":<32}{"total ms":>10}{"us/value":>10}{"speedup":>9}')
+    for name, function, setup in variants:
+        seconds, result = best_of(args.repeat, function, setup)
+        if expected is None:
+            expected, baseline = result, seconds
+        elif result != expected:
+            print(f'{name} formatted differently from the legacy filter', file=sys.stderr)
+            sys.exit(1)
+        print(f'{name:<32}{seconds * 1000:>10.1f}{seconds / len(values) * 1e6:>10.2f}{baseline / seconds:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# ----------------------------------------------------------------------------#
+# Synthetic data generator.
+#
+# Scales initial_data.json shaped data to any number of shows, with one
+# venue and one artist per ten shows. Venue and artist popularity is skewed
+# so a few of them have many shows, and start times span two years back and
+# one year ahead of today so both past and upcoming shows exist. Output is
+# deterministic for a given --seed.
+#
+#   python -m benchmarks.generate_data --size 100k -o data/bench_100k.ndjson
+#   python populate_db.py --path data/bench_100k.ndjson
+#
+# Records are generated lazily and written as NDJSON, so even the 1M show
+# preset runs in constant memory.
+# ----------------------------------------------------------------------------#
+import argparse
+import json
+import random
+import sys
+from datetime import datetime, timedelta
+
+from config import INITIAL_DATA_PATH
+
+SIZES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1m': 1000000,
+}
+
+SHOWS_PER_ENTITY = 10
+
+CITIES = (
+    ('San Francisco', 'CA'), ('Los Angeles', 'CA'), ('New York', 'NY'), ('Brooklyn', 'NY'),
+    ('Chicago', 'IL'), ('Austin', 'TX'), ('Houston', 'TX'), ('Seattle', 'WA'), ('Portland', 'OR'),
+    ('Denver', 'CO'), ('Nashville', 'TN'), ('Memphis', 'TN'), ('New Orleans', 'LA'), ('Atlanta', 'GA'),
+    ('Miami', 'FL'), ('Boston', 'MA'), ('Philadelphia', 'PA'), ('Detroit', 'MI'), ('Minneapolis', 'MN'),
+    ('Washington', 'DC'),
+)
+
+ADJECTIVES = (
+    'Blue', 'Golden', 'Velvet', 'Electric', 'Rusty', 'Silver', 'Midnight', 'Crimson', 'Wild', 'Lucky',
+    'Hollow', 'Neon', 'Little', 'Grand', 'Broken', 'Paper', 'Sunset', 'Copper', 'Quiet', 'Loud',
+)
+VENUE_NOUNS = (
+    'Hall', 'Lounge', 'Room', 'Tavern', 'Club', 'Theater', 'Garden', 'Cellar', 'Ballroom', 'Bar',
+    'Saloon', 'Stage', 'Loft', 'Barn', 'Parlor',
+)
+ARTIST_NOUNS = (
+    'Foxes', 'Pianos', 'Horns', 'Wolves', 'Strings', 'Saints', 'Ramblers', 'Drifters', 'Echoes', 'Owls',
+    'Sparrows', 'Brothers', 'Sisters', 'Kings', 'Machines',
+)
+STREETS = ('Folsom Street', 'Delancey Street', 'Main Street', 'Market Street', 'Broadway', 'Elm Street', 'Pine Street')
+
+
+def _skewed_id(rng, count):
+    """Id in 1..count, low ids are much more likely (a few busy venues and artists, a long tail)"""
+    return int(count * rng.random() ** 2) + 1
+
+
+def _phone(rng):
+    return f'{rng.randint(200, 999)}-{rng.randint(100, 999)}-{rng.randint(1000, 9999)}'
+
+
+def _name(rng, nouns, entity_id):
+    # The id keeps names unique, the words make them searchable
+    return f'The {rng.choice(ADJECTIVES)} {rng.choice(nouns)} {entity_id}'
+
+
+def generate_records(shows, seed=0, genres=None, now=None):
+    """(section, record) pairs for the given number of shows, in loading order"""
+    rng = random.Random(seed)
+    now = (now or datetime.utcnow()).replace(minute=0, second=0, microsecond=0)
+    if genres is None:
+        with open(INITIAL_DATA_PATH) as f:
+            genres = json.load(f)['genres']
+    genre_ids = [genre['id'] for genre in genres]
+    entities = max(shows // SHOWS_PER_ENTITY, 1)
+
+    for genre in genres:
+        yield 'genres', genre
+
+    for venue_id in range(1, entities + 1):
+        city, state = rng.choice(CITIES)
+        name = _name(rng, VENUE_NOUNS, venue_id)
+        seeking_talent = rng.random() < 0.5
+        yield 'venues', {
+            'id': venue_id,
+            'name': name,
+            'address': f'{rng.randint(1, 9999)} {rng.choice(STREETS)}',
+            'city': city,
+            'state': state,
+            'phone': _phone(rng),
+            'website_link': f'https://www.venue{venue_id}.example.com',
+            'facebook_link': f'https://www.facebook.com/venue{venue_id}',
+            'seeking_talent': seeking_talent,
+            'seeking_description': f'{name} is looking for local acts.' if seeking_talent else '',
+            'image_link': f'https://images.example.com/venues/{venue_id}.jpg',
+            'genres': rng.sample(genre_ids, rng.randint(1, 4)),
+        }
+
+    for artist_id in range(1, entities + 1):
+        city, state = rng.choice(CITIES)
+        seeking_venue = rng.random() < 0.5
+        yield 'artists', {
+            'id': artist_id,
+            'name': _name(rng, ARTIST_NOUNS, artist_id),
+            'city': city,
+            'state': state,
+            'phone': _phone(rng),
+            'website_link': f'https://www.artist{artist_id}.example.com',
+            'facebook_link': f'https://www.facebook.com/artist{artist_id}',
+            'seeking_venue': seeking_venue,
+            'seeking_description': f'Looking for shows in {city}!' if seeking_venue else '',
+            'image_link': f'https://images.example.com/artists/{artist_id}.jpg',
+            'genres': rng.sample(genre_ids, rng.randint(1, 3)),
+        }
+
+    for _ in range(shows):
+        start_time = now + timedelta(days=rng.randint(-730, 365), hours=rng.randint(-6, 6))
+        yield 'shows', {
+            'venue_id': _skewed_id(rng, entities),
+            'artist_id': _skewed_id(rng, entities),
+            'start_time': start_time.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+        }
+
+
+def parse_size(value):
+    """Number of shows of a preset name (1k, 100k, 1m) or a plain integer"""
+    if value.lower() in SIZES:
+        return SIZES[value.lower()]
+    try:
+        return int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'size must be one of {", ".join(SIZES)} or a number of shows')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate initial_data.json shaped NDJSON of any size.')
+    parser.add_argument('--size', type=parse_size, default='1k',
+                        help=f'number of shows, or a preset: {", ".join(SIZES)} (default: 1k)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    parser.add_argument('-o', '--output', help='output file (default: standard output)')
+    args = parser.parse_args()
+
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for section, record in generate_records(args.size, seed=args.seed):
+            output.write(json.dumps({'section': section, 'record': record}) + '\n')
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,321 @@
+# ----------------------------------------------------------------------------#
+# Response and fragment cache.
+#
+# Entries are stored together with the versions of the tags they depend on
+# (e.g. "venue:3", "shows"). Invalidating a tag bumps its version, so every
+# entry built against the old version misses on its next read. Backends only
+# need get / set / delete / incr, which keeps the in-process LRU and the
+# Redis-compatible backend interchangeable.
+#
+# With read replicas, a request may read data older than the tag versions
+# it sees. Values read from a replica are therefore not stored while one of
+# their tags was invalidated less than DB_REPLICA_PIN_SECONDS ago.
+# ----------------------------------------------------------------------------#
+import functools
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from datetime import timezone
+
+from flask import current_app, g, has_app_context, has_request_context, make_response, request, session
+
+DEFAULT_TTL = 300
+DEFAULT_MAX_ENTRIES = 1024
+
+
+class NullCache:
+    """Backend that stores nothing, every read is a miss"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def get_counters(self, keys):
+        return [0 for key in keys]
+
+    def clear(self):
+        pass
+
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with a TTL per entry
+
+    Tag counters are kept outside the LRU: an evicted counter would restart
+    at zero and make entries it had invalidated valid again.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, default_ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires <= self.clock():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        with self.lock:
+            self.entries[key] = (self.clock() + ttl if ttl else None, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+    def get_counters(self, keys):
+        with self.lock:
+            return [self.counters.get(key, 0) for key in keys]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.counters.clear()
+
+
+class RedisCache:
+    """Backend for any client with the redis-py get / set(ex=) / delete / incr / mget interface"""
+
+    def __init__(self, client, prefix='fyyur:', default_ttl=DEFAULT_TTL):
+        self.client = client
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def incr(self, key):
+        return self.client.incr(self.prefix + key)
+
+    def get_counters(self, keys):
+        if not keys:
+            return []
+        return [int(value or 0) for value in self.client.mget([self.prefix + key for key in keys])]
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+def _replica_lag_seconds():
+    """How long a replica may serve data older than an invalidation, 0 without replicas"""
+    if not has_app_context():
+        return 0
+    router = current_app.extensions.get('replica_router')
+    return router.pin_seconds if router is not None and router.binds else 0
+
+
+def backend_from_config(config):
+    cache_type = config.get('CACHE_TYPE', 'lru')
+    ttl = config.get('CACHE_DEFAULT_TTL', DEFAULT_TTL)
+
+    if cache_type == 'lru':
+        return LRUCache(max_entries=config.get('CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES), default_ttl=ttl)
+    if cache_type == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('CACHE_TYPE = "redis" requires the redis package (pip install redis)')
+        return RedisCache(redis.Redis.from_url(config['CACHE_REDIS_URL']),
+                          prefix=config.get('CACHE_KEY_PREFIX', 'fyyur:'), default_ttl=ttl)
+    if cache_type == 'null':
+        return NullCache()
+    raise ValueError(f'Unknown CACHE_TYPE {cache_type!r}')
+
+
+class ResponseCache:
+    """Tag-invalidated cache for whole responses (cached()) and fragments (get_or_set())"""
+
+    def __init__(self, app=None, backend=None):
+        self.backend = backend
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if self.backend is None:
+            self.backend = backend_from_config(app.config)
+        app.extensions['response_cache'] = self
+
+    def _tag_versions(self, tags):
+        tags = sorted(set(tags))
+        return tuple(zip(tags, self.backend.get_counters(['tag:' + tag for tag in tags])))
+
+    def get(self, key, tags):
+        entry = self.backend.get(key)
+        if entry is not None:
+            versions, value = entry
+            if versions == self._tag_versions(tags):
+                return value
+        return None
+
+    def set(self, key, tags, value, ttl=None, versions=None):
+        versions = self._tag_versions(tags) if versions is None else versions
+        self.backend.set(key, (versions, value), ttl)
+
+    def get_or_set(self, key, tags, producer, ttl=None):
+        """Cached value of key, or producer() stored against the current versions of tags"""
+        versions = self._tag_versions(tags)
+        entry = self.backend.get(key)
+        if entry is not None and entry[0] == versions:
+            return entry[1]
+
+        # Versions are read before producing so an invalidation that races with us wins
+        value = producer()
+        if self.storable(tags):
+            self.set(key, tags, value, ttl=ttl, versions=versions)
+        return value
+
+    def get_or_set_many(self, entries, producer, ttl=None):
+        """{key: value} of entries ({key: tags}), the missing ones from a single producer(missing keys) call
+
+        producer returns {key: value}, keys it leaves out are neither cached
+        nor in the result. The tag versions of all keys are read at once.
+        """
+        tags = sorted(set().union(*entries.values()))
+        counters = dict(zip(tags, self.backend.get_counters(['tag:' + tag for tag in tags])))
+        versions = {key: tuple((tag, counters[tag]) for tag in sorted(set(entry_tags)))
+                    for key, entry_tags in entries.items()}
+
+        values, missing = {}, []
+        for key in entries:
+            entry = self.backend.get(key)
+            if entry is not None and entry[0] == versions[key]:
+                values[key] = entry[1]
+            else:
+                missing.append(key)
+
+        if missing:
+            produced = producer(missing)
+            for key, value in produced.items():
+                if self.storable(entries[key]):
+                    self.set(key, entries[key], value, ttl=ttl, versions=versions[key])
+            values.update(produced)
+        return values
+
+    def invalidate(self, *tags):
+        lag = _replica_lag_seconds()
+        for tag in set(tags):
+            self.backend.incr('tag:' + tag)
+            if lag:
+                self.backend.set('recent:' + tag, True, lag)
+
+    def storable(self, tags):
+        """False if the current request read from a replica that may not have the latest change to tags yet"""
+        if not has_request_context() or g.get('replica_engine') is None:
+            return True
+        return not any(self.backend.get('recent:' + tag) for tag in set(tags))
+
+    def clear(self):
+        self.backend.clear()
+
+    def cached(self, tags, ttl=None):
+        """Cache the 200 responses of a GET view, keyed by endpoint, view args and query string
+
+        tags is a list of tags or a function of the view args returning one.
+        Requests with pending flash messages bypass the cache because the
+        page would render them.
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**view_args):
+                if request.method != 'GET' or '_flashes' in session:
+                    return view(**view_args)
+
+                entry_tags = tags(**view_args) if callable(tags) else tags
+                # Under conditional() the page version is part of the key, so a body can never
+                # be served with the ETag of newer data even if the change skipped invalidation
+                key = 'view:{}:{}:{}:{}'.format(
+                    request.endpoint,
+                    sorted(view_args.items()),
+                    sorted(request.args.items(multi=True)),
+                    g.get('page_version', ''),
+                )
+
+                versions = self._tag_versions(entry_tags)
+                entry = self.backend.get(key)
+                if entry is not None and entry[0] == versions:
+                    body, status, headers = entry[1]
+                    response = current_app.response_class(body, status=status, headers=headers)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = make_response(view(**view_args))
+                if response.status_code == 200 and not response.direct_passthrough and self.storable(entry_tags):
+                    headers = [(name, value) for name, value in response.headers if name.lower() != 'set-cookie']
+                    self.set(key, entry_tags, (response.get_data(), response.status_code, headers),
+                             ttl=ttl, versions=versions)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+
+def conditional(validators):
+    """Answer GETs of a view with 304 Not Modified when the client already has the current version
+
+    validators(**view_args) returns an object with etag and last_modified
+    (naive UTC) attributes, or None to render the view unconditionally.
+    It runs before the view, so a 304 costs only that lookup.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(**view_args):
+            if request.method != 'GET' or '_flashes' in session:
+                return view(**view_args)
+
+            current = validators(**view_args)
+            if current is None:
+                return view(**view_args)
+
+            g.page_version = current.etag
+
+            # HTTP dates have a one second resolution
+            last_modified = current.last_modified.replace(microsecond=0, tzinfo=timezone.utc)
+
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(current.etag)
+            else:
+                not_modified = bool(request.if_modified_since and last_modified <= request.if_modified_since)
+
+            response = current_app.response_class(status=304) if not_modified else make_response(view(**view_args))
+            if response.status_code in (200, 304):
+                response.set_etag(current.etag)
+                response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,122 @@
+# ----------------------------------------------------------------------------#
+# Venue and artist calendars.
+#
+# When a venue or an artist is busy (its shows) and free (the time between
+# them) over a window of dates, for booking agents looking for open dates:
+#
+#   GET /api/v1/venues/3/calendar?from=2035-01-01&to=2035-03-01
+#
+# The shows of each calendar month are cached in the response cache. The
+# months of a window missing from it are loaded with one range query over
+# their span, so a warm month view runs no query at all. A month is tagged
+# "calendar:venue:3:2035-01" and scheduling a show invalidates only the
+# months it overlaps, deleting a venue invalidates every month of the
+# calendars its shows were on ("calendar:venue:3", "calendar:artist:4").
+# ----------------------------------------------------------------------------#
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+
+from models import db, Venue, Artist, Show, shows_during
+
+DEFAULT_MAX_DAYS = 366
+
+Booking = namedtuple('Booking', ['show_id', 'start_time', 'end_time', 'counterpart_id'])
+Calendar = namedtuple('Calendar', ['busy', 'free'])
+
+
+def _columns(kind):
+    """(model, key column, counterpart column) of a calendar kind"""
+    if kind == 'venue':
+        return Venue, Show.venue_id, Show.artist_id
+    return Artist, Show.artist_id, Show.venue_id
+
+
+def month_of(value):
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(month):
+    return datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def months(start, end):
+    """First days of the months overlapping [start, end)"""
+    month = month_of(start)
+    result = []
+    while month < end:
+        result.append(month)
+        month = next_month(month)
+    return result
+
+
+def calendar_tag(kind, entity_id, month=None):
+    """Tag of one month of a calendar, or of all of them without month"""
+    return f'calendar:{kind}:{entity_id}' + (f':{month:%Y-%m}' if month else '')
+
+
+def month_tags(kind, entity_id, start, end):
+    """Tags of the calendar months that a show from start to end is on"""
+    return [calendar_tag(kind, entity_id, month) for month in months(start, end)]
+
+
+def load_months(kind, entity_id, wanted):
+    """{month: [Booking]} of the wanted months from one query, {} when the entity doesn't exist"""
+    model, key, counterpart = _columns(kind)
+    if db.session.query(model.id).filter(model.id == entity_id).scalar() is None:
+        return {}
+
+    start, end = min(wanted), next_month(max(wanted))
+    rows = db.session.query(Show.id, Show.start_time, Show.end_time, counterpart) \
+        .filter(key == entity_id) \
+        .filter(shows_during(start, end, db.engine.dialect.name)) \
+        .order_by(Show.start_time, Show.id)
+
+    loaded = {month: [] for month in wanted}
+    for row in rows:
+        booking = Booking(*row)
+        # A show running past midnight at the end of a month is on both
+        for month in months(booking.start_time, booking.end_time):
+            if month in loaded:
+                loaded[month].append(booking)
+    return loaded
+
+
+def free_slots(busy, start, end):
+    """[(start, end)] of the gaps between the bookings (sorted by start_time) within [start, end)"""
+    free = []
+    cursor = start
+    for booking in busy:
+        if booking.start_time > cursor:
+            free.append((cursor, min(booking.start_time, end)))
+        cursor = max(cursor, booking.end_time)
+        if cursor >= end:
+            break
+    if cursor < end:
+        free.append((cursor, end))
+    return free
+
+
+def calendar(kind, entity_id, start, end):
+    """Calendar of the venue / artist from start to end, None if it doesn't exist"""
+    # A month is cached under the name of its tag
+    keys = {calendar_tag(kind, entity_id, month): month for month in months(start, end)}
+    entity_tag = calendar_tag(kind, entity_id)
+    cached = current_app.extensions['response_cache'].get_or_set_many(
+        {key: [entity_tag, key] for key in keys},
+        lambda missing: {
+            calendar_tag(kind, entity_id, month): bookings
+            for month, bookings in load_months(kind, entity_id, [keys[key] for key in missing]).items()
+        },
+    )
+    if len(cached) < len(keys):
+        return None
+
+    busy = {}
+    for key in keys:
+        for booking in cached[key]:
+            if booking.start_time < end and booking.end_time > start:
+                busy[booking.show_id] = booking
+    busy = sorted(busy.values(), key=lambda booking: (booking.start_time, booking.show_id))
+    return Calendar(busy, free_slots(busy, start, end))
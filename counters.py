@@ -0,0 +1,129 @@
+# ----------------------------------------------------------------------------#
+# Denormalized show counters.
+#
+# Venue and Artist carry upcoming_shows_count / past_shows_count so listings
+# never aggregate the shows table. The counters are maintained by:
+#
+#   * mapper events on Show for inserts, deletes and moved shows (models.py),
+#   * refresh_show_counters() after Core bulk loads,
+#   * `flask counters roll`, run periodically (e.g. hourly from cron), which
+#     moves shows that have started since the previous run from upcoming to
+#     past,
+#   * `flask counters check [--repair]`, which finds and fixes drift.
+#
+# A show starting exactly at "now" is upcoming, like on the detail pages.
+# ----------------------------------------------------------------------------#
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import case, func, select
+
+from models import db, Venue, Artist, Show, refresh_show_counters
+
+VENUES = Venue.__table__
+ARTISTS = Artist.__table__
+SHOWS = Show.__table__
+
+# (table, foreign key of shows pointing at it)
+COUNTED_TABLES = (
+    (VENUES, SHOWS.c.venue_id),
+    (ARTISTS, SHOWS.c.artist_id),
+)
+
+
+def roll_forward(connection, since, now=None):
+    """Move the shows that started in [since, now) from the upcoming to the past counters"""
+    now = now or datetime.utcnow()
+    started = select(SHOWS.c.venue_id, SHOWS.c.artist_id) \
+        .where(SHOWS.c.start_time >= since) \
+        .where(SHOWS.c.start_time < now)
+
+    rows = connection.execute(started).all()
+    venue_ids = {row.venue_id for row in rows}
+    artist_ids = {row.artist_id for row in rows}
+    # Recomputing rather than shifting makes overlapping runs harmless
+    refresh_show_counters(connection, venue_ids, artist_ids, now=now)
+    # Their pages moved a show from upcoming to past, Last-Modified follows updated_at
+    updated_at = datetime.utcnow()
+    for table, ids in ((VENUES, venue_ids), (ARTISTS, artist_ids)):
+        if ids:
+            connection.execute(table.update().where(table.c.id.in_(ids)).values(updated_at=updated_at))
+    return len(venue_ids), len(artist_ids)
+
+
+def find_drift(connection, now=None):
+    """(table name, id, stored (upcoming, past), actual (upcoming, past)) for every counter that is wrong"""
+    now = now or datetime.utcnow()
+    drift = []
+    for table, key in COUNTED_TABLES:
+        actual_upcoming = func.coalesce(func.sum(case((SHOWS.c.start_time >= now, 1), else_=0)), 0)
+        actual_past = func.coalesce(func.sum(case((SHOWS.c.start_time < now, 1), else_=0)), 0)
+        query = select(
+            table.c.id,
+            table.c.upcoming_shows_count,
+            table.c.past_shows_count,
+            actual_upcoming.label('actual_upcoming'),
+            actual_past.label('actual_past'),
+        ).select_from(table.outerjoin(SHOWS, key == table.c.id)) \
+            .group_by(table.c.id, table.c.upcoming_shows_count, table.c.past_shows_count) \
+            .having((table.c.upcoming_shows_count != actual_upcoming) | (table.c.past_shows_count != actual_past))
+
+        for row in connection.execute(query):
+            drift.append((table.name, row.id,
+                          (row.upcoming_shows_count, row.past_shows_count),
+                          (row.actual_upcoming, row.actual_past)))
+    return drift
+
+
+def repair_drift(connection, drift, now=None):
+    venue_ids = [entity_id for table_name, entity_id, stored, actual in drift if table_name == 'venues']
+    artist_ids = [entity_id for table_name, entity_id, stored, actual in drift if table_name == 'artists']
+    refresh_show_counters(connection, venue_ids, artist_ids, now=now)
+
+
+# ----------------------------------------------------------------------------#
+# CLI.
+# ----------------------------------------------------------------------------#
+
+counters_cli = AppGroup('counters', help='Maintain the denormalized show counters.')
+
+
+@counters_cli.command('roll')
+@click.option('--since-minutes', default=65, show_default=True,
+              help='Look back this far for shows that have started, at least the interval between runs.')
+def roll_command(since_minutes):
+    """Move shows that have started from the upcoming to the past counters."""
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        venues, artists = roll_forward(connection, now - timedelta(minutes=since_minutes), now=now)
+    click.echo(f'Rolled forward the counters of {venues} venues and {artists} artists.')
+
+
+@counters_cli.command('check')
+@click.option('--repair', is_flag=True, help='Recompute every counter that has drifted.')
+def check_command(repair):
+    """Report venues and artists whose counters don't match the shows table."""
+    now = datetime.utcnow()
+    with db.engine.begin() as connection:
+        drift = find_drift(connection, now=now)
+        for table_name, entity_id, stored, actual in drift:
+            click.echo(f'{table_name} {entity_id}: stored upcoming/past {stored[0]}/{stored[1]}, '
+                       f'actual {actual[0]}/{actual[1]}')
+        if drift and repair:
+            repair_drift(connection, drift, now=now)
+
+    if not drift:
+        click.echo('All counters are consistent.')
+    elif repair:
+        click.echo(f'Repaired {len(drift)} counters.')
+    else:
+        raise SystemExit(1)
+
+
+@counters_cli.command('rebuild')
+def rebuild_command():
+    """Recompute every counter from the shows table."""
+    with db.engine.begin() as connection:
+        refresh_show_counters(connection)
+    click.echo('Rebuilt all show counters.')
@@ -0,0 +1,92 @@
+# ----------------------------------------------------------------------------#
+# Runs EXPLAIN on the query behind each route and checks the planner picks the
+# index added for it.
+#
+#   python explain_queries.py
+#
+# Exits with status 1 when an expected index isn't used. On PostgreSQL
+# sequential scans are disabled for the check so that the tiny seed data
+# doesn't make the planner prefer them.
+# ----------------------------------------------------------------------------#
+import sys
+from datetime import datetime, timedelta
+
+from sqlalchemy import desc, text
+
+from app import app
+from models import db, Artist, Venue
+from services import (
+    venue_directory_rows,
+    upcoming_show_counts_query,
+    venue_shows_query,
+    artist_shows_query,
+    shows_page_query,
+)
+from scheduling import booked_shows_query
+
+
+def route_queries():
+    """(route, query, index names the plan must mention)"""
+    now = datetime.utcnow()
+    dialect_name = db.engine.dialect.name
+    # Range indexes on PostgreSQL only
+    booking_indexes = ['ix_shows_venue_id_during', 'ix_shows_artist_id_during'] if dialect_name == 'postgresql' \
+        else ['ix_shows_venue_id_start_time', 'ix_shows_artist_id_start_time']
+    return [
+        ('/ (venues)', Venue.query.order_by(desc(Venue.created_date)).limit(10),
+         ['ix_venues_created_date']),
+        ('/ (artists)', Artist.query.order_by(desc(Artist.created_date)).limit(10),
+         ['ix_artists_created_date']),
+        ('/venues?city=&state=', venue_directory_rows(city='San Francisco', state='CA'),
+         ['ix_venues_city_state']),
+        # Counter lookups by primary key, whose index name depends on the database
+        ('/venues/search', upcoming_show_counts_query(Venue, [1, 2, 3]), []),
+        ('/artists/search', upcoming_show_counts_query(Artist, [4, 5, 6]), []),
+        ('/venues/<id>', venue_shows_query(1),
+         ['ix_shows_venue_id_start_time']),
+        ('/artists/<id>', artist_shows_query(4),
+         ['ix_shows_artist_id_start_time']),
+        ('/shows', shows_page_query(now=now).limit(50),
+         ['ix_shows_start_time_id']),
+        ('POST /api/v1/shows', booked_shows_query([1, 2], [4, 5], now, now + timedelta(days=30), dialect_name),
+         booking_indexes),
+    ]
+
+
+def explain(connection, query):
+    statement = getattr(query, 'statement', query)
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = connection.exec_driver_sql(prefix + str(compiled), params).all()
+    # SQLite returns (id, parent, notused, detail), PostgreSQL a single text column
+    return '\n'.join(str(row[-1]) for row in rows)
+
+
+def main():
+    failures = 0
+    with app.app_context():
+        with db.engine.connect() as connection:
+            transaction = connection.begin()
+            if connection.dialect.name == 'postgresql':
+                connection.execute(text('SET LOCAL enable_seqscan = off'))
+
+            for route, query, indexes in route_queries():
+                plan = explain(connection, query)
+                missing = [index for index in indexes if index not in plan]
+                failures += bool(missing)
+
+                print(f"{'MISSING ' + ', '.join(missing) if missing else 'OK'}  {route}")
+                for line in plan.splitlines():
+                    print('    ' + line)
+
+            transaction.rollback()
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
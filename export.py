@@ -0,0 +1,159 @@
+# ----------------------------------------------------------------------------#
+# Streaming exports.
+#
+# Full dumps of shows, venues and artists as NDJSON or CSV. Rows are read
+# with a server-side cursor (stream_results, a named cursor on psycopg2)
+# one partition at a time and encoded as they arrive, so memory stays
+# constant whatever the table size. Used by /api/v1/export/<kind> and
+#
+#   flask export shows --format csv --from 2024-01-01 --city "San Francisco" -o shows.csv
+# ----------------------------------------------------------------------------#
+import csv
+import io
+import json
+from datetime import datetime
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select
+
+from models import db, Venue, Artist, Show, venue_genres, artist_genres, Genre, naive_utc
+from replicas import read_engine
+
+EXPORT_KINDS = ('shows', 'venues', 'artists')
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_BATCH_SIZE = 1000
+
+
+def _genre_names(link_table, key, entity_table, dialect_name):
+    """Correlated subquery with the comma separated genre names of each row"""
+    genres = Genre.__table__
+    if dialect_name == 'postgresql':
+        names = func.string_agg(genres.c.name, ',')
+    else:
+        names = func.group_concat(genres.c.name, ',')
+    return select(names) \
+        .select_from(link_table.join(genres, genres.c.id == link_table.c.genre_id)) \
+        .where(link_table.c[key] == entity_table.c.id) \
+        .scalar_subquery()
+
+
+def export_query(kind, start=None, end=None, city=None, dialect_name='postgresql'):
+    """Core select of one export, in primary key order
+
+    start / end bound the start_time of shows and the created_date of
+    venues and artists. city matches the venue city of shows.
+    """
+    if kind == 'shows':
+        shows, venues, artists = Show.__table__, Venue.__table__, Artist.__table__
+        query = select(
+            shows.c.id,
+            shows.c.start_time,
+            shows.c.end_time,
+            shows.c.venue_id,
+            venues.c.name.label('venue_name'),
+            venues.c.city.label('venue_city'),
+            venues.c.state.label('venue_state'),
+            shows.c.artist_id,
+            artists.c.name.label('artist_name'),
+        ).select_from(
+            shows.join(venues, shows.c.venue_id == venues.c.id).join(artists, shows.c.artist_id == artists.c.id)
+        )
+        time_column, city_column = shows.c.start_time, venues.c.city
+    else:
+        model, link_table, key = (Venue, venue_genres, 'venue_id') if kind == 'venues' \
+            else (Artist, artist_genres, 'artist_id')
+        table = model.__table__
+        columns = [column for column in table.c if column.name != 'search_vector']
+        query = select(
+            *columns,
+            _genre_names(link_table, key, table, dialect_name).label('genres'),
+        )
+        time_column, city_column = table.c.created_date, table.c.city
+
+    if start:
+        query = query.where(time_column >= start)
+    if end:
+        query = query.where(time_column < end)
+    if city:
+        query = query.where(city_column == city)
+
+    return query.order_by(query.selected_columns.id)
+
+
+def iter_export_rows(connection, query, batch_size=EXPORT_BATCH_SIZE):
+    """Rows of query fetched batch_size at a time from a server-side cursor"""
+    result = connection.execution_options(stream_results=True).execute(query)
+    for partition in result.partitions(batch_size):
+        yield from partition
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def ndjson_chunks(columns, rows, batch_size=EXPORT_BATCH_SIZE):
+    """One JSON object per line, batch_size lines per yielded chunk"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, map(_plain, row)))) + '\n')
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def csv_chunks(columns, rows, batch_size=EXPORT_BATCH_SIZE):
+    """A header line then the rows, batch_size rows per yielded chunk"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(map(_plain, row))
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_export(kind, export_format, start=None, end=None, city=None, batch_size=EXPORT_BATCH_SIZE):
+    """Generator of encoded chunks, the connection is held only while it is iterated"""
+    encode = ndjson_chunks if export_format == 'ndjson' else csv_chunks
+    with read_engine(db).connect() as connection:
+        query = export_query(kind, start=start, end=end, city=city, dialect_name=connection.dialect.name)
+        columns = list(query.selected_columns.keys())
+        yield from encode(columns, iter_export_rows(connection, query, batch_size), batch_size)
+
+
+class IsoDate(click.ParamType):
+    name = 'date'
+
+    def convert(self, value, param, ctx):
+        try:
+            # Offsets are converted, stored times are naive UTC
+            return naive_utc(value)
+        except ValueError:
+            self.fail(f'{value!r} is not an ISO 8601 date', param, ctx)
+
+
+@click.command('export')
+@click.argument('kind', type=click.Choice(EXPORT_KINDS))
+@click.option('--format', 'export_format', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson',
+              show_default=True)
+@click.option('--from', 'start', type=IsoDate(), help='Shows starting (venues / artists created) at or after.')
+@click.option('--to', 'end', type=IsoDate(), help='Shows starting (venues / artists created) before.')
+@click.option('--city', help='Only venues / artists in, or shows at a venue in, this city.')
+@click.option('--batch-size', default=EXPORT_BATCH_SIZE, show_default=True, help='Rows fetched per round trip.')
+@click.option('-o', '--output', type=click.File('w', encoding='utf-8'), default='-',
+              help='Output file, standard output by default.')
+@with_appcontext
+def export_command(kind, export_format, start, end, city, batch_size, output):
+    """Stream every row of KIND as NDJSON or CSV in constant memory."""
+    for chunk in stream_export(kind, export_format, start=start, end=end, city=city, batch_size=batch_size):
+        output.write(chunk)
@@ -7,12 +7,22 @@ from fabric.contrib.console import confirm
 def test():
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python -m pytest -q", capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def bench():
+    # Requests every route against a small synthetic SQLite database, fails on any server error
+    with settings(warn_only=True):
+        result = local(
+            "python -m benchmarks.run --size 1k --iterations 5 --warmup 1", capture=True
+        )
+    if result.failed and not confirm("Benchmark failed. Continue?"):
+        abort("Aborted at user request.")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -39,8 +49,9 @@ def heroku():
 
 
 def heroku_test():
+    # Read-only, the benchmark would recreate the production tables
     local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
+        "heroku run python explain_queries.py"
     )
 
 
@@ -0,0 +1,107 @@
+# ----------------------------------------------------------------------------#
+# Date formatting for the templates.
+#
+# Babel patterns are compiled once per (format, locale). A compiled pattern
+# remembers the text of each field per distinct value of the part of the
+# datetime it shows (12 month names, 7 weekdays, 60 minutes...), so Babel
+# only runs the first time a part is seen and the output stays Babel's.
+# Each formatter also remembers whole results, as many shows share a start
+# time. Values may be datetimes or ISO 8601 strings.
+# ----------------------------------------------------------------------------#
+import functools
+from datetime import timezone
+
+import dateutil.parser
+from babel import Locale
+from babel.dates import DateTimeFormat, parse_pattern, tokenize_pattern
+
+# Named formats of the datetime filter, anything else is used as a Babel pattern
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+# Distinct values remembered per formatter, a few pages worth of show times
+FORMATTED_CACHE_SIZE = 4096
+
+
+def _weekday(value):
+    return value.weekday()
+
+
+def _period(value):
+    return value.hour >= 12
+
+
+# Pattern fields whose text depends only on one part of the datetime, and that part. Patterns with other
+# fields (time zones, weeks, fractions of seconds...) are formatted by Babel on every call
+FIELD_PARTS = {
+    'y': lambda value: value.year,
+    'u': lambda value: value.year,
+    'M': lambda value: value.month,
+    'L': lambda value: value.month,
+    'd': lambda value: value.day,
+    'E': _weekday,
+    'e': _weekday,
+    'c': _weekday,
+    'a': _period,
+    'h': lambda value: value.hour,
+    'H': lambda value: value.hour,
+    'K': lambda value: value.hour,
+    'k': lambda value: value.hour,
+    'm': lambda value: value.minute,
+    's': lambda value: value.second,
+}
+
+
+def _field_formatter(field, part, locale):
+    texts = {}
+
+    def format_field(value):
+        key = part(value)
+        text = texts.get(key)
+        if text is None:
+            text = texts[key] = DateTimeFormat(value, locale)[field]
+        return text
+    return format_field
+
+
+def compile_pattern(pattern, locale):
+    """Function formatting a datetime with the Babel pattern in locale, like DateTimePattern.apply()"""
+    tokens = tokenize_pattern(pattern)
+    if any(kind == 'field' and value[0] not in FIELD_PARTS for kind, value in tokens):
+        parsed = parse_pattern(pattern)
+        return lambda value: parsed.apply(value, locale)
+
+    parts = [
+        value if kind == 'chars' else _field_formatter(value[0] * value[1], FIELD_PARTS[value[0]], locale)
+        for kind, value in tokens
+    ]
+    return lambda value: ''.join(part if isinstance(part, str) else part(value) for part in parts)
+
+
+@functools.lru_cache(maxsize=64)
+def datetime_formatter(format='medium', locale='en'):
+    """Function formatting a datetime with format in locale"""
+    apply = compile_pattern(DATETIME_FORMATS.get(format, format), Locale.parse(locale))
+
+    @functools.lru_cache(maxsize=FORMATTED_CACHE_SIZE)
+    def formatter(value):
+        # Babel treats naive datetimes as UTC without converting them
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return apply(value)
+    return formatter
+
+
+def format_datetime(value, format='medium', locale='en'):
+    """The datetime template filter"""
+    if isinstance(value, str):
+        value = dateutil.parser.parse(value)
+    return datetime_formatter(format, locale)(value)
+
+
+def format_datetimes(values, format='medium', locale='en'):
+    """format_datetime() of each value, e.g. the start times of a whole show list"""
+    formatter = datetime_formatter(format, locale)
+    return [formatter(dateutil.parser.parse(value) if isinstance(value, str) else value) for value in values]
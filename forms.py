@@ -4,6 +4,8 @@ from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField
 from wtforms.validators import DataRequired, AnyOf, URL
 import re
 
+from genres import genre_catalog
+
 state_choices = [
     ('AL', 'AL'),
     ('AK', 'AK'),
@@ -57,27 +59,6 @@ state_choices = [
     ('WI', 'WI'),
     ('WY', 'WY'),
 ]
-genres_choices = [
-    ('Alternative', 'Alternative'),
-    ('Blues', 'Blues'),
-    ('Classical', 'Classical'),
-    ('Country', 'Country'),
-    ('Electronic', 'Electronic'),
-    ('Folk', 'Folk'),
-    ('Funk', 'Funk'),
-    ('Hip-Hop', 'Hip-Hop'),
-    ('Heavy Metal', 'Heavy Metal'),
-    ('Instrumental', 'Instrumental'),
-    ('Jazz', 'Jazz'),
-    ('Musical Theatre', 'Musical Theatre'),
-    ('Pop', 'Pop'),
-    ('Punk', 'Punk'),
-    ('R&B', 'R&B'),
-    ('Reggae', 'Reggae'),
-    ('Rock n Roll', 'Rock n Roll'),
-    ('Soul', 'Soul'),
-    ('Other', 'Other'),
-]
 
 
 class ShowForm(Form):
@@ -87,15 +68,21 @@ class ShowForm(Form):
     venue_id = StringField(
         'venue_id'
     )
+    # Show times are naive UTC, like everywhere else
     start_time = DateTimeField(
         'start_time',
         validators=[DataRequired()],
-        default=datetime.today()
+        default=datetime.utcnow
     )
 
 
 # Base form class with common fields and validators
 class BaseForm(Form):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.genre_catalog = genre_catalog()
+        self.genres.choices = self.genre_catalog.choices
+
     def validate_phone(form, field):
         if not re.search(r"^[0-9]{3}-[0-9]{3}-[0-9]{4}$", field.data):
             raise ValidationError("Invalid phone number. should be in the format 123-456-7890")
@@ -107,10 +94,8 @@ class BaseForm(Form):
                 raise ValidationError('Invalid Facebook URL. Please enter a valid Facebook link.')
 
     def validate_genres(form, field):
-        genres_values = [choice[1] for choice in genres_choices]
-        for value in field.data:
-            if value not in genres_values:
-                raise ValidationError('Invalid genres value.')
+        if form.genre_catalog.unknown(field.data):
+            raise ValidationError('Invalid genres value.')
 
     name = StringField('name', validators=[DataRequired()])
     city = StringField('city', validators=[DataRequired()])
@@ -122,9 +107,10 @@ class BaseForm(Form):
         'phone', validators=[DataRequired()]
     )
     image_link = StringField('image_link')
+    # Choices come from the genre catalog, validate_genres checks them against its set of names
     genres = SelectMultipleField(
         'genres', validators=[DataRequired()],
-        choices=genres_choices
+        choices=[], validate_choice=False
     )
     facebook_link = StringField(
         'facebook_link', validators=[URL()]
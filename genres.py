@@ -0,0 +1,107 @@
+# ----------------------------------------------------------------------------#
+# Genre catalog.
+#
+# The genres table is small and rarely changes, so every process keeps it in
+# memory: a frozenset of names to validate form input against, name / id maps
+# and the form choices. Handlers turn names into Genre instances without a
+# query. The catalog is reloaded after a commit that changed a genre through
+# the ORM, after the bulk loaders wrote, and once it is older than
+# GENRE_CATALOG_MAX_AGE seconds, which bounds how long a change made by
+# another process goes unseen.
+# ----------------------------------------------------------------------------#
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import db, Genre
+
+DEFAULT_MAX_AGE = 300
+
+
+class GenreCatalog:
+    """Immutable snapshot of the genres table"""
+
+    def __init__(self, rows, loaded_at=None):
+        self.names_by_id = {genre_id: name for genre_id, name in rows}
+        self.ids_by_name = {name: genre_id for genre_id, name in self.names_by_id.items()}
+        self.names = frozenset(self.ids_by_name)
+        self.choices = [(name, name) for name in sorted(self.names, key=str.lower)]
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def unknown(self, names):
+        """The names that aren't genres"""
+        return set(names) - self.names
+
+    def ids(self, names):
+        """Ids of the genre names, KeyError for a name that isn't a genre"""
+        return [self.ids_by_name[name] for name in names]
+
+    def instances(self, session, names):
+        """Genre instances of the names in session, for assigning to a relationship without loading them"""
+        genres = []
+        for genre_id in self.ids(names):
+            genre = Genre(id=genre_id, name=self.names_by_id[genre_id])
+            make_transient_to_detached(genre)
+            # load=False trusts the catalog instead of SELECTing the row, an instance already in the session wins
+            genres.append(session.merge(genre, load=False))
+        return genres
+
+
+_catalogs = {}
+_lock = threading.Lock()
+
+
+def genre_catalog():
+    """The catalog of the current app's database, loaded on first use"""
+    key = str(db.engine.url)
+    max_age = current_app.config.get('GENRE_CATALOG_MAX_AGE', DEFAULT_MAX_AGE)
+    catalog = _catalogs.get(key)
+    if catalog is None or time.monotonic() - catalog.loaded_at > max_age:
+        with _lock:
+            catalog = _catalogs.get(key)
+            if catalog is None or time.monotonic() - catalog.loaded_at > max_age:
+                catalog = _catalogs[key] = GenreCatalog(db.session.query(Genre.id, Genre.name).all())
+    return catalog
+
+
+def invalidate_genre_catalog():
+    """Drop every loaded catalog so the next use reloads it"""
+    _catalogs.clear()
+
+
+# Changes become visible to other sessions at commit, reloading earlier could cache the old rows again
+
+def _on_genre_change(mapper, connection, target):
+    Session.object_session(target).info['genres_changed'] = True
+
+
+def _on_genre_update(mapper, connection, target):
+    # Also called for genres only dirty from a venues / artists backref append, which changes no catalog data
+    session = Session.object_session(target)
+    if session.is_modified(target, include_collections=False):
+        session.info['genres_changed'] = True
+
+
+event.listen(Genre, 'after_insert', _on_genre_change)
+event.listen(Genre, 'after_update', _on_genre_update)
+event.listen(Genre, 'after_delete', _on_genre_change)
+
+
+@event.listens_for(Session, 'after_commit')
+def _reload_changed_genres(session):
+    if session.info.pop('genres_changed', False):
+        invalidate_genre_catalog()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back_genres(session, previous_transaction):
+    session.info.pop('genres_changed', None)
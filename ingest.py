@@ -0,0 +1,496 @@
+# ----------------------------------------------------------------------------#
+# Bulk ingest of initial_data.json shaped records.
+#
+# Rows are written with Core executemany() batches, or with PostgreSQL's
+# COPY FROM STDIN when the connection is psycopg2. Every batch is committed
+# on its own so a large import never holds one huge transaction.
+#
+# SyncLoader applies the same records incrementally to a live database with
+# INSERT ... ON CONFLICT DO UPDATE instead.
+# ----------------------------------------------------------------------------#
+import io
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import (
+    Genre, Venue, Artist, Show, venue_genres, artist_genres, rebuild_search_vectors, refresh_show_counters,
+    DEFAULT_SHOW_DURATION, naive_utc,
+)
+from genres import invalidate_genre_catalog
+from scheduling import ShowRow, find_double_bookings
+
+# Tables in foreign key order, buffers are always flushed in this order
+TABLES = (
+    Genre.__table__,
+    Venue.__table__,
+    Artist.__table__,
+    venue_genres,
+    artist_genres,
+    Show.__table__,
+)
+
+# Tables loaded with explicit ids whose sequences must be moved past max(id)
+EXPLICIT_ID_TABLES = ('genres', 'venues', 'artists')
+
+# Top-level sections of the data file, in the order they are loaded
+SECTIONS = ('genres', 'venues', 'artists', 'shows')
+
+NDJSON_EXTENSIONS = ('.ndjson', '.jsonl')
+
+
+def parse_start_time(value):
+    """Naive UTC datetime from an ISO 8601 string such as 2019-05-21T21:30:00.000Z"""
+    return naive_utc(value)
+
+
+def genre_row(genre):
+    return {"id": genre["id"], "name": genre["name"]}
+
+
+def venue_row(venue, created_date):
+    return {
+        "id": venue["id"],
+        "name": venue["name"],
+        "address": venue["address"],
+        "city": venue["city"],
+        "state": venue["state"],
+        "phone": venue["phone"],
+        "website_link": venue.get("website_link", ""),
+        "facebook_link": venue.get("facebook_link", ""),
+        "seeking_talent": venue.get("seeking_talent", False),
+        "seeking_description": venue.get("seeking_description", ""),
+        "image_link": venue["image_link"],
+        "created_date": created_date,
+        "updated_at": created_date,
+    }
+
+
+def artist_row(artist, created_date):
+    return {
+        "id": artist["id"],
+        "name": artist["name"],
+        "city": artist["city"],
+        "state": artist["state"],
+        "phone": artist["phone"],
+        "website_link": artist.get("website_link", ""),
+        "facebook_link": artist.get("facebook_link", ""),
+        "seeking_venue": artist.get("seeking_venue", False),
+        "seeking_description": artist.get("seeking_description", ""),
+        "image_link": artist["image_link"],
+        "created_date": created_date,
+        "updated_at": created_date,
+    }
+
+
+def show_row(show, updated_at):
+    start_time = parse_start_time(show["start_time"])
+    return {
+        "venue_id": show["venue_id"],
+        "artist_id": show["artist_id"],
+        "start_time": start_time,
+        "end_time": parse_start_time(show["end_time"]) if show.get("end_time") else start_time + DEFAULT_SHOW_DURATION,
+        "updated_at": updated_at,
+    }
+
+
+# Characters with a meaning in COPY's text format, escaped in values
+_COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+
+def copy_value(value):
+    """value as a field of COPY's text format: None as \\N (NULL), other values escaped
+
+    Unlike the CSV format, this keeps NULL and the empty string apart, as executemany() does.
+    """
+    if value is None:
+        return '\\N'
+    return str(value).translate(_COPY_ESCAPES)
+
+
+class TableStats:
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.skipped = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        skipped = f', {self.skipped} skipped' if self.skipped else ''
+        return f'{self.name}: {self.rows} rows in {self.seconds:.2f}s ({self.rows_per_second:.0f} rows/s){skipped}'
+
+
+def print_progress(stats, total_rows, elapsed):
+    print(f'{stats}  [{total_rows} rows total, {elapsed:.1f}s]')
+
+
+class BulkLoader:
+    """Buffers records per table and writes them in committed batches
+
+    Feed it records with add(section, record) in any volume, then call
+    finish() to flush the remainder, reset sequences and rebuild the
+    search vectors. Returns the per-table TableStats.
+    """
+
+    # Rebuild every search vector in finish(), not only the cleared ones
+    only_missing_vectors = False
+
+    def __init__(self, connection, batch_size=5000, use_copy=None, progress=print_progress):
+        self.connection = connection
+        self.batch_size = batch_size
+        self.use_copy = connection.dialect.driver == 'psycopg2' if use_copy is None else use_copy
+        self.progress = progress
+
+        self.created_date = datetime.utcnow()
+        self.started = time.perf_counter()
+        self.buffers = {table.name: [] for table in TABLES}
+        self.stats = {table.name: TableStats(table.name) for table in TABLES}
+
+    @property
+    def total_rows(self):
+        return sum(stats.rows for stats in self.stats.values())
+
+    def add(self, section, record):
+        if section == 'genres':
+            self.buffers['genres'].append(genre_row(record))
+        elif section == 'venues':
+            self.buffers['venues'].append(venue_row(record, self.created_date))
+            self.buffers['venue_genres'].extend(
+                {"venue_id": record["id"], "genre_id": genre_id} for genre_id in record.get("genres", [])
+            )
+        elif section == 'artists':
+            self.buffers['artists'].append(artist_row(record, self.created_date))
+            self.buffers['artist_genres'].extend(
+                {"artist_id": record["id"], "genre_id": genre_id} for genre_id in record.get("genres", [])
+            )
+        elif section == 'shows':
+            self.buffers['shows'].append(show_row(record, self.created_date))
+        else:
+            raise ValueError(f'Unknown section {section!r}')
+
+        if any(len(rows) >= self.batch_size for rows in self.buffers.values()):
+            self.flush()
+
+    def pending(self, table):
+        return bool(self.buffers[table.name])
+
+    def write(self, table, rows):
+        """Write one batch of rows inside the current transaction, returns the number of rows written"""
+        if self.use_copy:
+            self._copy(table, rows)
+        else:
+            self.connection.execute(table.insert(), rows)
+        return len(rows)
+
+    def flush(self):
+        """Write every buffered row, parents before children, one transaction per table batch"""
+        for table in TABLES:
+            if not self.pending(table):
+                continue
+            rows = self.buffers[table.name]
+
+            started = time.perf_counter()
+            with self.connection.begin():
+                written = self.write(table, rows)
+
+            stats = self.stats[table.name]
+            stats.rows += written
+            stats.seconds += time.perf_counter() - started
+            self.buffers[table.name] = []
+
+            if self.progress:
+                self.progress(stats, self.total_rows, time.perf_counter() - self.started)
+
+    def _copy(self, table, rows):
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(copy_value(row[column]) for column in columns) + '\n')
+        buffer.seek(0)
+
+        cursor = self.connection.connection.cursor()
+        try:
+            cursor.copy_expert(f'COPY {table.name} ({", ".join(columns)}) FROM STDIN', buffer)
+        finally:
+            cursor.close()
+
+    def reset_sequences(self):
+        """Move the id sequences past the explicit ids that were loaded (PostgreSQL only)"""
+        if self.connection.dialect.name != 'postgresql':
+            return
+        with self.connection.begin():
+            for table_name in EXPLICIT_ID_TABLES:
+                self.connection.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), "
+                    f"coalesce(max(id), 1), max(id) IS NOT NULL) FROM {table_name}"
+                )
+
+    def finish(self):
+        self.flush()
+        self.reset_sequences()
+        with self.connection.begin():
+            # Core inserts bypass the ORM flush hook that maintains the vectors
+            rebuild_search_vectors(self.connection, only_missing=self.only_missing_vectors)
+            self.refresh_counters()
+        # Core writes don't reach the ORM events that keep the catalog current
+        invalidate_genre_catalog()
+        return list(self.stats.values())
+
+    def refresh_counters(self):
+        refresh_show_counters(self.connection)
+
+
+class SyncLoader(BulkLoader):
+    """Applies the records as a delta against the existing rows instead of loading an empty schema
+
+    Genres, venues and artists are upserted by id and only rows whose values
+    differ are updated. The genre associations of every venue and artist with
+    a "genres" key are diffed against the stored sets, records without one
+    keep theirs. Shows, which have no id in the data file, are inserted when
+    no show with the same venue, artist and start time exists yet and they
+    don't double book their venue or artist (scheduling.find_double_bookings),
+    the others are listed in double_bookings as (show row, errors).
+
+    Changed venues and artists get their search_vector cleared by the upsert,
+    finish() then rebuilds just those, and recounts the shows of the venues
+    and artists that received new ones.
+    """
+
+    only_missing_vectors = True
+
+    _link_keys = {
+        'venue_genres': 'venue_id',
+        'artist_genres': 'artist_id',
+    }
+
+    def __init__(self, connection, batch_size=5000, progress=print_progress):
+        super().__init__(connection, batch_size=batch_size, use_copy=False, progress=progress)
+        dialect_name = connection.dialect.name
+        if dialect_name == 'postgresql':
+            self.insert = postgresql.insert
+        elif dialect_name == 'sqlite':
+            self.insert = sqlite.insert
+        else:
+            raise ValueError(f'Incremental sync supports PostgreSQL and SQLite, not {dialect_name}')
+
+        # Parents whose association sets are in the current batch, even when they have no genres
+        self.link_parents = {name: set() for name in self._link_keys}
+        # Venues and artists that got new shows, recounted in finish()
+        self.counted_venue_ids = set()
+        self.counted_artist_ids = set()
+        self.double_bookings = []
+
+    def add(self, section, record):
+        # A record without genres leaves the stored ones alone, an empty list removes them
+        if section == 'venues' and "genres" in record:
+            self.link_parents['venue_genres'].add(record["id"])
+        elif section == 'artists' and "genres" in record:
+            self.link_parents['artist_genres'].add(record["id"])
+        super().add(section, record)
+
+    def pending(self, table):
+        return super().pending(table) or bool(self.link_parents.get(table.name))
+
+    def write(self, table, rows):
+        if table.name in self._link_keys:
+            return self._sync_links(table, rows)
+        if table.name == 'shows':
+            return self._insert_new_shows(table, rows)
+        return self._upsert(table, rows)
+
+    def _upsert(self, table, rows):
+        statement = self.insert(table)
+        columns = [column for column in rows[0] if column not in ('id', 'created_date', 'updated_at')]
+
+        values = {column: statement.excluded[column] for column in columns}
+        if 'search_vector' in table.c:
+            values['search_vector'] = None
+        if 'updated_at' in table.c:
+            values['updated_at'] = statement.excluded.updated_at
+
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.id],
+            set_=values,
+            # Leave identical rows alone, they keep their row versions and search vectors
+            where=or_(*[table.c[column].is_distinct_from(statement.excluded[column]) for column in columns]),
+        )
+        self.connection.execute(statement, rows)
+        return len(rows)
+
+    def _sync_links(self, table, rows):
+        key = self._link_keys[table.name]
+        parents = self.link_parents[table.name]
+        self.link_parents[table.name] = set()
+
+        wanted = {(row[key], row["genre_id"]) for row in rows}
+        existing = set(self.connection.execute(
+            select(table.c[key], table.c.genre_id).where(table.c[key].in_(parents))
+        ))
+
+        removed = existing - wanted
+        added = wanted - existing
+        for parent_id, genre_id in removed:
+            self.connection.execute(
+                table.delete().where(table.c[key] == parent_id).where(table.c.genre_id == genre_id)
+            )
+        if added:
+            self.connection.execute(table.insert(), [{key: parent_id, "genre_id": genre_id}
+                                                     for parent_id, genre_id in added])
+
+        # A changed genre set changes the search document of its parent
+        changed_parents = {parent_id for parent_id, genre_id in removed | added}
+        if changed_parents:
+            parent_table = Venue.__table__ if key == 'venue_id' else Artist.__table__
+            self.connection.execute(
+                parent_table.update()
+                .where(parent_table.c.id.in_(changed_parents))
+                .values(search_vector=None, updated_at=self.created_date)
+            )
+        return len(removed) + len(added)
+
+    def _insert_new_shows(self, table, rows):
+        keys = {(row["venue_id"], row["artist_id"], row["start_time"]): row for row in rows}
+        venue_ids = {venue_id for venue_id, artist_id, start_time in keys}
+        start_times = [start_time for venue_id, artist_id, start_time in keys]
+
+        existing = self.connection.execute(
+            select(table.c.venue_id, table.c.artist_id, table.c.start_time)
+            .where(table.c.venue_id.in_(venue_ids))
+            .where(table.c.start_time.between(min(start_times), max(start_times)))
+        )
+        for show in existing:
+            keys.pop(tuple(show), None)
+
+        candidates = list(keys.values())
+        free, errors = find_double_bookings(self.connection, [
+            ShowRow(number, row["venue_id"], row["artist_id"], row["start_time"], row["end_time"])
+            for number, row in enumerate(candidates)
+        ])
+        self.double_bookings.extend((candidates[error.row], error.errors) for error in errors)
+        self.stats['shows'].skipped += len(errors)
+
+        rows = [candidates[row.number] for row in free]
+        if rows:
+            self.connection.execute(table.insert(), rows)
+            self.counted_venue_ids.update(row["venue_id"] for row in rows)
+            self.counted_artist_ids.update(row["artist_id"] for row in rows)
+        return len(rows)
+
+    def refresh_counters(self):
+        if self.counted_venue_ids or self.counted_artist_ids:
+            refresh_show_counters(self.connection, self.counted_venue_ids, self.counted_artist_ids)
+
+
+# ----------------------------------------------------------------------------#
+# Streaming readers.
+#
+# Both yield (section, record) pairs one at a time so a seed file of any size
+# can be fed to BulkLoader in constant memory.
+# ----------------------------------------------------------------------------#
+
+class JsonStream:
+    """Incremental reader of one JSON document, decoding a value at a time"""
+
+    _whitespace = ' \t\n\r'
+
+    def __init__(self, fp, chunk_size=1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """Read another chunk, dropping what has already been consumed. False at end of file"""
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+    def peek(self):
+        """Next non-whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self._whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError('Unexpected end of JSON input')
+
+    def expect(self, *characters):
+        character = self.peek()
+        if character not in characters:
+            raise ValueError(f'Expected {" or ".join(characters)} at offset {self.pos}, found {character!r}')
+        self.pos += 1
+        return character
+
+    def value(self):
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number running up to the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+
+def iter_json_records(fp, chunk_size=1 << 16):
+    """(section, record) for every element of the top-level arrays of {"section": [...], ...}"""
+    stream = JsonStream(fp, chunk_size)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+
+    while True:
+        section = stream.value()
+        stream.expect(':')
+        if stream.peek() == '[':
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.expect(']')
+            else:
+                while True:
+                    yield section, stream.value()
+                    if stream.expect(',', ']') == ']':
+                        break
+        else:
+            # Not a list of records, skip it
+            stream.value()
+
+        if stream.expect(',', '}') == '}':
+            return
+
+
+def iter_ndjson_records(fp):
+    """(section, record) for every line of the form {"section": "venues", "record": {...}}"""
+    for line_number, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+            yield entry["section"], entry["record"]
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f'Invalid NDJSON entry on line {line_number}: {e}')
+
+
+def iter_records(fp, ndjson=False):
+    return iter_ndjson_records(fp) if ndjson else iter_json_records(fp)
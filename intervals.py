@@ -0,0 +1,107 @@
+# ----------------------------------------------------------------------------#
+# Interval tree.
+#
+# Half-open [start, end) intervals in a treap ordered by start, every node
+# also holding the largest end of its subtree. Adding an interval and finding
+# one that overlaps a given interval both take expected logarithmic time, so
+# checking a whole upload against a busy venue's calendar doesn't rescan the
+# calendar for every row.
+# ----------------------------------------------------------------------------#
+import random
+
+
+class _Node:
+    __slots__ = ('start', 'end', 'value', 'priority', 'max_end', 'left', 'right')
+
+    def __init__(self, start, end, value, priority):
+        self.start = start
+        self.end = end
+        self.value = value
+        self.priority = priority
+        self.max_end = end
+        self.left = None
+        self.right = None
+
+    def update(self):
+        self.max_end = self.end
+        if self.left is not None and self.left.max_end > self.max_end:
+            self.max_end = self.left.max_end
+        if self.right is not None and self.right.max_end > self.max_end:
+            self.max_end = self.right.max_end
+
+
+def _rotate_right(node):
+    top = node.left
+    node.left, top.right = top.right, node
+    node.update()
+    top.update()
+    return top
+
+
+def _rotate_left(node):
+    top = node.right
+    node.right, top.left = top.left, node
+    node.update()
+    top.update()
+    return top
+
+
+def _insert(node, new):
+    if node is None:
+        return new
+    if new.start < node.start:
+        node.left = _insert(node.left, new)
+        if node.left.priority > node.priority:
+            return _rotate_right(node)
+    else:
+        node.right = _insert(node.right, new)
+        if node.right.priority > node.priority:
+            return _rotate_left(node)
+    node.update()
+    return node
+
+
+class IntervalTree:
+    """Half-open intervals with a value each, e.g. the shows booked at one venue"""
+
+    def __init__(self, intervals=(), seed=None):
+        self.root = None
+        self.size = 0
+        self.random = random.Random(seed)
+        for start, end, value in intervals:
+            self.add(start, end, value)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, start, end, value=None):
+        """Add [start, end), overlapping intervals are allowed"""
+        if not start < end:
+            raise ValueError(f'Empty interval [{start}, {end})')
+        self.root = _insert(self.root, _Node(start, end, value, self.random.random()))
+        self.size += 1
+
+    def find(self, start, end):
+        """(start, end, value) of an interval overlapping [start, end), None if there is none"""
+        node = self.root
+        while node is not None:
+            if node.start < end and start < node.end:
+                return node.start, node.end, node.value
+            # An interval on the left ends after start, if it doesn't overlap it starts at or after end and so
+            # does everything on the right
+            if node.left is not None and node.left.max_end > start:
+                node = node.left
+            else:
+                node = node.right
+        return None
+
+    def __iter__(self):
+        """(start, end, value) of every interval, by start"""
+        stack, node = [], self.root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.start, node.end, node.value
+            node = node.right
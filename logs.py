@@ -0,0 +1,188 @@
+# ----------------------------------------------------------------------------#
+# Non-blocking error and access logs.
+#
+# Request threads only put records on a bounded in-memory queue; a
+# QueueListener thread formats them and writes the log files. When the
+# queue is full, records are dropped and counted rather than making
+# requests wait for the disk.
+#
+# Every worker process has its own listener appending to the same files, so
+# none of them may rotate the files: they are rotated by size outside the
+# app (deploy/logrotate.conf) and each WatchedFileHandler reopens its file
+# once it has been moved away.
+#
+# The access log has one JSON object per request with its timing. Plain
+# requests are sampled at LOG_ACCESS_SAMPLE_RATE; 5xx responses and requests
+# slower than LOG_ACCESS_SLOW_MS are always kept.
+# ----------------------------------------------------------------------------#
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, WatchedFileHandler
+
+from flask import g, request
+
+access_logger = logging.getLogger('fyyur.access')
+
+ERROR_FORMAT = '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
+
+# Attributes every LogRecord has, anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and the extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a sample_rate fraction of the records at INFO and below, every record above"""
+
+    def __init__(self, sample_rate, random=random.random):
+        super().__init__()
+        self.sample_rate = sample_rate
+        self.random = random
+
+    def filter(self, record):
+        return record.levelno > logging.INFO or self.sample_rate >= 1 or self.random() < self.sample_rate
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records instead of blocking or raising when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.lock = threading.Lock()
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+
+
+class LogPipeline:
+    """Sends app.logger, the fyyur loggers and the access log through a queue to the log files"""
+
+    def __init__(self, app=None):
+        self.handler = None
+        self.listener = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['log_pipeline'] = self
+        self.slow_seconds = app.config.get('LOG_ACCESS_SLOW_MS', 1000) / 1000
+
+        error_handler = WatchedFileHandler(app.config.get('LOG_ERROR_FILE', 'error.log'), delay=True)
+        error_handler.setFormatter(logging.Formatter(ERROR_FORMAT))
+        error_handler.addFilter(lambda record: record.name != access_logger.name)
+        handlers = [error_handler]
+
+        access_file = app.config.get('LOG_ACCESS_FILE')
+        if access_file:
+            access_handler = WatchedFileHandler(access_file, delay=True)
+            access_handler.setFormatter(JsonFormatter())
+            access_handler.addFilter(logging.Filter(access_logger.name))
+            handlers.append(access_handler)
+
+            # Sampled before enqueueing, so a dropped sample costs the request thread nothing
+            access_logger.addFilter(SamplingFilter(app.config.get('LOG_ACCESS_SAMPLE_RATE', 1.0)))
+            access_logger.setLevel(logging.INFO)
+            access_logger.propagate = False
+            access_logger.addHandler(self._queue_handler(app))
+            app.before_request(self._start_timer)
+            app.after_request(self._log_access)
+
+        app.logger.setLevel(logging.INFO)
+        app.logger.addHandler(self._queue_handler(app))
+        logging.getLogger('fyyur').addHandler(self._queue_handler(app))
+
+        self.listener = QueueListener(self.handler.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+        # Flush what is still queued when the process exits
+        atexit.register(self.stop)
+
+    def _queue_handler(self, app):
+        if self.handler is None:
+            self.handler = DroppingQueueHandler(queue.Queue(app.config.get('LOG_QUEUE_SIZE', 10000)))
+        return self.handler
+
+    def stop(self):
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    @property
+    def dropped(self):
+        return self.handler.dropped if self.handler is not None else 0
+
+    # Access log
+
+    def _start_timer(self):
+        g.access_started = time.perf_counter()
+
+    def _log_access(self, response):
+        started = g.get('access_started')
+        if started is None:
+            return response
+        duration = time.perf_counter() - started
+
+        if response.status_code >= 500:
+            level = logging.ERROR
+        elif duration >= self.slow_seconds:
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+
+        fields = {
+            'method': request.method,
+            'path': request.path,
+            'query': request.query_string.decode('latin-1'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            # None for streamed responses
+            'bytes': response.content_length,
+            'remote_addr': request.remote_addr,
+            'user_agent': request.user_agent.string,
+            'cache': response.headers.get('X-Cache'),
+        }
+        profile = g.get('request_profile')
+        if profile is not None:
+            fields['sql_queries'] = profile.queries
+            fields['sql_ms'] = round(profile.sql_seconds * 1000, 2)
+        access_logger.log(level, '%s %s %s', request.method, request.full_path.rstrip('?'), response.status_code,
+                          extra=fields)
+        return response
+
+    # Exposition
+
+    def render_metrics(self):
+        """Dropped record count in the Prometheus text exposition format"""
+        if self.handler is None:
+            return ''
+        name = 'fyyur_log_records_dropped_total'
+        return '\n'.join([
+            f'# HELP {name} Log records dropped because the log queue was full.',
+            f'# TYPE {name} counter',
+            f'{name} {self.dropped}',
+        ]) + '\n'
@@ -0,0 +1,66 @@
+"""full-text search vectors for venues and artists
+
+Revision ID: 0ab54b61b423
+Revises: 8f43494f59b4
+Create Date: 2026-10-18 10:03:27.551930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0ab54b61b423'
+down_revision = '8f43494f59b4'
+branch_labels = None
+depends_on = None
+
+
+# Same document as models.search_document(): name (A), genres and location (B), seeking description (C)
+POSTGRES_BACKFILL = """
+UPDATE {table} SET search_vector =
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english',
+        coalesce((SELECT string_agg(g.name, ' ')
+                  FROM {genre_table} eg JOIN genres g ON g.id = eg.genre_id
+                  WHERE eg.{key} = {table}.id), '')
+        || ' ' || coalesce(city, '') || ' ' || coalesce(state, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(seeking_description, '')), 'C')
+"""
+
+PLAIN_BACKFILL = """
+UPDATE {table} SET search_vector = lower(
+    coalesce(name, '') || ' ' ||
+    coalesce((SELECT group_concat(g.name, ' ')
+              FROM {genre_table} eg JOIN genres g ON g.id = eg.genre_id
+              WHERE eg.{key} = {table}.id), '')
+    || ' ' || coalesce(city, '') || ' ' || coalesce(state, '') || ' ' || coalesce(seeking_description, ''))
+"""
+
+TABLES = (
+    ('venues', 'venue_genres', 'venue_id'),
+    ('artists', 'artist_genres', 'artist_id'),
+)
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    column_type = postgresql.TSVECTOR() if is_postgres else sa.Text()
+
+    for table, genre_table, key in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('search_vector', column_type, nullable=True))
+
+        backfill = POSTGRES_BACKFILL if is_postgres else PLAIN_BACKFILL
+        op.execute(backfill.format(table=table, genre_table=genre_table, key=key))
+
+        op.create_index(f'ix_{table}_search_vector', table, ['search_vector'], unique=False,
+                        postgresql_using='gin')
+
+
+def downgrade():
+    for table, genre_table, key in reversed(TABLES):
+        op.drop_index(f'ix_{table}_search_vector', table_name=table)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('search_vector')
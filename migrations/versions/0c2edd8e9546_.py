@@ -0,0 +1,32 @@
+"""updated_at version columns on venues, artists and shows
+
+Revision ID: 0c2edd8e9546
+Revises: a67006d91e97
+Create Date: 2026-10-18 13:48:55.270143
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c2edd8e9546'
+down_revision = 'a67006d91e97'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists', 'shows'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(), nullable=True))
+
+    op.execute('UPDATE venues SET updated_at = coalesce(created_date, CURRENT_TIMESTAMP)')
+    op.execute('UPDATE artists SET updated_at = coalesce(created_date, CURRENT_TIMESTAMP)')
+    op.execute('UPDATE shows SET updated_at = CURRENT_TIMESTAMP')
+
+
+def downgrade():
+    for table in ('shows', 'artists', 'venues'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('updated_at')
@@ -0,0 +1,45 @@
+"""show end times and range indexes for double-booking checks
+
+Revision ID: 1d5c37800caa
+Revises: da5092cbbc7a
+Create Date: 2026-10-18 18:41:05.223164
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d5c37800caa'
+down_revision = 'da5092cbbc7a'
+branch_labels = None
+depends_on = None
+
+
+# Existing shows get models.DEFAULT_SHOW_DURATION. SQLite's datetime() drops the microseconds that
+# SQLAlchemy stores, they are added back so that end times compare as text like the start times
+POSTGRES_BACKFILL = "UPDATE shows SET end_time = start_time + interval '2 hours'"
+SQLITE_BACKFILL = "UPDATE shows SET end_time = datetime(start_time, '+2 hours') || substr(start_time, 20)"
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+
+    op.add_column('shows', sa.Column('end_time', sa.DateTime(), nullable=True))
+    op.execute(POSTGRES_BACKFILL if is_postgres else SQLITE_BACKFILL)
+    with op.batch_alter_table('shows', schema=None) as batch_op:
+        batch_op.alter_column('end_time', existing_type=sa.DateTime(), nullable=False)
+
+    # Not EXCLUDE constraints: shows loaded before this may already overlap, scheduling.py checks new ones
+    if is_postgres:
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        for key in ('venue_id', 'artist_id'):
+            op.execute(f'CREATE INDEX ix_shows_{key}_during ON shows USING gist ({key}, tsrange(start_time, end_time))')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_shows_artist_id_during', table_name='shows')
+        op.drop_index('ix_shows_venue_id_during', table_name='shows')
+    with op.batch_alter_table('shows', schema=None) as batch_op:
+        batch_op.drop_column('end_time')
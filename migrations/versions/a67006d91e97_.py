@@ -0,0 +1,38 @@
+"""indexes for the hot filter columns
+
+Revision ID: a67006d91e97
+Revises: 0ab54b61b423
+Create Date: 2026-10-18 11:21:08.406773
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a67006d91e97'
+down_revision = '0ab54b61b423'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # show_venue() / venue upcoming counts and show_artist() / artist upcoming counts
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    # keyset pagination of /shows
+    op.create_index('ix_shows_start_time_id', 'shows', ['start_time', 'id'], unique=False)
+    # city / state filters of /venues
+    op.create_index('ix_venues_city_state', 'venues', ['city', 'state'], unique=False)
+    # "recently listed" on the home page
+    op.create_index('ix_venues_created_date', 'venues', ['created_date'], unique=False)
+    op.create_index('ix_artists_created_date', 'artists', ['created_date'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_created_date', table_name='artists')
+    op.drop_index('ix_venues_created_date', table_name='venues')
+    op.drop_index('ix_venues_city_state', table_name='venues')
+    op.drop_index('ix_shows_start_time_id', table_name='shows')
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
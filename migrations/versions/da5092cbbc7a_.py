@@ -0,0 +1,42 @@
+"""denormalized upcoming / past show counters on venues and artists
+
+Revision ID: da5092cbbc7a
+Revises: 0c2edd8e9546
+Create Date: 2026-10-18 15:02:11.408316
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'da5092cbbc7a'
+down_revision = '0c2edd8e9546'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    for table in ('venues', 'artists'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('upcoming_shows_count', sa.Integer(), server_default='0', nullable=False))
+            batch_op.add_column(sa.Column('past_shows_count', sa.Integer(), server_default='0', nullable=False))
+
+    # start_time is naive UTC, compare it with the application's UTC clock rather than the database's
+    for table, key in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.get_bind().execute(sa.text(f"""
+            UPDATE {table} SET
+                upcoming_shows_count = (SELECT count(*) FROM shows
+                                        WHERE shows.{key} = {table}.id AND shows.start_time >= :now),
+                past_shows_count = (SELECT count(*) FROM shows
+                                    WHERE shows.{key} = {table}.id AND shows.start_time < :now)
+        """), {'now': datetime.utcnow()})
+
+
+def downgrade():
+    for table in ('artists', 'venues'):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_column('past_shows_count')
+            batch_op.drop_column('upcoming_shows_count')
@@ -1,11 +1,56 @@
 # ----------------------------------------------------------------------------#
 # Models.
 # ----------------------------------------------------------------------------#
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
+import dateutil.parser
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event, func, inspect, select
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import Session, sessionmaker, validates
+from sqlalchemy.pool import NullPool
 
-db = SQLAlchemy()
+from pool import TimedNullPool, engine_options, instrument_engine
+from replicas import RoutingSession
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy whose engines use the DB_* pool settings and record pool metrics
+
+    Its sessions route the reads of @replica_reads views to the read replicas.
+    """
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        # Flask-SQLAlchemy 2.5 returns (sa_url, options), 2.4 changes options in place
+        result = super().apply_driver_hacks(app, sa_url, options)
+        for key, value in engine_options(sa_url.get_backend_name(), app.config).items():
+            options.setdefault(key, value)
+        if options.get('poolclass') is NullPool:
+            options['poolclass'] = TimedNullPool
+        return result
+
+    def create_engine(self, sa_url, engine_opts):
+        return instrument_engine(super().create_engine(sa_url, engine_opts))
+
+
+db = PooledSQLAlchemy()
+
+# Text search configuration used for the search_vector columns
+SEARCH_CONFIG = 'english'
+
+# The trigram name indexes need pg_trgm, make sure create_all() can build them
+event.listen(
+    db.Model.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+# and the show range indexes btree_gist, for the integer column in a GiST index
+event.listen(
+    db.Model.metadata, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS btree_gist').execute_if(dialect='postgresql')
+)
 
 
 class Genre(db.Model):
@@ -28,6 +73,12 @@ artist_genres = db.Table('artist_genres',
 
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        db.Index('ix_venues_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_venues_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_venues_city_state', 'city', 'state'),
+        db.Index('ix_venues_created_date', 'created_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -43,6 +94,13 @@ class Venue(db.Model):
 
     genres = db.relationship('Genre', secondary=venue_genres, backref=db.backref('venues', lazy=True))
     created_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every change that affects the entity's page, drives its ETag / Last-Modified
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # tsvector on PostgreSQL, a lower-cased plain text document elsewhere
+    search_vector = db.Column(db.Text().with_variant(TSVECTOR(), 'postgresql'))
+    # Denormalized show counts kept current by the Show mapper events below and `flask counters`
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return f'<Venue {self.id} {self.name}>'
@@ -50,6 +108,11 @@ class Venue(db.Model):
 
 class Artist(db.Model):
     __tablename__ = 'artists'
+    __table_args__ = (
+        db.Index('ix_artists_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+        db.Index('ix_artists_search_vector', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_artists_created_date', 'created_date'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String)
@@ -64,21 +127,243 @@ class Artist(db.Model):
 
     genres = db.relationship('Genre', secondary=artist_genres, backref=db.backref('artists', lazy=True))
     created_date = db.Column(db.DateTime, default=datetime.utcnow)
+    # Bumped on every change that affects the entity's page, drives its ETag / Last-Modified
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # tsvector on PostgreSQL, a lower-cased plain text document elsewhere
+    search_vector = db.Column(db.Text().with_variant(TSVECTOR(), 'postgresql'))
+    # Denormalized show counts kept current by the Show mapper events below and `flask counters`
+    upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     def __repr__(self):
         return f'<Artist {self.id} {self.name}>'
 
 
+# Show times are naive UTC, whatever the source (seed data, form, upload, API), and "now" to compare them with
+# is always datetime.utcnow(): the upcoming / past split, the counters, double bookings and calendars agree
+def naive_utc(value):
+    """value as the naive UTC datetime show times are stored as: ISO 8601 strings are parsed, offsets converted"""
+    if isinstance(value, str):
+        value = dateutil.parser.isoparse(value.strip())
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+# Length of a show booked without an end_time
+DEFAULT_SHOW_DURATION = timedelta(hours=2)
+
+
+def default_end_time(context):
+    return context.get_current_parameters()['start_time'] + DEFAULT_SHOW_DURATION
+
+
 class Show(db.Model):
     __tablename__ = 'shows'
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    end_time = db.Column(db.DateTime, nullable=False, default=default_end_time)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     artist = db.relationship('Artist', backref=db.backref('shows', cascade='all, delete'))
     venue = db.relationship('Venue', backref=db.backref('shows', cascade='all, delete'))
 
+    @validates('start_time', 'end_time')
+    def _coerce_time(self, key, value):
+        # The counter hooks compare start_time with the clock, which needs a naive datetime
+        return naive_utc(value)
+
     def __repr__(self):
         return f'<Show {self.id} {self.artist_id} {self.venue_id} {self.start_time}>'
+
+
+# Which shows of a venue / an artist overlap a time range, see shows_during(). Expression indexes on
+# PostgreSQL only, elsewhere the (venue_id, start_time) / (artist_id, start_time) ones serve
+SHOW_RANGE_INDEX = 'CREATE INDEX ix_shows_{key}_during ON shows USING gist ({key}, tsrange(start_time, end_time))'
+
+event.listen(Show.__table__, 'after_create',
+             DDL(SHOW_RANGE_INDEX.format(key='venue_id')).execute_if(dialect='postgresql'))
+event.listen(Show.__table__, 'after_create',
+             DDL(SHOW_RANGE_INDEX.format(key='artist_id')).execute_if(dialect='postgresql'))
+
+
+def shows_during(start, end, dialect_name='postgresql'):
+    """Filter of the shows overlapping [start, end), combine it with a venue_id or artist_id filter"""
+    if dialect_name == 'postgresql':
+        # Written like the index expression so the GiST range indexes serve it
+        return func.tsrange(Show.start_time, Show.end_time).op('&&')(func.tsrange(start, end))
+    return (Show.start_time < end) & (Show.end_time > start)
+
+
+# ----------------------------------------------------------------------------#
+# Version tracking.
+# ----------------------------------------------------------------------------#
+
+@event.listens_for(Session, 'before_flush')
+def touch_updated_at(session, flush_context, instances):
+    """Bump updated_at for changes that onupdate doesn't see
+
+    Changing only the genres of a venue or artist doesn't UPDATE its row,
+    and deleting a show changes the pages of its venue and artist.
+    """
+    now = datetime.utcnow()
+    for entity in session.dirty:
+        if isinstance(entity, (Venue, Artist)) and session.is_modified(entity):
+            entity.updated_at = now
+    for entity in session.deleted:
+        if isinstance(entity, Show):
+            for parent in (entity.venue, entity.artist):
+                if parent is not None and parent not in session.deleted:
+                    parent.updated_at = now
+
+
+# ----------------------------------------------------------------------------#
+# Show counters.
+# ----------------------------------------------------------------------------#
+
+def _shift_show_counters(connection, venue_id, artist_id, start_time, delta):
+    """Add delta to the upcoming or past counter of a show's venue and artist, in the flush's transaction"""
+    column = 'upcoming_shows_count' if start_time >= datetime.utcnow() else 'past_shows_count'
+    for table, entity_id in ((Venue.__table__, venue_id), (Artist.__table__, artist_id)):
+        connection.execute(
+            table.update().where(table.c.id == entity_id).values({column: table.c[column] + delta})
+        )
+
+
+@event.listens_for(Show, 'after_insert')
+def count_inserted_show(mapper, connection, show):
+    _shift_show_counters(connection, show.venue_id, show.artist_id, show.start_time, 1)
+
+
+@event.listens_for(Show, 'after_delete')
+def count_deleted_show(mapper, connection, show):
+    _shift_show_counters(connection, show.venue_id, show.artist_id, show.start_time, -1)
+
+
+@event.listens_for(Show, 'after_update')
+def count_moved_show(mapper, connection, show):
+    """Move a show between counters when its venue, artist or start_time changed"""
+    state = inspect(show)
+    old = {}
+    for name in ('venue_id', 'artist_id', 'start_time'):
+        history = state.attrs[name].history
+        old[name] = history.deleted[0] if history.deleted else getattr(show, name)
+
+    if old != {name: getattr(show, name) for name in old}:
+        _shift_show_counters(connection, old['venue_id'], old['artist_id'], old['start_time'], -1)
+        _shift_show_counters(connection, show.venue_id, show.artist_id, show.start_time, 1)
+
+
+# Set-based recount for shows written without the ORM and for the periodic roll-forward
+def _counted_shows(table, key, upcoming, now):
+    shows = Show.__table__
+    condition = shows.c.start_time >= now if upcoming else shows.c.start_time < now
+    return select(func.count(shows.c.id)).where(key == table.c.id).where(condition).scalar_subquery()
+
+
+def refresh_show_counters(connection, venue_ids=None, artist_ids=None, now=None):
+    """Recompute the counters of the given venues and artists from shows, or of all of them when both are None"""
+    now = now or datetime.utcnow()
+    everything = venue_ids is None and artist_ids is None
+
+    shows = Show.__table__
+    counted = ((Venue.__table__, shows.c.venue_id), (Artist.__table__, shows.c.artist_id))
+    for (table, key), ids in zip(counted, (venue_ids, artist_ids)):
+        if not everything and not ids:
+            continue
+        statement = table.update().values(
+            upcoming_shows_count=_counted_shows(table, key, True, now),
+            past_shows_count=_counted_shows(table, key, False, now),
+        )
+        if not everything:
+            statement = statement.where(table.c.id.in_(ids))
+        connection.execute(statement)
+
+
+# ----------------------------------------------------------------------------#
+# Full-text search vectors.
+# ----------------------------------------------------------------------------#
+
+def search_document(entity):
+    """Weighted text of a venue or artist: name (A), genres and location (B), seeking description (C)"""
+    return (
+        ('A', entity.name or ''),
+        ('B', ' '.join([genre.name for genre in entity.genres] + [entity.city or '', entity.state or ''])),
+        ('C', entity.seeking_description or ''),
+    )
+
+
+def search_vector_value(entity, dialect_name):
+    """Value to store in entity.search_vector for the given database dialect"""
+    document = search_document(entity)
+    if dialect_name != 'postgresql':
+        return ' '.join(text for weight, text in document if text).lower()
+
+    vector = None
+    for weight, text in document:
+        part = func.setweight(func.to_tsvector(SEARCH_CONFIG, text), weight)
+        vector = part if vector is None else vector.op('||')(part)
+    return vector
+
+
+# Attributes that make up the search document, see search_vector_value()
+SEARCH_ATTRIBUTES = ('name', 'genres', 'city', 'state', 'seeking_description')
+
+
+def _search_document_changed(entity):
+    state = inspect(entity)
+    return any(state.attrs[name].history.has_changes() for name in SEARCH_ATTRIBUTES)
+
+
+@event.listens_for(Session, 'before_flush')
+def refresh_search_vectors(session, flush_context, instances):
+    """Recompute search_vector of new venues and artists and of those whose document changed, before they are written
+
+    Changes to other columns only, e.g. the show counters or updated_at, keep the stored vector.
+    """
+    dialect_name = session.get_bind().dialect.name
+    for entity in list(session.new) + list(session.dirty):
+        if isinstance(entity, (Venue, Artist)) and (entity in session.new or _search_document_changed(entity)):
+            entity.search_vector = search_vector_value(entity, dialect_name)
+
+
+# Set-based equivalent of search_vector_value() for rows written without the ORM
+_REBUILD_SEARCH_VECTORS = {
+    'postgresql': """
+        UPDATE {table} SET search_vector =
+            setweight(to_tsvector('{config}', coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('{config}',
+                coalesce((SELECT string_agg(g.name, ' ')
+                          FROM {genre_table} eg JOIN genres g ON g.id = eg.genre_id
+                          WHERE eg.{key} = {table}.id), '')
+                || ' ' || coalesce(city, '') || ' ' || coalesce(state, '')), 'B') ||
+            setweight(to_tsvector('{config}', coalesce(seeking_description, '')), 'C')
+    """,
+    'default': """
+        UPDATE {table} SET search_vector = lower(
+            coalesce(name, '') || ' ' ||
+            coalesce((SELECT group_concat(g.name, ' ')
+                      FROM {genre_table} eg JOIN genres g ON g.id = eg.genre_id
+                      WHERE eg.{key} = {table}.id), '')
+            || ' ' || coalesce(city, '') || ' ' || coalesce(state, '') || ' ' || coalesce(seeking_description, ''))
+    """,
+}
+
+
+def rebuild_search_vectors(connection, only_missing=False):
+    """Recompute search_vector of every venue and artist (or only where it is NULL), one statement per table"""
+    statement = _REBUILD_SEARCH_VECTORS.get(connection.dialect.name, _REBUILD_SEARCH_VECTORS['default'])
+    if only_missing:
+        statement += ' WHERE search_vector IS NULL'
+    for table, genre_table, key in (('venues', 'venue_genres', 'venue_id'), ('artists', 'artist_genres', 'artist_id')):
+        connection.exec_driver_sql(
+            statement.format(table=table, genre_table=genre_table, key=key, config=SEARCH_CONFIG)
+        )
@@ -0,0 +1,185 @@
+# ----------------------------------------------------------------------------#
+# Connection pool configuration and health metrics.
+#
+# Engine options come from the DB_* settings in config.py (environment
+# driven). DB_POOL_MODE=null uses a NullPool, one connection per checkout,
+# for running behind PgBouncer, which then does the pooling.
+#
+# The pools record how long every checkout waited for a connection (which
+# includes opening one), how many checkouts timed out and how many
+# connections are in use, exposed through /metrics when profiling is on.
+# The connections in use follow the checkout / checkin / detach / invalidate
+# pool events, so connections that are invalidated or detached stop counting.
+# ----------------------------------------------------------------------------#
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Upper bounds in seconds of the checkout wait histogram
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+
+
+class PoolStats:
+    """Checkout counters of one pool, shared by the pools it is recreated into"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Connection records currently checked out, a set so that a record returned twice
+        # (invalidated, then checked in) is only removed once
+        self.records = set()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.buckets = [0] * len(WAIT_BUCKETS)
+
+    @property
+    def in_use(self):
+        return len(self.records)
+
+    def waited(self, wait_seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds += wait_seconds
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if wait_seconds <= bound:
+                    self.buckets[index] += 1
+
+    def timed_out(self):
+        with self.lock:
+            self.timeouts += 1
+
+    def checked_out(self, connection_record):
+        with self.lock:
+            self.records.add(connection_record)
+
+    def returned(self, connection_record):
+        with self.lock:
+            self.records.discard(connection_record)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'in_use': len(self.records),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'wait_seconds': self.wait_seconds,
+                'buckets': list(self.buckets),
+            }
+
+
+def instrument_engine(engine):
+    """Keep the in-use connections of engine's PoolStats current through the pool events
+
+    Listeners on the engine carry over to the pool engine.dispose() creates.
+    """
+    stats = getattr(engine.pool, 'stats', None)
+    if stats is None:
+        return engine
+    event.listen(engine, 'checkout', lambda dbapi_connection, record, proxy: stats.checked_out(record))
+    event.listen(engine, 'checkin', lambda dbapi_connection, record: stats.returned(record))
+    # A detached connection is never checked in, an invalidated one may not be
+    event.listen(engine, 'detach', lambda dbapi_connection, record: stats.returned(record))
+    event.listen(engine, 'invalidate', lambda dbapi_connection, record, exception: stats.returned(record))
+    return engine
+
+
+class TimedPoolMixin:
+    """Records how long the pool's connect() waited, see instrument_engine() for the connections in use"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        # engine.dispose() replaces the pool, keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.stats.timed_out()
+            raise
+        self.stats.waited(time.perf_counter() - started)
+        return connection
+
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedNullPool(TimedPoolMixin, NullPool):
+    pass
+
+
+def engine_options(dialect_name, config):
+    """create_engine() keyword arguments for a database of dialect_name from the DB_* settings"""
+    if dialect_name == 'sqlite':
+        # SQLite files get a NullPool from Flask-SQLAlchemy, pool sizing doesn't apply
+        return {}
+
+    if config.get('DB_POOL_MODE') == 'null':
+        # Behind PgBouncer: no client side pool. Set statement_timeout on the database
+        # role instead, transaction pooling rejects per-connection startup options
+        return {'poolclass': TimedNullPool}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', -1),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+    statement_timeout = config.get('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout and dialect_name == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout)}'}
+    return options
+
+
+def render_pool_metrics(pools):
+    """Gauges and counters of pools ({bind name: pool}) in the Prometheus text exposition format, one series per bind"""
+    snapshots = [(bind, pool, pool.stats.snapshot()) for bind, pool in pools.items()
+                 if getattr(pool, 'stats', None) is not None]
+    if not snapshots:
+        return ''
+    queue_pools = [(bind, pool, values) for bind, pool, values in snapshots if isinstance(pool, QueuePool)]
+
+    def family(name, kind, help_text, samples):
+        return [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}'] + \
+            [f'{name}{{bind="{bind}"}} {value}' for bind, value in samples]
+
+    lines = family('fyyur_db_pool_checked_out', 'gauge', 'Connections currently checked out of the pool.',
+                   [(bind, values['in_use']) for bind, pool, values in snapshots])
+    lines += family('fyyur_db_pool_checkout_timeouts_total', 'counter', 'Checkouts that gave up after pool_timeout.',
+                    [(bind, values['timeouts']) for bind, pool, values in snapshots])
+    if queue_pools:
+        lines += family('fyyur_db_pool_size', 'gauge', 'Connections the pool keeps open.',
+                        [(bind, pool.size()) for bind, pool, values in queue_pools])
+        lines += family('fyyur_db_pool_overflow', 'gauge',
+                        'Connections open beyond pool_size (negative while the pool fills up).',
+                        [(bind, pool.overflow()) for bind, pool, values in queue_pools])
+        lines += family('fyyur_db_pool_saturation', 'gauge', 'Checked out connections over pool_size + max_overflow.',
+                        [(bind, _saturation(pool, values)) for bind, pool, values in queue_pools])
+
+    name = 'fyyur_db_pool_checkout_wait_seconds'
+    lines += [f'# HELP {name} Time spent waiting for a connection, including opening it.', f'# TYPE {name} histogram']
+    for bind, pool, values in snapshots:
+        for bound, count in zip(WAIT_BUCKETS, values['buckets']):
+            lines.append(f'{name}_bucket{{bind="{bind}",le="{bound}"}} {count}')
+        lines += [
+            f'{name}_bucket{{bind="{bind}",le="+Inf"}} {values["checkouts"]}',
+            f'{name}_sum{{bind="{bind}"}} {values["wait_seconds"]}',
+            f'{name}_count{{bind="{bind}"}} {values["checkouts"]}',
+        ]
+    return '\n'.join(lines) + '\n'
+
+
+def _saturation(pool, values):
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    return values['in_use'] / capacity if capacity > 0 else 0.0
@@ -1,32 +1,31 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+import argparse
 import json
+import time
 
-from config import INITIAL_DATA_PATH
-from models import Genre, Venue, Artist, Show
+from flask import Flask
 from sqlalchemy import inspect
 
+from cache import ResponseCache, backend_from_config
+from config import INITIAL_DATA_PATH
+from ingest import BulkLoader, SyncLoader, SECTIONS, NDJSON_EXTENSIONS, iter_records, parse_start_time
+from models import db, Genre, Venue, Artist, Show
+
 app = Flask(__name__)
 app.config.from_object('config')
-db = SQLAlchemy(app)
-inspector = inspect(db.engine)
+db.init_app(app)
 
-# Your models go here...
 
-# Initialize the app and database
-with app.app_context():
+def reset_schema():
     # Drop all tables
     db.drop_all()
 
     # Recreate all tables based on the models
     db.create_all()
-    print("printing inspector.get_table_names() ", inspector.get_table_names())
+    print("printing inspector.get_table_names() ", inspect(db.engine).get_table_names())
 
-    # Load the JSON data
-    with open(INITIAL_DATA_PATH, "r") as f:
-        data = json.load(f)
 
+def populate_orm(data):
+    """Load data one ORM object per row (small seed files)"""
     # Add genres to the database
     genre_objects = []
     for genre in data["genres"]:
@@ -73,17 +72,126 @@ with app.app_context():
     db.session.add_all(artist_objects)
     db.session.commit()
 
-    artist = Artist.query.get(4)
-    print('printing artist', artist)
-
     # Add shows to the database
     show_objects = []
     for show in data["shows"]:
         show_objects.append(Show(
             venue_id=show["venue_id"],
             artist_id=show["artist_id"],
-            start_time=datetime.fromisoformat(show["start_time"].replace("Z", "+00:00"))
+            # Naive UTC like the bulk loaders, the counters compare it with a naive clock
+            start_time=parse_start_time(show["start_time"])
         ))
     db.session.add_all(show_objects)
 
     db.session.commit()
+
+
+def populate_bulk(data, batch_size, use_copy):
+    """Load data with batched Core inserts or COPY, committing every batch"""
+    with db.engine.connect() as connection:
+        loader = BulkLoader(connection, batch_size=batch_size, use_copy=use_copy)
+        for section in SECTIONS:
+            for record in data.get(section, []):
+                loader.add(section, record)
+        return loader.finish()
+
+
+def populate_stream(path, ndjson, batch_size, use_copy):
+    """Parse the file one record at a time and load it in bounded batches"""
+    with open(path, "r") as f, db.engine.connect() as connection:
+        loader = BulkLoader(connection, batch_size=batch_size, use_copy=use_copy)
+        for section, record in iter_records(f, ndjson=ndjson):
+            loader.add(section, record)
+        return loader.finish()
+
+
+def populate_sync(path, ndjson, batch_size):
+    """Apply the file as a delta to the existing rows, without dropping anything"""
+    with open(path, "r") as f, db.engine.connect() as connection:
+        try:
+            loader = SyncLoader(connection, batch_size=batch_size)
+        except ValueError as e:
+            raise SystemExit(f'--sync: {e}')
+        for section, record in iter_records(f, ndjson=ndjson):
+            loader.add(section, record)
+        stats = loader.finish()
+    for show, errors in loader.double_bookings:
+        print('skipped show {} / {} at {}: {}'.format(
+            show["venue_id"], show["artist_id"], show["start_time"], '; '.join(errors.values())))
+    return stats
+
+
+def clear_shared_cache():
+    """Empty the response cache of the app servers when they share one, True if it was cleared
+
+    Loads bypass the app's tag invalidation, so without this the pages and
+    calendar months cached before the load stay until CACHE_DEFAULT_TTL.
+    An in-process cache can't be reached from here.
+    """
+    if app.config.get('CACHE_TYPE') != 'redis':
+        return False
+    ResponseCache(backend=backend_from_config(app.config)).clear()
+    return True
+
+
+def print_report(stats, elapsed):
+    total = sum(table.rows for table in stats)
+    print('Loaded {} rows in {:.2f}s ({:.0f} rows/s)'.format(total, elapsed, total / elapsed if elapsed else 0))
+    for table in stats:
+        print('  ' + str(table))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Recreate the Fyyur tables and load the seed data.')
+    parser.add_argument('--path', default=INITIAL_DATA_PATH, help='data file (default: config.INITIAL_DATA_PATH)')
+    parser.add_argument('--bulk', action='store_true',
+                        help='load with batched Core inserts (COPY on PostgreSQL) instead of ORM objects')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse the file incrementally and load it in bulk, in constant memory')
+    parser.add_argument('--sync', action='store_true',
+                        help='upsert the file into the existing tables instead of recreating them')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='the file holds one {"section": ..., "record": ...} object per line '
+                             '(implied by a .ndjson or .jsonl extension, implies --stream)')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='rows per committed batch in --bulk, --stream and --sync mode')
+    parser.add_argument('--no-copy', dest='use_copy', action='store_false', default=None,
+                        help='use executemany() even when COPY is available')
+    args = parser.parse_args()
+    args.ndjson = args.ndjson or args.path.endswith(NDJSON_EXTENSIONS)
+    args.stream = args.stream or args.ndjson
+    return args
+
+
+if __name__ == '__main__':
+    args = parse_args()
+
+    with app.app_context():
+        if args.sync:
+            # Only creates the tables that don't exist yet, live rows are kept
+            db.create_all()
+        else:
+            reset_schema()
+
+        started = time.perf_counter()
+        if args.sync:
+            print_report(populate_sync(args.path, args.ndjson, args.batch_size), time.perf_counter() - started)
+        elif args.stream:
+            stats = populate_stream(args.path, args.ndjson, args.batch_size, args.use_copy)
+            print_report(stats, time.perf_counter() - started)
+        else:
+            # Load the JSON data
+            with open(args.path, "r") as f:
+                data = json.load(f)
+
+            if args.bulk:
+                print_report(populate_bulk(data, args.batch_size, args.use_copy), time.perf_counter() - started)
+            else:
+                populate_orm(data)
+                print('Loaded {} in {:.2f}s'.format(args.path, time.perf_counter() - started))
+
+        if clear_shared_cache():
+            print('Cleared the shared response cache')
+        else:
+            print('Running app servers may serve cached pages and calendars for up to {}s'.format(
+                app.config.get('CACHE_DEFAULT_TTL')))
@@ -0,0 +1,225 @@
+# ----------------------------------------------------------------------------#
+# Opt-in request profiling.
+#
+# With PROFILING enabled every request records its SQL query count, SQL
+# time, template render time and wall time, from SQLAlchemy cursor events
+# and Flask's request / template signals. Totals per endpoint are served at
+# /metrics in the Prometheus text format. Requests slower than
+# PROFILING_SLOW_REQUEST_MS, or running one statement at least
+# PROFILING_N_PLUS_ONE_THRESHOLD times (the N+1 signature), are logged to
+# the "fyyur.profiling" logger. Each response also gets a Server-Timing
+# header so the numbers show up in the browser's network panel.
+#
+# /metrics itself is served whenever METRICS is on, profiling or not, with
+# the metrics of the add_collector() hooks (connection pools, log queue).
+# ----------------------------------------------------------------------------#
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from flask import Response, g, has_request_context, request
+from flask.signals import before_render_template, request_finished, request_started, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('fyyur.profiling')
+
+# Upper bounds in seconds of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestProfile:
+    """Measurements of the request in flight, kept on flask.g"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.template_starts = []
+        self.statements = Counter()
+
+    @property
+    def wall_seconds(self):
+        return time.perf_counter() - self.started
+
+    def repeated_statements(self, threshold):
+        """(count, statement) of statements run at least threshold times, most repeated first"""
+        return [(count, statement) for statement, count in self.statements.most_common() if count >= threshold]
+
+
+class EndpointStats:
+    """Running totals of one (endpoint, method, status)"""
+
+    def __init__(self):
+        self.requests = 0
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.template_seconds = 0.0
+        self.wall_seconds = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+
+    def add(self, profile, wall_seconds):
+        self.requests += 1
+        self.queries += profile.queries
+        self.sql_seconds += profile.sql_seconds
+        self.template_seconds += profile.template_seconds
+        self.wall_seconds += wall_seconds
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if wall_seconds <= bound:
+                self.buckets[index] += 1
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestProfiler:
+    """Collects per-request and per-endpoint timings when PROFILING is enabled"""
+
+    def __init__(self, app=None):
+        self.stats = defaultdict(EndpointStats)
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.collectors = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['request_profiler'] = self
+        if app.config.get('METRICS', True) or app.config.get('PROFILING'):
+            app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+        if not app.config.get('PROFILING'):
+            return
+
+        self.enabled = True
+        self.slow_seconds = app.config.get('PROFILING_SLOW_REQUEST_MS', 500) / 1000
+        self.n_plus_one_threshold = app.config.get('PROFILING_N_PLUS_ONE_THRESHOLD', 10)
+
+        # Engine-wide, so every engine the app creates (e.g. per bind) is covered
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(Engine, 'handle_error', self._handle_error)
+
+        # Weak references, the bound methods live as long as the profiler
+        request_started.connect(self._request_started, app)
+        request_finished.connect(self._request_finished, app)
+        before_render_template.connect(self._before_render_template, app)
+        template_rendered.connect(self._template_rendered, app)
+
+    # SQLAlchemy events
+
+    @staticmethod
+    def _profile():
+        return g.get('request_profile') if has_request_context() else None
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('profiling_starts', []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['profiling_starts'].pop()
+        profile = self._profile()
+        if profile is not None:
+            profile.queries += 1
+            profile.sql_seconds += elapsed
+            profile.statements[statement] += 1
+
+    def _handle_error(self, exception_context):
+        # A failed statement never reaches after_cursor_execute
+        connection = exception_context.connection
+        if connection is not None and exception_context.cursor is not None:
+            starts = connection.info.get('profiling_starts')
+            if starts:
+                starts.pop()
+
+    # Flask signals
+
+    def _request_started(self, sender, **extra):
+        g.request_profile = RequestProfile()
+
+    def _before_render_template(self, sender, template, context, **extra):
+        profile = self._profile()
+        if profile is not None:
+            profile.template_starts.append(time.perf_counter())
+
+    def _template_rendered(self, sender, template, context, **extra):
+        profile = self._profile()
+        if profile is not None and profile.template_starts:
+            elapsed = time.perf_counter() - profile.template_starts.pop()
+            # Templates rendered from inside another render are already part of the outer time
+            if not profile.template_starts:
+                profile.template_seconds += elapsed
+
+    def _request_finished(self, sender, response, **extra):
+        profile = self._profile()
+        if profile is None:
+            return
+
+        wall_seconds = profile.wall_seconds
+        endpoint = request.endpoint or 'unmatched'
+        with self.lock:
+            self.stats[(endpoint, request.method, response.status_code)].add(profile, wall_seconds)
+
+        response.headers['Server-Timing'] = ', '.join([
+            f'sql;desc="{profile.queries} queries";dur={profile.sql_seconds * 1000:.1f}',
+            f'template;dur={profile.template_seconds * 1000:.1f}',
+            f'total;dur={wall_seconds * 1000:.1f}',
+        ])
+
+        repeated = profile.repeated_statements(self.n_plus_one_threshold)
+        if wall_seconds >= self.slow_seconds or repeated:
+            self._log_request(endpoint, response.status_code, profile, wall_seconds, repeated)
+
+    def _log_request(self, endpoint, status, profile, wall_seconds, repeated):
+        logger.warning(
+            '%s %s (%s) %s in %.0fms: %d queries in %.0fms, templates %.0fms%s',
+            request.method, request.full_path.rstrip('?'), endpoint, status, wall_seconds * 1000,
+            profile.queries, profile.sql_seconds * 1000, profile.template_seconds * 1000,
+            ''.join(f'\n  possible N+1, {count}x: {" ".join(statement.split())[:300]}'
+                    for count, statement in repeated),
+        )
+
+    # Exposition
+
+    def add_collector(self, collector):
+        """Serve collector(), more metrics in the Prometheus text format, after the request metrics"""
+        self.collectors.append(collector)
+
+    def render_metrics(self):
+        """Per-endpoint totals (when profiling) and the collectors' metrics in the Prometheus text exposition format"""
+        collected = ''.join(collector() for collector in self.collectors)
+        if not self.enabled:
+            return collected
+
+        with self.lock:
+            stats = sorted(self.stats.items())
+            snapshot = [(key, dict(vars(value), buckets=list(value.buckets))) for key, value in stats]
+
+        families = [
+            ('fyyur_requests_total', 'counter', 'Requests handled.', 'requests'),
+            ('fyyur_request_sql_queries_total', 'counter', 'SQL statements executed by requests.', 'queries'),
+            ('fyyur_request_sql_seconds_total', 'counter', 'Time spent executing SQL.', 'sql_seconds'),
+            ('fyyur_request_template_seconds_total', 'counter', 'Time spent rendering templates.', 'template_seconds'),
+        ]
+        lines = []
+        for name, kind, help_text, field in families:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+            for (endpoint, method, status), values in snapshot:
+                labels = f'endpoint="{_label(endpoint)}",method="{method}",status="{status}"'
+                lines.append(f'{name}{{{labels}}} {values[field]}')
+
+        name = 'fyyur_request_duration_seconds'
+        lines += [f'# HELP {name} Wall time of requests.', f'# TYPE {name} histogram']
+        for (endpoint, method, status), values in snapshot:
+            labels = f'endpoint="{_label(endpoint)}",method="{method}",status="{status}"'
+            for bound, count in zip(DURATION_BUCKETS, values['buckets']):
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {values["requests"]}')
+            lines.append(f'{name}_sum{{{labels}}} {values["wall_seconds"]}')
+            lines.append(f'{name}_count{{{labels}}} {values["requests"]}')
+
+        return '\n'.join(lines) + '\n' + collected
+
+    def metrics_view(self):
+        return Response(self.render_metrics(), mimetype='text/plain; version=0.0.4')
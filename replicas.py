@@ -0,0 +1,124 @@
+# ----------------------------------------------------------------------------#
+# Read replica routing.
+#
+# Views decorated with @replica_reads run their queries against one of the
+# SQLALCHEMY_REPLICA_URIS, picked per request round-robin or by fewest
+# connections in use (DB_REPLICA_SELECTION). Everything else, and any
+# statement that writes, goes to the primary.
+#
+# Replicas lag behind the primary, so a client that just wrote is pinned to
+# the primary for DB_REPLICA_PIN_SECONDS (e.g. the redirect to the venue page
+# after edit_venue_submission) through a timestamp in its session cookie.
+# Other clients may still read the old data until the replica catches up.
+# For the same DB_REPLICA_PIN_SECONDS after a tag is invalidated, what they
+# read from a replica isn't cached under it (ResponseCache.storable()).
+# ----------------------------------------------------------------------------#
+import functools
+import itertools
+import time
+
+from flask import current_app, g, has_request_context, session as client_session
+from flask_sqlalchemy import SignallingSession
+
+SELECTIONS = ('round_robin', 'least_connections')
+
+# Client session key holding the time until which its reads go to the primary
+PIN_KEY = '_read_primary_until'
+
+
+def replica_reads(view):
+    """Let the queries of a read-only view run on a replica"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        g.replica_reads = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def mark_primary_write():
+    """Record that the current request wrote to the primary, for writes that bypass the session's flush"""
+    if has_request_context():
+        g.wrote_primary = True
+
+
+def _in_use(engine):
+    stats = getattr(engine.pool, 'stats', None)
+    return stats.in_use if stats is not None else engine.pool.checkedout()
+
+
+class ReplicaRouter:
+    """Chooses the replica engine of the current request and pins clients that wrote to the primary"""
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        self.counter = itertools.count()
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db=None):
+        self.db = db or self.db
+        self.uris = list(app.config.get('SQLALCHEMY_REPLICA_URIS') or ())
+        self.selection = app.config.get('DB_REPLICA_SELECTION', 'round_robin')
+        if self.selection not in SELECTIONS:
+            raise ValueError(f'DB_REPLICA_SELECTION must be one of {", ".join(SELECTIONS)}, not {self.selection!r}')
+        self.pin_seconds = app.config.get('DB_REPLICA_PIN_SECONDS', 5)
+
+        # Replicas are binds without tables, so their engines get the same pool options as the primary
+        self.binds = [f'replica_{index}' for index in range(len(self.uris))]
+        binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+        binds.update(zip(self.binds, self.uris))
+        app.config['SQLALCHEMY_BINDS'] = binds
+
+        app.extensions['replica_router'] = self
+        app.after_request(self._pin_writers)
+
+    def engines(self):
+        return [self.db.get_engine(current_app, bind) for bind in self.binds]
+
+    def choose(self):
+        """Replica engine for a new request"""
+        engines = self.engines()
+        if self.selection == 'least_connections':
+            # Start at a rotating offset so ties don't all land on the first replica
+            offset = next(self.counter)
+            order = engines[offset % len(engines):] + engines[:offset % len(engines)]
+            return min(order, key=_in_use)
+        return engines[next(self.counter) % len(engines)]
+
+    def pinned(self):
+        return client_session.get(PIN_KEY, 0) > time.time()
+
+    def read_engine(self):
+        """Replica engine the current request reads from, or None to use the primary"""
+        if not self.binds or not has_request_context() or not g.get('replica_reads'):
+            return None
+        if g.get('wrote_primary') or self.pinned():
+            return None
+        if 'replica_engine' not in g:
+            g.replica_engine = self.choose()
+        return g.replica_engine
+
+    def _pin_writers(self, response):
+        if g.get('wrote_primary') and self.pin_seconds:
+            client_session[PIN_KEY] = time.time() + self.pin_seconds
+        return response
+
+
+def read_engine(db):
+    """Engine to read from in the current request: its replica, or db.engine"""
+    router = current_app.extensions.get('replica_router')
+    return (router.read_engine() if router is not None else None) or db.engine
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of @replica_reads views to a replica and everything else to the primary"""
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or getattr(clause, 'is_dml', False):
+            mark_primary_write()
+        else:
+            router = self.app.extensions.get('replica_router')
+            engine = router.read_engine() if router is not None else None
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
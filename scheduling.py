@@ -0,0 +1,306 @@
+# ----------------------------------------------------------------------------#
+# Bulk show scheduling.
+#
+# Creates many shows from one CSV (venue_id, artist_id, start_time and an
+# optional end_time column) or JSON (a list of objects, or {"shows": [...]})
+# upload, e.g. a whole tour:
+#
+#   curl -X POST --data-binary @tour.csv -H 'Content-Type: text/csv' /api/v1/shows
+#   flask schedule-shows tour.csv
+#
+# Every row is checked before anything is written: field formats row by row,
+# then all venue and artist ids of the upload in one query, then double
+# bookings. A show can't overlap another show of its venue or of its artist,
+# already booked or earlier in the upload: the booked shows of the upload's
+# venues and artists within its time span are loaded in one query into an
+# interval tree per venue and per artist, so each row is checked in
+# logarithmic time. The rows are inserted in batches inside a single
+# transaction, so an upload with an invalid row creates nothing unless
+# invalid rows are skipped, and every error is reported with its row number.
+# ----------------------------------------------------------------------------#
+import csv
+import io
+import json
+import sys
+from collections import namedtuple
+from collections import defaultdict
+from datetime import datetime
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import literal, select, union_all
+
+from intervals import IntervalTree
+from calendars import month_tags
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_DURATION, naive_utc, refresh_show_counters, shows_during
+
+SCHEDULE_FORMATS = ('csv', 'json')
+SCHEDULE_COLUMNS = ('venue_id', 'artist_id', 'start_time')
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_ROWS = 10000
+
+# Row numbers start at 1 with the first show, not counting a CSV header
+ShowRow = namedtuple('ShowRow', ['number', 'venue_id', 'artist_id', 'start_time', 'end_time'])
+RowError = namedtuple('RowError', ['row', 'errors'])
+# calendar_tags are those of the venue and artist calendar months that got shows
+ScheduleResult = namedtuple('ScheduleResult', ['created', 'errors', 'venue_ids', 'artist_ids', 'calendar_tags'])
+
+
+class ScheduleError(ValueError):
+    """The upload as a whole can't be read"""
+
+
+def read_show_records(text, schedule_format, max_rows=DEFAULT_MAX_ROWS):
+    """Records (dicts) of an uploaded CSV or JSON document"""
+    if schedule_format == 'csv':
+        reader = csv.DictReader(io.StringIO(text))
+        missing = [column for column in SCHEDULE_COLUMNS if column not in (reader.fieldnames or ())]
+        if missing:
+            raise ScheduleError(f'CSV header is missing {", ".join(missing)}')
+        records = list(reader)
+    else:
+        try:
+            records = json.loads(text)
+        except ValueError as error:
+            raise ScheduleError(f'Invalid JSON: {error}')
+        if isinstance(records, dict):
+            records = records.get('shows')
+        if not isinstance(records, list):
+            raise ScheduleError('JSON must be a list of shows or an object with a "shows" list')
+
+    if not records:
+        raise ScheduleError('No shows to schedule')
+    if len(records) > max_rows:
+        raise ScheduleError(f'{len(records)} shows in one upload, the limit is {max_rows}')
+    return records
+
+
+def _parse_id(value):
+    if isinstance(value, bool):
+        raise ValueError
+    number = int(value)
+    if number < 1 or (isinstance(value, float) and value != number):
+        raise ValueError
+    return number
+
+
+def _parse_time(value):
+    """Naive UTC datetime like the stored show times, offsets converted"""
+    return naive_utc(value)
+
+
+def check_show_record(number, record):
+    """(ShowRow, None) for a well-formed record, (None, {field: message}) otherwise"""
+    if not isinstance(record, dict):
+        return None, {'row': 'must be an object with venue_id, artist_id and start_time'}
+
+    errors = {}
+    values = {}
+    for field, parse, message in (
+        ('venue_id', _parse_id, 'must be a positive integer'),
+        ('artist_id', _parse_id, 'must be a positive integer'),
+        ('start_time', _parse_time, 'must be an ISO 8601 date and time'),
+        ('end_time', _parse_time, 'must be an ISO 8601 date and time'),
+    ):
+        value = record.get(field)
+        if value is None or value == '':
+            if field != 'end_time':
+                errors[field] = 'is required'
+            continue
+        try:
+            values[field] = parse(value)
+        except (TypeError, ValueError, AttributeError, OverflowError):
+            errors[field] = message
+    if 'start_time' in values:
+        values.setdefault('end_time', values['start_time'] + DEFAULT_SHOW_DURATION)
+        if values['end_time'] <= values['start_time']:
+            errors['end_time'] = 'must be after start_time'
+    if errors:
+        return None, errors
+    return ShowRow(number, **values), None
+
+
+def existing_ids(connection, venue_ids, artist_ids):
+    """(venue ids, artist ids) that exist among the given ones, from a single query"""
+    query = union_all(
+        select(literal('venue').label('kind'), Venue.id).where(Venue.id.in_(venue_ids)),
+        select(literal('artist').label('kind'), Artist.id).where(Artist.id.in_(artist_ids)),
+    )
+    found = {'venue': set(), 'artist': set()}
+    for kind, entity_id in connection.execute(query):
+        found[kind].add(entity_id)
+    return found['venue'], found['artist']
+
+
+def booked_shows_query(venue_ids, artist_ids, start, end, dialect_name='postgresql'):
+    """(kind, venue or artist id, show id, start_time, end_time) of the shows of the venues and the artists
+    overlapping [start, end)
+    """
+    def overlapping(kind, key, ids):
+        return select(literal(kind).label('kind'), key, Show.id, Show.start_time, Show.end_time) \
+            .where(key.in_(ids)).where(shows_during(start, end, dialect_name))
+
+    return union_all(
+        overlapping('venue', Show.venue_id, venue_ids),
+        overlapping('artist', Show.artist_id, artist_ids),
+    )
+
+
+def lock_calendars(connection, venue_ids, artist_ids):
+    """Make concurrent schedulings of the same venues or artists wait for this transaction
+
+    Otherwise two uploads could each check the calendars before the other's
+    shows are inserted. SQLite has a single writer already.
+    """
+    if connection.dialect.name != 'postgresql':
+        return
+    # FOR NO KEY UPDATE, the lock the counter updates take anyway, in id order against deadlocks
+    for model, ids in ((Venue, venue_ids), (Artist, artist_ids)):
+        connection.execute(
+            select(model.id).where(model.id.in_(ids)).order_by(model.id).with_for_update(key_share=True)
+        ).all()
+
+
+def _booking(kind, entity_id, start, end, booked_by):
+    day = start.strftime('%Y-%m-%d')
+    until = end.strftime('%H:%M') if end.date() == start.date() else end.strftime('%Y-%m-%d %H:%M')
+    return f'{kind} {entity_id} is already booked on {day} from {start:%H:%M} to {until} by {booked_by}'
+
+
+def find_double_bookings(connection, rows):
+    """(ShowRows booking free times, RowErrors of the others)
+
+    Rows are taken in order, a row conflicting with an earlier one of the
+    upload is the one reported.
+    """
+    if not rows:
+        return [], []
+    venue_ids = {row.venue_id for row in rows}
+    artist_ids = {row.artist_id for row in rows}
+    lock_calendars(connection, venue_ids, artist_ids)
+
+    calendars = defaultdict(IntervalTree)
+    booked = connection.execute(booked_shows_query(
+        venue_ids, artist_ids, min(row.start_time for row in rows), max(row.end_time for row in rows),
+        connection.dialect.name,
+    ))
+    for kind, entity_id, show_id, start_time, end_time in booked:
+        # Imports aren't checked, an empty show there can't conflict anyway
+        if start_time < end_time:
+            calendars[kind, entity_id].add(start_time, end_time, f'show {show_id}')
+
+    free, errors = [], []
+    for row in rows:
+        row_errors = {}
+        for field, kind, entity_id in (('venue_id', 'venue', row.venue_id), ('artist_id', 'artist', row.artist_id)):
+            booking = calendars[kind, entity_id].find(row.start_time, row.end_time)
+            if booking is not None:
+                row_errors[field] = _booking(kind, entity_id, *booking)
+        if row_errors:
+            errors.append(RowError(row.number, row_errors))
+            continue
+        calendars['venue', row.venue_id].add(row.start_time, row.end_time, f'row {row.number}')
+        calendars['artist', row.artist_id].add(row.start_time, row.end_time, f'row {row.number}')
+        free.append(row)
+    return free, errors
+
+
+def validate_show_records(connection, records):
+    """(valid ShowRows, RowErrors) of the records"""
+    rows, errors = [], []
+    for number, record in enumerate(records, 1):
+        row, row_errors = check_show_record(number, record)
+        if row_errors:
+            errors.append(RowError(number, row_errors))
+        else:
+            rows.append(row)
+
+    venues, artists = existing_ids(connection, {row.venue_id for row in rows}, {row.artist_id for row in rows})
+    valid = []
+    for row in rows:
+        row_errors = {}
+        if row.venue_id not in venues:
+            row_errors['venue_id'] = f'venue {row.venue_id} does not exist'
+        if row.artist_id not in artists:
+            row_errors['artist_id'] = f'artist {row.artist_id} does not exist'
+        if row_errors:
+            errors.append(RowError(row.number, row_errors))
+        else:
+            valid.append(row)
+
+    valid, conflicts = find_double_bookings(connection, valid)
+    errors.extend(conflicts)
+    errors.sort()
+    return valid, errors
+
+
+def schedule_shows(connection, records, batch_size=DEFAULT_BATCH_SIZE, skip_invalid=False):
+    """Insert the shows of records on connection, in its current transaction
+
+    With an invalid record nothing is inserted, unless skip_invalid is set
+    and then only the valid ones are. Returns a ScheduleResult.
+    """
+    rows, errors = validate_show_records(connection, records)
+    if errors and not skip_invalid:
+        return ScheduleResult(0, errors, set(), set(), set())
+
+    updated_at = datetime.utcnow()
+    values = [
+        {'venue_id': row.venue_id, 'artist_id': row.artist_id, 'start_time': row.start_time,
+         'end_time': row.end_time, 'updated_at': updated_at}
+        for row in rows
+    ]
+    for start in range(0, len(values), batch_size):
+        connection.execute(Show.__table__.insert(), values[start:start + batch_size])
+
+    venue_ids = {row.venue_id for row in rows}
+    artist_ids = {row.artist_id for row in rows}
+    calendar_tags = {
+        tag
+        for row in rows
+        for kind, entity_id in (('venue', row.venue_id), ('artist', row.artist_id))
+        for tag in month_tags(kind, entity_id, row.start_time, row.end_time)
+    }
+    # Core inserts bypass the ORM events that keep the counters
+    if rows:
+        refresh_show_counters(connection, venue_ids=venue_ids, artist_ids=artist_ids)
+    return ScheduleResult(len(rows), errors, venue_ids, artist_ids, calendar_tags)
+
+
+def invalidate_scheduled_pages(result):
+    """Drop the cached pages and calendar months showing the venues and artists that got shows"""
+    if result.created:
+        current_app.extensions['response_cache'].invalidate(
+            'venues', 'shows',
+            *(f'venue:{venue_id}' for venue_id in result.venue_ids),
+            *(f'artist:{artist_id}' for artist_id in result.artist_ids),
+            *result.calendar_tags,
+        )
+
+
+@click.command('schedule-shows')
+@click.argument('source', type=click.File('r', encoding='utf-8'))
+@click.option('--format', 'schedule_format', type=click.Choice(SCHEDULE_FORMATS),
+              help='Input format, guessed from the file extension by default.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Rows per INSERT.')
+@click.option('--skip-invalid', is_flag=True, help='Create the valid shows even if some rows are invalid.')
+@with_appcontext
+def schedule_command(source, schedule_format, batch_size, skip_invalid):
+    """Create the shows listed in SOURCE, a CSV or JSON file ('-' for standard input)."""
+    schedule_format = schedule_format or ('json' if source.name.endswith('.json') else 'csv')
+    try:
+        records = read_show_records(source.read(), schedule_format, max_rows=sys.maxsize)
+    except ScheduleError as error:
+        raise click.ClickException(str(error))
+
+    with db.engine.begin() as connection:
+        result = schedule_shows(connection, records, batch_size=batch_size, skip_invalid=skip_invalid)
+    invalidate_scheduled_pages(result)
+
+    for error in result.errors:
+        messages = '; '.join(f'{field} {message}' for field, message in error.errors.items())
+        click.echo(f'row {error.row}: {messages}', err=True)
+    click.echo(f'Created {result.created} shows' + (f', {len(result.errors)} rows invalid' if result.errors else ''))
+    if result.errors:
+        sys.exit(1)
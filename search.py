@@ -0,0 +1,204 @@
+# ----------------------------------------------------------------------------#
+# Name search.
+#
+# On PostgreSQL the substring match is answered by the pg_trgm GIN indexes on
+# venues.name / artists.name and ranked with similarity(). Other databases
+# (SQLite test runs) fall back to an in-process trigram index that is built
+# from the table on first use, dropped whenever a row changes through the ORM
+# and rebuilt once older than SEARCH_INDEX_MAX_AGE seconds, which bounds how
+# long Core writes and other processes go unseen.
+# ----------------------------------------------------------------------------#
+import re
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from flask import current_app
+from sqlalchemy import case, event, func, literal, select, union_all
+
+from models import db, Venue, Artist, SEARCH_CONFIG
+
+DEFAULT_SEARCH_LIMIT = 50
+DEFAULT_SEARCH_PAGE_SIZE = 20
+DEFAULT_INDEX_MAX_AGE = 60
+
+NameMatch = namedtuple('NameMatch', ['id', 'name'])
+SearchHit = namedtuple('SearchHit', ['kind', 'id', 'name', 'city', 'state', 'rank'])
+SearchPage = namedtuple('SearchPage', ['term', 'page', 'per_page', 'total', 'hits'])
+
+_WORD_SPLIT = re.compile(r'\W+')
+
+
+def trigrams(text):
+    """Raw trigrams of the lower-cased text, used to find substring candidates"""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def word_trigrams(text):
+    """pg_trgm style trigrams: every word padded with two leading and one trailing space"""
+    grams = set()
+    for word in _WORD_SPLIT.split(text.lower()):
+        if word:
+            padded = '  ' + word + ' '
+            grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(a, b):
+    """Share of trigrams two sets have in common, the same measure as pg_trgm's similarity()"""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class NgramIndex:
+    """In-memory trigram index over (id, name) pairs"""
+
+    def __init__(self, rows, loaded_at=None):
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+        self.names = {}
+        self.word_grams = {}
+        self.postings = defaultdict(set)
+
+        for row_id, name in rows:
+            name = name or ''
+            self.names[row_id] = name
+            self.word_grams[row_id] = word_trigrams(name)
+            for gram in trigrams(name):
+                self.postings[gram].add(row_id)
+
+    def candidates(self, term):
+        grams = trigrams(term)
+        if not grams:
+            # Terms shorter than a trigram can't use the postings
+            return self.names.keys()
+
+        # Intersect the smallest posting lists first
+        postings = sorted((self.postings.get(gram, set()) for gram in grams), key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result &= posting
+            if not result:
+                break
+        return result
+
+    def search(self, term, limit=DEFAULT_SEARCH_LIMIT):
+        """Ids of the names containing term, best matches first"""
+        needle = term.lower()
+        term_grams = word_trigrams(term)
+
+        matches = [row_id for row_id in self.candidates(term) if needle in self.names[row_id].lower()]
+        matches.sort(key=lambda row_id: (
+            -similarity(term_grams, self.word_grams[row_id]),
+            self.names[row_id].lower(),
+            row_id,
+        ))
+        return matches[:limit] if limit else matches
+
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def _index_for(model):
+    key = (str(db.engine.url), model.__tablename__)
+    max_age = current_app.config.get('SEARCH_INDEX_MAX_AGE', DEFAULT_INDEX_MAX_AGE)
+    index = _indexes.get(key)
+    if index is None or time.monotonic() - index.loaded_at > max_age:
+        with _lock:
+            index = _indexes.get(key)
+            if index is None or time.monotonic() - index.loaded_at > max_age:
+                index = _indexes[key] = NgramIndex(db.session.query(model.id, model.name))
+    return index
+
+
+def invalidate_name_index(model=None):
+    """Drop the in-process index of model (or of every model) so it's rebuilt on the next search"""
+    for key in list(_indexes):
+        if model is None or key[1] == model.__tablename__:
+            del _indexes[key]
+
+
+def _uses_trigram_indexes():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def search_names(model, term, limit=None):
+    """Return NameMatch rows of model whose name contains term, best matches first"""
+    term = term.strip()
+    if limit is None:
+        limit = current_app.config.get('SEARCH_RESULT_LIMIT', DEFAULT_SEARCH_LIMIT)
+
+    if _uses_trigram_indexes():
+        query = db.session.query(model.id, model.name)
+        if term:
+            # ilike on a gin_trgm_ops indexed column is an index scan, not a sequential one
+            query = query.filter(model.name.ilike(f"%{term}%")) \
+                .order_by(func.similarity(model.name, term).desc())
+        return [NameMatch(*row) for row in query.order_by(model.name, model.id).limit(limit)]
+
+    index = _index_for(model)
+    return [NameMatch(row_id, index.names[row_id]) for row_id in index.search(term, limit)]
+
+
+def _on_name_change(mapper, connection, target):
+    invalidate_name_index(mapper.class_)
+
+
+for _model in (Venue, Artist):
+    for _event in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event, _on_name_change)
+
+
+# ----------------------------------------------------------------------------#
+# Full-text search over venues and artists.
+#
+# Matches name, genres, city, state and seeking description through the
+# search_vector columns maintained in models.py.
+# ----------------------------------------------------------------------------#
+
+def _ranked_select(model, kind, term, dialect_name):
+    columns = [literal(kind).label('kind'), model.id, model.name, model.city, model.state]
+
+    if dialect_name == 'postgresql':
+        tsquery = func.plainto_tsquery(SEARCH_CONFIG, term)
+        return select(*columns, func.ts_rank(model.search_vector, tsquery).label('rank')) \
+            .where(model.search_vector.op('@@')(tsquery))
+
+    # Plain text fallback: every word must appear in the document, name hits rank higher
+    words = [word for word in _WORD_SPLIT.split(term.lower()) if word]
+    rank = sum(case((func.lower(model.name).like(f'%{word}%'), 1.0), else_=0.4) for word in words)
+    return select(*columns, rank.label('rank')) \
+        .where(*[model.search_vector.like(f'%{word}%') for word in words])
+
+
+def full_text_search(term, page=1, per_page=None):
+    """Relevance-ranked page of venues and artists matching term, fetched with a single query"""
+    term = term.strip()
+    page = max(page, 1)
+    if per_page is None:
+        per_page = current_app.config.get('SEARCH_PAGE_SIZE', DEFAULT_SEARCH_PAGE_SIZE)
+    if not _WORD_SPLIT.sub('', term):
+        return SearchPage(term, page, per_page, 0, [])
+
+    dialect_name = db.engine.dialect.name
+    hits = union_all(
+        _ranked_select(Venue, 'venue', term, dialect_name),
+        _ranked_select(Artist, 'artist', term, dialect_name),
+    ).subquery()
+
+    query = select(hits, func.count().over().label('total')) \
+        .order_by(hits.c.rank.desc(), hits.c.name, hits.c.kind, hits.c.id) \
+        .limit(per_page) \
+        .offset((page - 1) * per_page)
+    rows = db.session.execute(query).all()
+
+    if rows:
+        total = rows[0].total
+    else:
+        # count() over () has no row to ride on past the last page
+        total = db.session.execute(select(func.count()).select_from(hits)).scalar() if page > 1 else 0
+    return SearchPage(term, page, per_page, total, [
+        SearchHit(row.kind, row.id, row.name, row.city, row.state, row.rank) for row in rows
+    ])
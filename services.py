@@ -0,0 +1,295 @@
+# ----------------------------------------------------------------------------#
+# Query services shared by the controllers.
+# ----------------------------------------------------------------------------#
+import base64
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+from itertools import groupby
+
+from sqlalchemy import case, func, tuple_
+from sqlalchemy.orm import joinedload, selectinload
+
+from models import db, Artist, Venue, Show
+
+ShowsPage = namedtuple('ShowsPage', ['shows', 'next_cursor'])
+EntityPage = namedtuple('EntityPage', ['items', 'next_cursor'])
+PageValidators = namedtuple('PageValidators', ['etag', 'last_modified'])
+
+
+def venue_directory_rows(city=None, state=None):
+    """Venues with their upcoming show counts, ordered by area, read from the denormalized counters"""
+    query = db.session.query(
+        Venue.id,
+        Venue.name,
+        Venue.city,
+        Venue.state,
+        Venue.upcoming_shows_count.label('num_upcoming_shows'),
+    )
+
+    if city:
+        query = query.filter(Venue.city == city)
+    if state:
+        query = query.filter(Venue.state == state)
+
+    return query.order_by(Venue.state, Venue.city, Venue.name, Venue.id)
+
+
+def group_venues_by_area(rows):
+    """Lazily group ordered directory rows into {city, state, venues} areas for the template"""
+    for (city, state), area_rows in groupby(rows, key=lambda row: (row.city, row.state)):
+        yield {
+            "city": city,
+            "state": state,
+            "venues": [{
+                "id": row.id,
+                "name": row.name,
+                "num_upcoming_shows": row.num_upcoming_shows
+            } for row in area_rows]
+        }
+
+
+def upcoming_show_counts_query(model, ids):
+    return db.session.query(model.id, model.upcoming_shows_count).filter(model.id.in_(ids))
+
+
+def upcoming_show_counts(model, ids):
+    """Map every id in ids to its number of upcoming shows, read from the denormalized counters"""
+    ids = list(ids)
+    if not ids:
+        return {}
+
+    counts = dict.fromkeys(ids, 0)
+    counts.update(upcoming_show_counts_query(model, ids))
+    return counts
+
+
+def upcoming_show_counts_by_venue(venue_ids):
+    return upcoming_show_counts(Venue, venue_ids)
+
+
+def upcoming_show_counts_by_artist(artist_ids):
+    return upcoming_show_counts(Artist, artist_ids)
+
+
+def search_results(matches, counts):
+    """Build the {count, data} payload the search templates expect"""
+    data = [{
+        "id": match.id,
+        "name": match.name,
+        "num_upcoming_shows": counts.get(match.id, 0)
+    } for match in matches]
+
+    return {
+        "count": len(data),
+        "data": data
+    }
+
+
+def encode_show_cursor(show):
+    """Opaque keyset cursor pointing just after show in (start_time, id) order"""
+    raw = f'{show.start_time.isoformat()}|{show.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_show_cursor(cursor):
+    """(start_time, id) of a cursor made by encode_show_cursor, None if it is malformed"""
+    try:
+        start_time, show_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(start_time), int(show_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def shows_page_query(cursor=None, when=None, start=None, end=None, now=None):
+    """Shows in keyset order with venue and artist columns eager loaded, see shows_page()"""
+    now = now or datetime.utcnow()
+    descending = when == 'past'
+
+    query = Show.query.options(
+        joinedload(Show.venue).load_only(Venue.id, Venue.name),
+        joinedload(Show.artist).load_only(Artist.id, Artist.name, Artist.image_link),
+    )
+
+    if when == 'upcoming':
+        query = query.filter(Show.start_time >= now)
+    elif when == 'past':
+        query = query.filter(Show.start_time < now)
+    if start:
+        query = query.filter(Show.start_time >= start)
+    if end:
+        query = query.filter(Show.start_time < end)
+
+    position = decode_show_cursor(cursor) if cursor else None
+    if position:
+        key = tuple_(Show.start_time, Show.id)
+        query = query.filter(key < position if descending else key > position)
+
+    if descending:
+        return query.order_by(Show.start_time.desc(), Show.id.desc())
+    return query.order_by(Show.start_time, Show.id)
+
+
+def shows_page(cursor=None, page_size=50, when=None, start=None, end=None, now=None):
+    """One page of shows in (start_time, id) order using keyset pagination
+
+    when is 'upcoming', 'past' or None for all shows. Past shows are listed
+    most recent first, everything else soonest first.
+    """
+    query = shows_page_query(cursor=cursor, when=when, start=start, end=end, now=now)
+
+    # Fetch one extra row to know whether there is a next page
+    shows = query.limit(page_size + 1).all()
+    next_cursor = encode_show_cursor(shows[page_size - 1]) if len(shows) > page_size else None
+
+    return ShowsPage(shows[:page_size], next_cursor)
+
+
+def encode_id_cursor(entity_id):
+    """Opaque keyset cursor pointing just after the row with entity_id in id order"""
+    return base64.urlsafe_b64encode(str(entity_id).encode()).decode()
+
+
+def decode_id_cursor(cursor):
+    """Id of a cursor made by encode_id_cursor, None if it is malformed"""
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def entities_page(model, cursor=None, page_size=50, city=None, state=None, with_genres=False):
+    """One page of venues or artists in id order using keyset pagination
+
+    Genres are only loaded, in one extra query, when with_genres is set.
+    """
+    query = model.query
+    if with_genres:
+        query = query.options(selectinload(model.genres))
+    if city:
+        query = query.filter(model.city == city)
+    if state:
+        query = query.filter(model.state == state)
+
+    position = decode_id_cursor(cursor) if cursor else None
+    if position is not None:
+        query = query.filter(model.id > position)
+
+    # Fetch one extra row to know whether there is a next page
+    items = query.order_by(model.id).limit(page_size + 1).all()
+    next_cursor = encode_id_cursor(items[page_size - 1].id) if len(items) > page_size else None
+
+    return EntityPage(items[:page_size], next_cursor)
+
+
+def split_shows(rows, now):
+    """Split rows ordered by start_time into (past, upcoming) around a single now
+
+    A show starting exactly at now counts as upcoming.
+    """
+    past = [row for row in rows if row.start_time < now]
+    upcoming = [row for row in rows if row.start_time >= now]
+    return past, upcoming
+
+
+def venue_shows_query(venue_id):
+    """Every show of a venue with the artist columns its page needs, ordered by start_time"""
+    return db.session.query(
+        Show.start_time,
+        Artist.id.label('artist_id'),
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+    ).join(Artist, Show.artist_id == Artist.id) \
+        .filter(Show.venue_id == venue_id) \
+        .order_by(Show.start_time, Show.id)
+
+
+def artist_shows_query(artist_id):
+    """Every show of an artist with the venue columns its page needs, ordered by start_time"""
+    return db.session.query(
+        Show.start_time,
+        Venue.id.label('venue_id'),
+        Venue.name.label('venue_name'),
+        Venue.image_link.label('venue_image_link'),
+    ).join(Venue, Show.venue_id == Venue.id) \
+        .filter(Show.artist_id == artist_id) \
+        .order_by(Show.start_time, Show.id)
+
+
+def load_venue_with_shows(venue_id, now=None):
+    """(venue, past_shows, upcoming_shows) with genres preloaded, or None if the venue doesn't exist
+
+    Costs three queries: the venue, its genres and its shows joined to the artist columns.
+    """
+    venue = Venue.query.options(selectinload(Venue.genres)).get(venue_id)
+    if venue is None:
+        return None
+
+    rows = venue_shows_query(venue_id).all()
+    return (venue,) + split_shows(rows, now or datetime.utcnow())
+
+
+def load_artist_with_shows(artist_id, now=None):
+    """(artist, past_shows, upcoming_shows) with genres preloaded, or None if the artist doesn't exist"""
+    artist = Artist.query.options(selectinload(Artist.genres)).get(artist_id)
+    if artist is None:
+        return None
+
+    rows = artist_shows_query(artist_id).all()
+    return (artist,) + split_shows(rows, now or datetime.utcnow())
+
+
+def _page_validators(kind, entity_id, row, salt):
+    """Strong ETag and Last-Modified of a detail page from its version row
+
+    The row holds the entity's updated_at, the latest updated_at of its
+    shows and of the other side of those shows, the show count and the
+    start of the most recent show that is already in the past. The last
+    one changes the ETag when an upcoming show becomes a past show.
+
+    Last-Modified only comes from the updated_at columns, all written with
+    the same UTC clock, so it never moves backwards. `flask counters roll`
+    bumps updated_at when shows become past, for clients that only send
+    If-Modified-Since.
+    """
+    updated_at, shows_updated_at, related_updated_at, show_count, last_past_start = row
+    stamps = [stamp for stamp in (updated_at, shows_updated_at, related_updated_at) if stamp]
+    if not stamps:
+        return None
+
+    fingerprint = repr((salt, kind, entity_id, tuple(row)))
+    return PageValidators(hashlib.sha1(fingerprint.encode()).hexdigest(), max(stamps))
+
+
+def venue_page_validators(venue_id, salt='', now=None):
+    """PageValidators of show_venue(venue_id) from one aggregate query, None if the venue doesn't exist"""
+    now = now or datetime.utcnow()
+    row = db.session.query(
+        Venue.updated_at,
+        func.max(Show.updated_at),
+        func.max(Artist.updated_at),
+        func.count(Show.id),
+        func.max(case((Show.start_time < now, Show.start_time))),
+    ).outerjoin(Show, Show.venue_id == Venue.id) \
+        .outerjoin(Artist, Show.artist_id == Artist.id) \
+        .filter(Venue.id == venue_id) \
+        .group_by(Venue.id, Venue.updated_at) \
+        .first()
+    return _page_validators('venue', venue_id, row, salt) if row else None
+
+
+def artist_page_validators(artist_id, salt='', now=None):
+    """PageValidators of show_artist(artist_id) from one aggregate query, None if the artist doesn't exist"""
+    now = now or datetime.utcnow()
+    row = db.session.query(
+        Artist.updated_at,
+        func.max(Show.updated_at),
+        func.max(Venue.updated_at),
+        func.count(Show.id),
+        func.max(case((Show.start_time < now, Show.start_time))),
+    ).outerjoin(Show, Show.artist_id == Artist.id) \
+        .outerjoin(Venue, Show.venue_id == Venue.id) \
+        .filter(Artist.id == artist_id) \
+        .group_by(Artist.id, Artist.updated_at) \
+        .first()
+    return _page_validators('artist', artist_id, row, salt) if row else None
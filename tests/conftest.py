@@ -0,0 +1,92 @@
+# ----------------------------------------------------------------------------#
+# Test setup.
+#
+# The app runs against a throwaway SQLite file seeded with the initial data
+# through populate_db.populate_orm(), the default seed path. The settings
+# below are environment variables read by config.py, so they are set before
+# the app is imported.
+# ----------------------------------------------------------------------------#
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEST_DIR = tempfile.mkdtemp(prefix='fyyur-tests-')
+PRIMARY_PATH = os.path.join(TEST_DIR, 'primary.db')
+os.environ.update(
+    DATABASE_URL='sqlite:///' + PRIMARY_PATH,
+    DATABASE_REPLICA_URLS='',
+    CACHE_TYPE='lru',
+    LOG_ERROR_FILE=os.path.join(TEST_DIR, 'error.log'),
+    LOG_ACCESS_FILE='',
+)
+
+from app import app as fyyur_app  # noqa: E402
+from config import INITIAL_DATA_PATH  # noqa: E402
+from genres import invalidate_genre_catalog  # noqa: E402
+from models import db, Show  # noqa: E402
+from populate_db import populate_orm  # noqa: E402
+from search import invalidate_name_index  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    fyyur_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return fyyur_app
+
+
+@pytest.fixture
+def seeded(app):
+    """The app with freshly created tables holding the initial data, and empty caches"""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        with open(INITIAL_DATA_PATH) as f:
+            populate_orm(json.load(f))
+        db.session.remove()
+    app.extensions['response_cache'].clear()
+    invalidate_genre_catalog()
+    invalidate_name_index()
+    return app
+
+
+@pytest.fixture
+def client(seeded):
+    return seeded.test_client()
+
+
+# ?from= / ?to= of WINDOW_SHOWS, 2029-12-31 19:00 to 21:00 UTC
+WINDOW = ('2030-01-01T00:00:00+05:00', '2030-01-01T02:00:00+05:00')
+
+
+@pytest.fixture
+def window_shows(seeded):
+    """A show of artist 5 just before WINDOW and one of artist 6 within it"""
+    with seeded.app_context():
+        db.session.add(Show(venue_id=1, artist_id=5, start_time=datetime(2029, 12, 31, 18)))
+        db.session.add(Show(venue_id=1, artist_id=6, start_time=datetime(2029, 12, 31, 20)))
+        db.session.commit()
+    return seeded
+
+
+@contextmanager
+def recorded_queries(engine):
+    """The list of SQL statements engine executes within the block"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
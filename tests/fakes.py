@@ -0,0 +1,43 @@
+# ----------------------------------------------------------------------------#
+# In-memory stand-ins for external services.
+# ----------------------------------------------------------------------------#
+import fnmatch
+import time
+
+
+class FakeRedis:
+    """The part of the redis-py client that cache.RedisCache uses, with expiry on a settable clock"""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.values = {}
+
+    def _live(self, key):
+        value, expires = self.values.get(key, (None, None))
+        if expires is not None and expires <= self.clock():
+            del self.values[key]
+            return None
+        return value
+
+    def get(self, key):
+        return self._live(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = (value if isinstance(value, bytes) else str(value).encode(),
+                            self.clock() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        return sum(self.values.pop(key, None) is not None for key in keys)
+
+    def incr(self, key):
+        count = int(self._live(key) or 0) + 1
+        # Like Redis, incrementing keeps the key's expiry
+        self.values[key] = (str(count).encode(), self.values.get(key, (None, None))[1])
+        return count
+
+    def mget(self, keys):
+        return [self._live(key) for key in keys]
+
+    def scan_iter(self, match='*'):
+        return [key for key in list(self.values) if fnmatch.fnmatchcase(key, match)]
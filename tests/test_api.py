@@ -0,0 +1,24 @@
+from conftest import WINDOW
+
+
+def test_shows_window_converts_offsets_to_utc(client, window_shows):
+    response = client.get('/api/v1/shows', query_string={
+        'from': WINDOW[0], 'to': WINDOW[1], 'fields': 'artist_id,start_time',
+    })
+    assert response.get_json()['data'] == [{'artist_id': 6, 'start_time': '2029-12-31T20:00:00'}]
+
+
+def test_routing_errors_are_json_under_the_api(client):
+    response = client.delete('/api/v1/venues')
+    assert response.status_code == 405
+    assert response.get_json()['error']['status'] == 405
+    assert 'GET' in response.headers['Allow']
+
+    response = client.get('/api/v1/nope')
+    assert response.status_code == 404
+    assert response.get_json()['error']['status'] == 404
+
+    response = client.delete('/venues')
+    assert response.status_code == 405
+    assert response.content_type.startswith('text/html')
+    assert client.get('/nope').status_code == 404
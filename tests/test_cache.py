@@ -0,0 +1,126 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from cache import LRUCache, RedisCache, ResponseCache
+from fakes import FakeRedis
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_backend(kind, clock, ttl=10, max_entries=3):
+    if kind == 'lru':
+        return LRUCache(max_entries=max_entries, default_ttl=ttl, clock=clock)
+    return RedisCache(FakeRedis(clock=clock), default_ttl=ttl)
+
+
+@pytest.fixture(params=['lru', 'redis'])
+def kind(request):
+    return request.param
+
+
+def test_entries_expire_after_their_ttl(kind):
+    clock = Clock()
+    backend = make_backend(kind, clock)
+    backend.set('short', 1, ttl=5)
+    backend.set('default', 2)
+
+    clock.now += 5
+    assert backend.get('short') is None
+    assert backend.get('default') == 2
+    clock.now += 5
+    assert backend.get('default') is None
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    backend = LRUCache(max_entries=3, clock=Clock())
+    for key in 'abc':
+        backend.set(key, key)
+    backend.get('a')
+    backend.set('d', 'd')
+
+    assert backend.get('b') is None
+    assert [backend.get(key) for key in 'acd'] == ['a', 'c', 'd']
+
+
+def test_lru_keeps_tag_counters_through_eviction():
+    backend = LRUCache(max_entries=1, clock=Clock())
+    cache = ResponseCache(backend=backend)
+    cache.invalidate('venue:1')
+    for key in 'abc':
+        backend.set(key, key)
+    assert backend.get_counters(['tag:venue:1']) == [1]
+
+
+def test_invalidating_a_tag_drops_the_entries_built_against_it(kind):
+    cache = ResponseCache(backend=make_backend(kind, Clock()))
+    cache.set('page', ['venue:1', 'shows'], 'body')
+    assert cache.get('page', ['venue:1', 'shows']) == 'body'
+
+    cache.invalidate('venue:2')
+    assert cache.get('page', ['venue:1', 'shows']) == 'body'
+    cache.invalidate('shows')
+    assert cache.get('page', ['venue:1', 'shows']) is None
+
+
+def test_get_or_set_produces_once_per_tag_version(kind):
+    cache = ResponseCache(backend=make_backend(kind, Clock()))
+    calls = []
+
+    def producer():
+        calls.append(1)
+        return len(calls)
+
+    assert cache.get_or_set('fragment', ['home'], producer) == 1
+    assert cache.get_or_set('fragment', ['home'], producer) == 1
+    cache.invalidate('home')
+    assert cache.get_or_set('fragment', ['home'], producer) == 2
+
+
+def test_get_or_set_many_only_produces_the_missing_keys(kind):
+    cache = ResponseCache(backend=make_backend(kind, Clock()))
+    entries = {'a': ['tag:a'], 'b': ['tag:b']}
+    assert cache.get_or_set_many(entries, lambda missing: {key: key.upper() for key in missing}) == \
+        {'a': 'A', 'b': 'B'}
+
+    cache.invalidate('tag:b')
+    produced = []
+    values = cache.get_or_set_many(entries, lambda missing: produced.extend(missing) or {'b': 'B2'})
+    assert produced == ['b']
+    assert values == {'a': 'A', 'b': 'B2'}
+
+
+@pytest.fixture
+def app_cache(seeded, kind):
+    """The app's response cache on a fresh backend of kind"""
+    cache = seeded.extensions['response_cache']
+    backend = cache.backend
+    cache.backend = make_backend(kind, Clock(), ttl=300, max_entries=100)
+    yield cache
+    cache.backend = backend
+
+
+def test_creating_a_show_invalidates_its_venue_artist_and_show_pages(client, app_cache):
+    pages = ['/venues/1', '/artists/4', '/shows']
+    for url in pages + ['/venues/2']:
+        assert client.get(url).headers['X-Cache'] == 'MISS'
+    for url in pages + ['/venues/2']:
+        assert client.get(url).headers['X-Cache'] == 'HIT'
+
+    start_time = (datetime.utcnow() + timedelta(days=400)).replace(hour=20, minute=0, second=0, microsecond=0)
+    response = client.post('/shows/create', data={
+        'venue_id': '1', 'artist_id': '4', 'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    assert b'Show was successfully listed!' in response.data
+
+    for url in pages:
+        response = client.get(url)
+        assert response.headers['X-Cache'] == 'MISS', url
+    assert client.get('/venues/2').headers['X-Cache'] == 'HIT'
+    assert client.get('/venues/1').headers['X-Cache'] == 'HIT'
@@ -0,0 +1,100 @@
+import json
+
+from conftest import recorded_queries
+from models import db
+
+
+def _calendar(client, kind, entity_id, start, end):
+    return client.get(f'/api/v1/{kind}s/{entity_id}/calendar', query_string={'from': start, 'to': end})
+
+
+def _busy(client, kind, entity_id, start, end):
+    response = _calendar(client, kind, entity_id, start, end)
+    assert response.status_code == 200
+    return [(booking['start_time'], booking['end_time']) for booking in response.get_json()['data']['busy']]
+
+
+def _queries(client, kind, entity_id, start, end):
+    """SQL statements of one calendar request"""
+    with client.application.app_context():
+        engine = db.engine
+    with recorded_queries(engine) as statements:
+        assert _calendar(client, kind, entity_id, start, end).status_code == 200
+    return statements
+
+
+def _schedule(client, *shows):
+    response = client.post('/api/v1/shows', data=json.dumps(list(shows)), content_type='application/json')
+    assert response.status_code == 201, response.get_json()
+
+
+def test_busy_and_free(client):
+    data = _calendar(client, 'venue', 3, '2035-04-01T12:00:00', '2035-04-09').get_json()['data']
+    assert data['venue_id'] == 3
+    assert data['busy'] == [
+        {'show_id': 3, 'artist_id': 6, 'start_time': '2035-04-01T20:00:00', 'end_time': '2035-04-01T22:00:00'},
+        {'show_id': 4, 'artist_id': 6, 'start_time': '2035-04-08T20:00:00', 'end_time': '2035-04-08T22:00:00'},
+    ]
+    assert data['free'] == [
+        {'start_time': '2035-04-01T12:00:00', 'end_time': '2035-04-01T20:00:00'},
+        {'start_time': '2035-04-01T22:00:00', 'end_time': '2035-04-08T20:00:00'},
+        {'start_time': '2035-04-08T22:00:00', 'end_time': '2035-04-09T00:00:00'},
+    ]
+
+    data = _calendar(client, 'artist', 6, '2035-04-08T21:00:00', '2035-04-08T21:30:00').get_json()['data']
+    assert [booking['venue_id'] for booking in data['busy']] == [3]
+    assert data['free'] == []
+
+
+def test_show_across_a_month_boundary(client):
+    _schedule(client, {'venue_id': 2, 'artist_id': 5, 'start_time': '2031-01-31T23:00:00'})
+    show = ('2031-01-31T23:00:00', '2031-02-01T01:00:00')
+
+    assert _busy(client, 'venue', 2, '2031-01-01', '2031-02-01') == [show]
+    assert _busy(client, 'venue', 2, '2031-02-01', '2031-03-01') == [show]
+    # Listed once for a window over both months
+    assert _busy(client, 'artist', 5, '2031-01-15', '2031-02-15') == [show]
+    data = _calendar(client, 'venue', 2, '2031-02-01', '2031-02-02').get_json()['data']
+    assert data['free'] == [{'start_time': '2031-02-01T01:00:00', 'end_time': '2031-02-02T00:00:00'}]
+
+
+def test_unknown_entity(client):
+    assert _calendar(client, 'venue', 99, '2035-04-01', '2035-05-01').status_code == 404
+    assert _calendar(client, 'artist', 1, '2035-04-01', '2035-05-01').status_code == 404
+    # Not cached as an empty calendar
+    assert _calendar(client, 'venue', 99, '2035-04-01', '2035-05-01').status_code == 404
+
+
+def test_warm_months_run_no_query(client):
+    assert _queries(client, 'venue', 3, '2035-03-01', '2035-05-01')
+    assert _queries(client, 'venue', 3, '2035-03-01', '2035-05-01') == []
+    # Any window within the cached months
+    assert _queries(client, 'venue', 3, '2035-04-08', '2035-04-09') == []
+
+
+def test_scheduling_invalidates_only_the_overlapped_months(client):
+    for kind, entity_id in (('venue', 1), ('artist', 4)):
+        for month in ('2031-01', '2031-02', '2031-03'):
+            assert _busy(client, kind, entity_id, f'{month}-01', f'{month}-28') == []
+
+    _schedule(client, {'venue_id': 1, 'artist_id': 4, 'start_time': '2031-02-10T20:00:00'})
+
+    for kind, entity_id in (('venue', 1), ('artist', 4)):
+        assert _queries(client, kind, entity_id, '2031-01-01', '2031-01-28') == []
+        assert _queries(client, kind, entity_id, '2031-03-01', '2031-03-28') == []
+        assert _busy(client, kind, entity_id, '2031-02-01', '2031-02-28') == [('2031-02-10T20:00:00',
+                                                                               '2031-02-10T22:00:00')]
+    # Other calendars stay cached
+    assert _busy(client, 'venue', 2, '2031-02-01', '2031-02-28') == []
+    _schedule(client, {'venue_id': 3, 'artist_id': 6, 'start_time': '2031-02-11T20:00:00'})
+    assert _queries(client, 'venue', 1, '2031-02-01', '2031-02-28') == []
+
+
+def test_deleting_a_venue_invalidates_its_calendars(client):
+    assert len(_busy(client, 'venue', 3, '2035-04-01', '2035-05-01')) == 3
+    assert len(_busy(client, 'artist', 6, '2035-04-01', '2035-05-01')) == 3
+
+    assert client.delete('/venues/3').status_code == 302
+
+    assert _calendar(client, 'venue', 3, '2035-04-01', '2035-05-01').status_code == 404
+    assert _busy(client, 'artist', 6, '2035-04-01', '2035-05-01') == []
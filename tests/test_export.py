@@ -0,0 +1,18 @@
+import json
+
+from conftest import WINDOW
+
+
+def _artist_ids(ndjson):
+    return [json.loads(line)['artist_id'] for line in ndjson.splitlines() if line]
+
+
+def test_export_window_converts_offsets_to_utc(client, window_shows):
+    response = client.get('/api/v1/export/shows', query_string={'from': WINDOW[0], 'to': WINDOW[1]})
+    assert _artist_ids(response.get_data(as_text=True)) == [6]
+
+
+def test_export_command_window_converts_offsets_to_utc(window_shows):
+    result = window_shows.test_cli_runner().invoke(args=['export', 'shows', '--from', WINDOW[0], '--to', WINDOW[1]])
+    assert result.exit_code == 0, result.output
+    assert _artist_ids(result.output) == [6]
@@ -0,0 +1,105 @@
+from conftest import recorded_queries
+from genres import genre_catalog
+from models import db, Artist, Genre, Venue
+
+ARTIST_FORM = {
+    'name': 'Guns N Petals', 'city': 'San Francisco', 'state': 'CA', 'phone': '326-123-5000',
+    'facebook_link': '', 'image_link': '', 'website_link': '',
+}
+VENUE_FORM = {
+    'name': 'The Musical Hop', 'address': '1015 Folsom Street', 'city': 'San Francisco', 'state': 'CA',
+    'phone': '123-123-1234', 'facebook_link': '', 'image_link': '', 'website_link': '', 'seeking_description': '',
+}
+
+
+def test_catalog_reloads_after_a_genre_commit(seeded):
+    with seeded.app_context():
+        catalog = genre_catalog()
+        db.session.add(Genre(name='Ska'))
+        db.session.commit()
+        assert genre_catalog() is not catalog
+        assert 'Ska' in genre_catalog()
+
+        catalog = genre_catalog()
+        Genre.query.filter_by(name='Ska').one().name = 'Two Tone'
+        db.session.commit()
+        assert genre_catalog() is not catalog
+        assert 'Two Tone' in genre_catalog() and 'Ska' not in genre_catalog()
+
+
+def test_rolled_back_genre_change_keeps_the_catalog(seeded):
+    with seeded.app_context():
+        catalog = genre_catalog()
+        db.session.add(Genre(name='Ska'))
+        db.session.flush()
+        db.session.rollback()
+        db.session.commit()
+        assert genre_catalog() is catalog
+
+
+def test_backref_append_keeps_the_catalog(seeded):
+    with seeded.app_context():
+        catalog = genre_catalog()
+        jazz = Genre.query.filter_by(name='Jazz').one()
+        jazz.artists  # loaded, so the append below also changes jazz.artists and makes jazz dirty
+        artist = Artist.query.get(4)
+        artist.genres.append(jazz)
+        assert jazz in db.session.dirty
+        db.session.commit()
+        assert genre_catalog() is catalog
+
+
+def test_instances_run_no_query(seeded):
+    with seeded.app_context():
+        catalog = genre_catalog()
+        with recorded_queries(db.engine) as statements:
+            jazz, folk = catalog.instances(db.session, ['Jazz', 'Folk'])
+        assert statements == []
+        assert (jazz.id, jazz.name, folk.id, folk.name) == (1, 'Jazz', 5, 'Folk')
+
+        # An instance already in the session is the one assigned
+        classical = Genre.query.get(4)
+        assert catalog.instances(db.session, ['Classical']) == [classical]
+
+        artist = Artist.query.get(4)
+        artist.genres = [jazz, folk]
+        db.session.commit()
+        db.session.expire_all()
+        assert sorted(genre.name for genre in Artist.query.get(4).genres) == ['Folk', 'Jazz']
+
+
+def test_edit_artist_with_an_unknown_genre(client):
+    response = client.post('/artists/4/edit', data=dict(ARTIST_FORM, name='Renamed', genres=['Jazz', 'Polka']),
+                           follow_redirects=True)
+    assert response.request.path == '/artists/4/edit'
+    assert 'Invalid genre(s): Polka. Artist Guns N Petals could not be updated.' in response.get_data(as_text=True)
+    with client.application.app_context():
+        artist = Artist.query.get(4)
+        assert artist.name == 'Guns N Petals'
+        assert [genre.name for genre in artist.genres] == ['Rock n Roll']
+
+
+def test_edit_artist_genres(client):
+    response = client.post('/artists/4/edit', data=dict(ARTIST_FORM, genres=['Jazz', 'Folk']))
+    assert response.status_code == 302
+    with client.application.app_context():
+        assert sorted(genre.name for genre in Artist.query.get(4).genres) == ['Folk', 'Jazz']
+
+
+def test_edit_venue_with_an_unknown_genre(client):
+    response = client.post('/venues/1/edit', data=dict(VENUE_FORM, name='Renamed', genres=['Polka', 'Jazz', 'Bebop']),
+                           follow_redirects=True)
+    assert response.request.path == '/venues/1/edit'
+    assert 'Invalid genre(s): Bebop, Polka. Venue The Musical Hop could not be updated.' in \
+        response.get_data(as_text=True)
+    with client.application.app_context():
+        venue = Venue.query.get(1)
+        assert venue.name == 'The Musical Hop'
+        assert len(venue.genres) == 5
+
+
+def test_edit_venue_genres(client):
+    response = client.post('/venues/1/edit', data=dict(VENUE_FORM, genres=['Folk']))
+    assert response.status_code == 302
+    with client.application.app_context():
+        assert [genre.name for genre in Venue.query.get(1).genres] == ['Folk']
@@ -0,0 +1,11 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ingest import SyncLoader
+
+
+def test_sync_rejects_unsupported_databases():
+    connection = SimpleNamespace(dialect=SimpleNamespace(name='mysql'))
+    with pytest.raises(ValueError, match='not mysql'):
+        SyncLoader(connection)
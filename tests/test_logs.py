@@ -0,0 +1,30 @@
+import logging
+import os
+
+from flask import Flask
+
+from conftest import TEST_DIR
+from logs import LogPipeline
+
+
+def test_error_log_is_reopened_after_external_rotation():
+    path = os.path.join(TEST_DIR, 'rotated-error.log')
+    app = Flask('fyyur_log_test')
+    app.config.update(LOG_ERROR_FILE=path, LOG_ACCESS_FILE='')
+    pipeline = LogPipeline(app)
+    try:
+        app.logger.error('before rotation')
+        pipeline.handler.queue.join()
+        # What logrotate does without copytruncate
+        os.rename(path, path + '.1')
+        app.logger.error('after rotation')
+    finally:
+        pipeline.stop()
+        logging.getLogger('fyyur').removeHandler(pipeline.handler)
+
+    with open(path + '.1') as f:
+        assert 'before rotation' in f.read()
+    with open(path) as f:
+        written = f.read()
+    assert 'after rotation' in written
+    assert 'before rotation' not in written
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+from counters import roll_forward
+from models import db, Show
+from services import venue_page_validators
+
+
+def _add_show(app, days):
+    with app.app_context():
+        show = Show(venue_id=1, artist_id=4, start_time=datetime.utcnow() + timedelta(days=days))
+        db.session.add(show)
+        db.session.commit()
+        return show.start_time
+
+
+def test_last_modified_ignores_show_start_times(seeded):
+    # A show far in the future is past from the point of view of a later "now"
+    start = _add_show(seeded, 3650)
+    later = start + timedelta(hours=1)
+    with seeded.app_context():
+        current = venue_page_validators(1)
+        rolled = venue_page_validators(1, now=later)
+
+    assert rolled.etag != current.etag
+    assert rolled.last_modified == current.last_modified
+    assert current.last_modified < datetime.utcnow() + timedelta(seconds=1)
+
+
+def test_rolling_shows_forward_advances_last_modified(seeded):
+    start = _add_show(seeded, 1)
+    later = start + timedelta(hours=1)
+    with seeded.app_context():
+        before = venue_page_validators(1, now=later)
+        with db.engine.begin() as connection:
+            assert roll_forward(connection, since=start - timedelta(hours=1), now=later) == (1, 1)
+        after = venue_page_validators(1, now=later)
+
+    assert after.etag != before.etag
+    assert after.last_modified > before.last_modified
+
+
+def test_if_modified_since(client):
+    response = client.get('/venues/1')
+    assert response.status_code == 200
+    assert response.last_modified is not None
+
+    response = client.get('/venues/1', headers={'If-Modified-Since': response.headers['Last-Modified']})
+    assert response.status_code == 304
@@ -0,0 +1,88 @@
+import os
+
+import pytest
+from sqlalchemy import create_engine, exc
+
+from conftest import TEST_DIR
+from pool import TimedQueuePool, instrument_engine, render_pool_metrics
+
+
+def timed_engine(name):
+    return instrument_engine(create_engine(
+        'sqlite:///' + os.path.join(TEST_DIR, name),
+        poolclass=TimedQueuePool, pool_size=2, max_overflow=0, pool_timeout=0.05,
+    ))
+
+
+@pytest.fixture
+def engine():
+    engine = timed_engine('pool.db')
+    yield engine
+    engine.dispose()
+
+
+def test_checkouts_and_timeouts(engine):
+    first, second = engine.connect(), engine.connect()
+    assert engine.pool.stats.in_use == 2
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+
+    first.close()
+    second.close()
+    values = engine.pool.stats.snapshot()
+    assert values['in_use'] == 0
+    assert values['checkouts'] == 2
+    assert values['timeouts'] == 1
+
+
+def test_invalidated_and_detached_connections_stop_counting(engine):
+    invalidated, detached = engine.connect(), engine.connect()
+    invalidated.invalidate()
+    detached.detach()
+    assert engine.pool.stats.in_use == 0
+
+    invalidated.close()
+    detached.close()
+    assert engine.pool.stats.in_use == 0
+    # The pool has room for two connections again
+    first, second = engine.connect(), engine.connect()
+    assert engine.pool.stats.in_use == 2
+    first.close()
+    second.close()
+
+
+def test_stats_survive_dispose(engine):
+    stats = engine.pool.stats
+    engine.connect().close()
+    engine.dispose()
+    assert engine.pool.stats is stats
+
+    connection = engine.connect()
+    assert stats.in_use == 1
+    assert stats.checkouts == 2
+    connection.close()
+    assert stats.in_use == 0
+
+
+def test_metrics_have_one_series_per_bind(engine):
+    replica = timed_engine('pool_replica.db')
+    connection = replica.connect()
+    try:
+        metrics = render_pool_metrics({'primary': engine.pool, 'replica_0': replica.pool}).splitlines()
+    finally:
+        connection.close()
+        replica.dispose()
+
+    assert metrics.count('# TYPE fyyur_db_pool_checked_out gauge') == 1
+    assert 'fyyur_db_pool_checked_out{bind="primary"} 0' in metrics
+    assert 'fyyur_db_pool_checked_out{bind="replica_0"} 1' in metrics
+    assert 'fyyur_db_pool_saturation{bind="replica_0"} 0.5' in metrics
+    assert 'fyyur_db_pool_checkout_wait_seconds_count{bind="replica_0"} 1' in metrics
+
+
+def test_metrics_are_served_without_profiling(app, client):
+    assert not app.config['PROFILING']
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert 'fyyur_db_pool_checked_out{bind="primary"}' in response.get_data(as_text=True)
+    assert 'fyyur_requests_total' not in response.get_data(as_text=True)
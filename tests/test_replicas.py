@@ -0,0 +1,136 @@
+import os
+import shutil
+import sqlite3
+
+import pytest
+from flask import g
+from sqlalchemy import update
+
+from cache import LRUCache, NullCache
+from conftest import PRIMARY_PATH, TEST_DIR
+from models import db, Venue
+from replicas import PIN_KEY
+
+NAMES = ('Replica A venue', 'Replica B venue')
+
+EDITED_VENUE = {
+    'name': 'Edited Hop', 'city': 'San Francisco', 'state': 'CA', 'address': '1015 Folsom Street',
+    'phone': '123-123-1234', 'genres': ['Jazz'], 'facebook_link': 'https://www.facebook.com/x',
+    'image_link': '', 'website_link': '', 'seeking_description': '',
+}
+
+
+def _venue_name(path):
+    with sqlite3.connect(path) as connection:
+        return connection.execute('SELECT name FROM venues WHERE id = 1').fetchone()[0]
+
+
+@pytest.fixture
+def replicated(seeded):
+    """The seeded app with two replica files, copies of the primary whose venue 1 is named after them"""
+    router = seeded.extensions['replica_router']
+    saved = router.uris, router.binds, router.selection, seeded.config.get('SQLALCHEMY_BINDS')
+
+    router.uris = []
+    for index, name in enumerate(NAMES):
+        path = os.path.join(TEST_DIR, f'replica_{index}.db')
+        shutil.copy(PRIMARY_PATH, path)
+        with sqlite3.connect(path) as connection:
+            connection.execute('UPDATE venues SET name = ? WHERE id = 1', (name,))
+        router.uris.append('sqlite:///' + path)
+    router.binds = [f'replica_{index}' for index in range(len(NAMES))]
+    seeded.config['SQLALCHEMY_BINDS'] = dict(zip(router.binds, router.uris))
+
+    # Routing tests look at every response, not at cached ones
+    cache = seeded.extensions['response_cache']
+    backend, cache.backend = cache.backend, NullCache()
+    yield seeded
+
+    cache.backend = backend
+    router.uris, router.binds, router.selection, seeded.config['SQLALCHEMY_BINDS'] = saved
+
+
+def _read_from(client, url='/venues'):
+    body = client.get(url).get_data(as_text=True)
+    return [name for name in NAMES + ('The Musical Hop', 'Edited Hop') if name in body]
+
+
+def test_round_robin(replicated):
+    replicated.extensions['replica_router'].selection = 'round_robin'
+    client = replicated.test_client()
+    reads = [_read_from(client) for _ in range(4)]
+    assert reads[0] != reads[1]
+    assert reads == [reads[0], reads[1]] * 2
+    assert sorted(reads[:2]) == [[name] for name in NAMES]
+
+
+def test_least_connections(replicated):
+    router = replicated.extensions['replica_router']
+    router.selection = 'least_connections'
+    with replicated.app_context():
+        busy = db.get_engine(replicated, 'replica_0').connect()
+        try:
+            client = replicated.test_client()
+            assert [_read_from(client) for _ in range(3)] == [[NAMES[1]]] * 3
+        finally:
+            busy.close()
+
+
+def test_writes_and_flushes_go_to_the_primary(replicated):
+    with replicated.test_request_context():
+        g.replica_reads = True
+        assert db.session.query(Venue.name).filter(Venue.id == 1).scalar() in NAMES
+
+        db.session.execute(update(Venue).where(Venue.id == 2).values(city='Oakland'))
+        venue = db.session.query(Venue).get(3)
+        venue.name = 'Flushed Room'
+        db.session.flush()
+        db.session.commit()
+        # Having written, the rest of the request reads from the primary
+        assert db.session.query(Venue.name).filter(Venue.id == 1).scalar() == 'The Musical Hop'
+        db.session.remove()
+
+    with sqlite3.connect(PRIMARY_PATH) as connection:
+        rows = connection.execute('SELECT id, name, city FROM venues WHERE id IN (2, 3) ORDER BY id').fetchall()
+    assert rows[0][2] == 'Oakland'
+    assert rows[1][1] == 'Flushed Room'
+    for index in range(len(NAMES)):
+        assert _venue_name(os.path.join(TEST_DIR, f'replica_{index}.db')) == NAMES[index]
+
+
+def test_edit_pins_the_writer_to_the_primary(replicated):
+    writer, other = replicated.test_client(), replicated.test_client()
+    response = writer.post('/venues/1/edit', data=EDITED_VENUE)
+    assert response.status_code == 302
+
+    with writer.session_transaction() as session:
+        assert PIN_KEY in session
+    # The redirect and the listing come from the primary
+    assert _read_from(writer, response.headers['Location']) == ['Edited Hop']
+    assert _read_from(writer) == ['Edited Hop']
+    # Replicas lag behind, the other client still reads them
+    assert _read_from(other) in [[name] for name in NAMES]
+
+    with writer.session_transaction() as session:
+        session[PIN_KEY] = 0
+    assert _read_from(writer) in [[name] for name in NAMES]
+
+
+def test_replica_reads_are_not_cached_right_after_an_invalidation(replicated):
+    cache = replicated.extensions['response_cache']
+    cache.backend = LRUCache(max_entries=100)
+    writer, other = replicated.test_client(), replicated.test_client()
+    response = writer.post('/venues/1/edit', data=EDITED_VENUE)
+    # Renders the flashed message, pages with one aren't cached
+    writer.get(response.headers['Location'])
+
+    # The stale page read from a replica isn't stored under the new "venues" version
+    for _ in range(2):
+        response = other.get('/venues')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert 'Edited Hop' not in response.get_data(as_text=True)
+    # the page read from the primary is, and then served to everyone
+    assert writer.get('/venues').headers['X-Cache'] == 'MISS'
+    response = other.get('/venues')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert 'Edited Hop' in response.get_data(as_text=True)
@@ -0,0 +1,248 @@
+import importlib.util
+import json
+import os
+import random
+from datetime import datetime
+
+import pytest
+import sqlalchemy as sa
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from conftest import ROOT, TEST_DIR, recorded_queries
+from intervals import IntervalTree
+from models import db, Show, DEFAULT_SHOW_DURATION
+
+TOUR = [
+    {'venue_id': 1, 'artist_id': 4, 'start_time': '2031-03-01T20:00:00'},
+    {'venue_id': 2, 'artist_id': 4, 'start_time': '2031-03-02T20:00:00'},
+    {'venue_id': 3, 'artist_id': 4, 'start_time': '2031-03-03T20:00:00', 'end_time': '2031-03-03T23:30:00'},
+]
+TOUR_CSV = '''venue_id,artist_id,start_time,end_time
+1,4,2031-03-01T20:00:00,
+2,4,2031-03-02T20:00:00,
+3,4,2031-03-03T20:00:00,2031-03-03T23:30:00
+'''
+# Rows 2 and 4 are invalid
+MIXED = [
+    {'venue_id': 1, 'artist_id': 5, 'start_time': '2031-04-01T20:00:00'},
+    {'venue_id': 99, 'artist_id': 'five', 'start_time': '2031-04-02T20:00:00'},
+    {'venue_id': 2, 'artist_id': 5, 'start_time': '2031-04-03T20:00:00+02:00'},
+    {'venue_id': 3, 'artist_id': 5, 'start_time': 'tomorrow', 'end_time': '2031-04-04T23:00:00'},
+]
+
+_spec = importlib.util.spec_from_file_location(
+    'migration_1d5c37800caa', os.path.join(ROOT, 'migrations', 'versions', '1d5c37800caa_.py'))
+migration = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(migration)
+
+
+def _scheduled(app, year=2031):
+    """(venue_id, artist_id, start_time, end_time) of the shows in year"""
+    with app.app_context():
+        shows = Show.query.filter(Show.start_time >= f'{year}-01-01', Show.start_time < f'{year + 1}-01-01') \
+            .order_by(Show.start_time)
+        return [(show.venue_id, show.artist_id, show.start_time.isoformat(), show.end_time.isoformat())
+                for show in shows]
+
+
+def _post(client, shows, **query_string):
+    return client.post('/api/v1/shows', data=json.dumps(shows), content_type='application/json',
+                       query_string=query_string)
+
+
+def _upload(name, text):
+    path = os.path.join(TEST_DIR, name)
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+def test_post_json(client):
+    response = _post(client, {'shows': TOUR})
+    assert response.status_code == 201
+    assert response.get_json() == {'created': 3, 'errors': []}
+    assert _scheduled(client.application) == [
+        (1, 4, '2031-03-01T20:00:00', '2031-03-01T22:00:00'),
+        (2, 4, '2031-03-02T20:00:00', '2031-03-02T22:00:00'),
+        (3, 4, '2031-03-03T20:00:00', '2031-03-03T23:30:00'),
+    ]
+
+
+def test_post_csv(client):
+    response = client.post('/api/v1/shows', data=TOUR_CSV, content_type='text/csv')
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 3
+    assert len(_scheduled(client.application)) == 3
+
+
+def test_post_reports_every_invalid_row_and_creates_nothing(client):
+    response = _post(client, MIXED)
+    assert response.status_code == 422
+    assert response.get_json() == {'created': 0, 'errors': [
+        {'row': 2, 'errors': {'artist_id': 'must be a positive integer'}},
+        {'row': 4, 'errors': {'start_time': 'must be an ISO 8601 date and time'}},
+    ]}
+    assert _scheduled(client.application) == []
+
+    # Ids that are well-formed but don't exist are reported the same way
+    response = _post(client, [dict(MIXED[0]), dict(MIXED[0], venue_id=99, start_time='2031-05-01T20:00:00')])
+    assert response.status_code == 422
+    assert response.get_json()['errors'] == [{'row': 2, 'errors': {'venue_id': 'venue 99 does not exist'}}]
+    assert _scheduled(client.application) == []
+
+
+def test_post_skip_invalid_creates_the_valid_rows(client):
+    response = _post(client, MIXED, skip_invalid=1)
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 2
+    assert [error['row'] for error in response.get_json()['errors']] == [2, 4]
+    # The offset is converted to UTC
+    assert _scheduled(client.application) == [
+        (1, 5, '2031-04-01T20:00:00', '2031-04-01T22:00:00'),
+        (2, 5, '2031-04-03T18:00:00', '2031-04-03T20:00:00'),
+    ]
+
+
+def test_post_unreadable_uploads(client):
+    assert _post(client, {'shows': []}).status_code == 400
+    assert client.post('/api/v1/shows', data='venue_id,start_time\n', content_type='text/csv').status_code == 400
+    assert client.post('/api/v1/shows', data='', content_type='text/plain').status_code == 415
+
+
+def test_ids_are_checked_with_one_query_and_rows_inserted_in_batches(client, monkeypatch):
+    monkeypatch.setitem(client.application.config, 'SCHEDULE_BATCH_SIZE', 2)
+    shows = [{'venue_id': venue_id, 'artist_id': artist_id, 'start_time': f'2031-06-{day:02}T20:00:00'}
+             for day, (venue_id, artist_id) in enumerate([(1, 4), (2, 5), (3, 6), (1, 5), (2, 6)], 1)]
+    with client.application.app_context():
+        engine = db.engine
+    with recorded_queries(engine) as statements:
+        response = _post(client, shows)
+    assert response.status_code == 201
+    assert response.get_json()['created'] == 5
+
+    selects = [statement for statement in statements if statement.lstrip().startswith('SELECT')]
+    id_checks = [statement for statement in selects if 'FROM venues' in statement and 'FROM artists' in statement]
+    assert len(id_checks) == 1
+    inserts = [statement for statement in statements if statement.lstrip().startswith('INSERT INTO shows')]
+    assert len(inserts) == 3
+
+
+def test_schedule_command(seeded):
+    result = seeded.test_cli_runner().invoke(args=['schedule-shows', _upload('tour.csv', TOUR_CSV)])
+    assert result.exit_code == 0, result.output
+    assert 'Created 3 shows' in result.output
+    assert len(_scheduled(seeded)) == 3
+
+
+def test_schedule_command_json_is_all_or_nothing(seeded):
+    path = _upload('mixed.json', json.dumps(MIXED))
+    result = seeded.test_cli_runner().invoke(args=['schedule-shows', path])
+    assert result.exit_code == 1
+    assert 'row 2: artist_id must be a positive integer' in result.output
+    assert 'row 4: start_time must be an ISO 8601 date and time' in result.output
+    assert 'Created 0 shows, 2 rows invalid' in result.output
+    assert _scheduled(seeded) == []
+
+    result = seeded.test_cli_runner().invoke(args=['schedule-shows', '--skip-invalid', path])
+    assert result.exit_code == 1
+    assert 'Created 2 shows, 2 rows invalid' in result.output
+    assert len(_scheduled(seeded)) == 2
+
+
+def test_schedule_command_unreadable_upload(seeded):
+    result = seeded.test_cli_runner().invoke(args=['schedule-shows', _upload('empty.csv', 'venue_id,artist_id\n')])
+    assert result.exit_code == 1
+    assert 'CSV header is missing start_time' in result.output
+
+
+# ----------------------------------------------------------------------------#
+# Double bookings.
+# ----------------------------------------------------------------------------#
+
+def test_interval_tree_overlap_and_touching():
+    tree = IntervalTree([(10, 20, 'a'), (30, 40, 'b'), (50, 60, 'c')], seed=1)
+    assert tree.find(15, 16) == (10, 20, 'a')
+    assert tree.find(35, 55) in ((30, 40, 'b'), (50, 60, 'c'))
+    assert tree.find(0, 100) is not None
+    # Half-open: intervals that only touch don't overlap
+    assert tree.find(20, 30) is None
+    assert tree.find(0, 10) is None
+    assert tree.find(60, 70) is None
+    assert list(tree) == [(10, 20, 'a'), (30, 40, 'b'), (50, 60, 'c')]
+    with pytest.raises(ValueError):
+        tree.add(5, 5)
+
+
+def test_interval_tree_matches_a_scan():
+    generator = random.Random(7)
+    intervals = []
+    tree = IntervalTree(seed=7)
+    for value in range(300):
+        start = generator.randrange(1000)
+        end = start + generator.randrange(1, 30)
+        intervals.append((start, end, value))
+        tree.add(start, end, value)
+    assert len(tree) == 300
+    for _ in range(300):
+        start = generator.randrange(1000)
+        end = start + generator.randrange(1, 30)
+        found = tree.find(start, end)
+        overlapping = [interval for interval in intervals if interval[0] < end and start < interval[1]]
+        assert (found is None) == (not overlapping)
+        assert found is None or found in overlapping
+
+
+def test_conflicts_with_stored_shows(client):
+    assert _post(client, [{'venue_id': 1, 'artist_id': 4, 'start_time': '2031-07-01T20:00:00'}]).status_code == 201
+
+    response = _post(client, [
+        # Same venue from 21:00, same artist from 21:59 elsewhere: both overlap 20:00-22:00
+        {'venue_id': 1, 'artist_id': 5, 'start_time': '2031-07-01T21:00:00'},
+        {'venue_id': 2, 'artist_id': 4, 'start_time': '2031-07-01T21:59:00'},
+        # Starting when the stored show ends is fine
+        {'venue_id': 1, 'artist_id': 4, 'start_time': '2031-07-01T22:00:00'},
+        {'venue_id': 1, 'artist_id': 6, 'start_time': '2031-07-01T18:00:00', 'end_time': '2031-07-01T20:00:00'},
+    ])
+    assert response.status_code == 422
+    errors = response.get_json()['errors']
+    assert [error['row'] for error in errors] == [1, 2]
+    assert errors[0]['errors']['venue_id'].startswith('venue 1 is already booked on 2031-07-01 from 20:00 to 22:00')
+    assert errors[1]['errors']['artist_id'].startswith('artist 4 is already booked on 2031-07-01 from 20:00 to 22:00')
+
+
+def test_conflicts_with_an_earlier_row_of_the_upload(client):
+    response = _post(client, [
+        {'venue_id': 1, 'artist_id': 4, 'start_time': '2031-08-01T20:00:00'},
+        {'venue_id': 2, 'artist_id': 4, 'start_time': '2031-08-01T21:00:00'},
+        {'venue_id': 2, 'artist_id': 5, 'start_time': '2031-08-01T22:00:00'},
+    ], skip_invalid=1)
+    assert response.status_code == 201
+    assert response.get_json() == {'created': 2, 'errors': [
+        {'row': 2, 'errors': {'artist_id': 'artist 4 is already booked on 2031-08-01 from 20:00 to 22:00 by row 1'}},
+    ]}
+    # The rejected row 2 doesn't block row 3 at its venue
+    assert [show[:2] for show in _scheduled(client.application)] == [(1, 4), (2, 5)]
+
+
+def test_migration_backfills_end_times():
+    engine = sa.create_engine('sqlite:///' + os.path.join(TEST_DIR, 'migration.db'))
+    metadata = sa.MetaData()
+    shows = sa.Table('shows', metadata, sa.Column('id', sa.Integer, primary_key=True),
+                     sa.Column('start_time', sa.DateTime, nullable=False))
+    starts = [datetime(2019, 5, 21, 21, 30), datetime(2035, 4, 1, 23, 15, 30, 250000)]
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(shows.insert(), [{'start_time': start} for start in starts])
+
+    with engine.begin() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            migration.upgrade()
+
+    migrated = sa.Table('shows', sa.MetaData(), sa.Column('id', sa.Integer), sa.Column('start_time', sa.DateTime),
+                        sa.Column('end_time', sa.DateTime))
+    with engine.connect() as connection:
+        rows = connection.execute(sa.select(migrated.c.start_time, migrated.c.end_time).order_by('id')).all()
+    engine.dispose()
+    assert rows == [(start, start + DEFAULT_SHOW_DURATION) for start in starts]
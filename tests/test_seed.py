@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta, timezone
+
+import populate_db
+from cache import RedisCache, ResponseCache
+from conftest import ROOT, TEST_DIR
+from config import INITIAL_DATA_PATH
+from counters import find_drift
+from fakes import FakeRedis
+from models import db, Venue, Show
+
+
+def test_populate_db_default_path_runs():
+    path = os.path.join(TEST_DIR, 'seed.db')
+    result = subprocess.run(
+        [sys.executable, 'populate_db.py'], cwd=ROOT, capture_output=True, text=True,
+        env=dict(os.environ, DATABASE_URL='sqlite:///' + path),
+    )
+    assert result.returncode == 0, result.stderr
+    assert 'Loaded' in result.stdout
+
+
+def test_seeded_shows_are_naive_utc_and_counted(seeded):
+    with open(INITIAL_DATA_PATH) as f:
+        data = json.load(f)
+    with seeded.app_context():
+        shows = Show.query.order_by(Show.id).all()
+        assert len(shows) == len(data['shows'])
+        assert shows[0].start_time == datetime(2019, 5, 21, 21, 30)
+        assert all(show.start_time.tzinfo is None for show in shows)
+        with db.engine.connect() as connection:
+            assert find_drift(connection) == []
+
+
+def test_show_times_are_coerced_before_counting(seeded):
+    with seeded.app_context():
+        upcoming = Venue.query.get(1).upcoming_shows_count
+        later = datetime.now(timezone.utc) + timedelta(days=30)
+        db.session.add(Show(venue_id=1, artist_id=4, start_time=later.isoformat()))
+        db.session.add(Show(venue_id=1, artist_id=5, start_time=later + timedelta(days=1)))
+        db.session.commit()
+
+        assert Venue.query.get(1).upcoming_shows_count == upcoming + 2
+        stored = Show.query.filter(Show.venue_id == 1).order_by(Show.id.desc()).limit(2).all()
+        assert all(show.start_time.tzinfo is None for show in stored)
+        assert stored[1].start_time == later.replace(tzinfo=None)
+
+
+def test_loads_clear_a_shared_response_cache(monkeypatch):
+    backend = RedisCache(FakeRedis())
+    cache = ResponseCache(backend=backend)
+    cache.set('calendar:venue:1:2035-01', ['calendar:venue:1', 'calendar:venue:1:2035-01'], [])
+    monkeypatch.setattr(populate_db, 'backend_from_config', lambda config: backend)
+
+    monkeypatch.setitem(populate_db.app.config, 'CACHE_TYPE', 'lru')
+    assert not populate_db.clear_shared_cache()
+    assert backend.get('calendar:venue:1:2035-01') is not None
+
+    monkeypatch.setitem(populate_db.app.config, 'CACHE_TYPE', 'redis')
+    assert populate_db.clear_shared_cache()
+    assert backend.get('calendar:venue:1:2035-01') is None
@@ -0,0 +1,46 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import WINDOW
+from counters import find_drift
+from models import db, Venue
+from services import load_venue_with_shows
+
+
+@pytest.fixture
+def local_time_behind_utc(monkeypatch):
+    """A local time zone five hours behind UTC, to catch times compared with the local clock"""
+    monkeypatch.setenv('TZ', 'Etc/GMT+5')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_form_shows_are_split_and_counted_in_utc(client, local_time_behind_utc):
+    # Past in UTC, but still ahead of the local clock
+    start_time = (datetime.utcnow() - timedelta(hours=2)).replace(second=0, microsecond=0)
+    with client.application.app_context():
+        before = Venue.query.get(1)
+        counts = before.upcoming_shows_count, before.past_shows_count
+
+    response = client.post('/shows/create', data={
+        'venue_id': '1', 'artist_id': '4', 'start_time': start_time.strftime('%Y-%m-%d %H:%M:%S'),
+    })
+    assert 'Show was successfully listed!' in response.get_data(as_text=True)
+
+    with client.application.app_context():
+        venue, past_shows, upcoming_shows = load_venue_with_shows(1)
+        assert start_time in [show.start_time for show in past_shows]
+        assert start_time not in [show.start_time for show in upcoming_shows]
+        assert (venue.upcoming_shows_count, venue.past_shows_count) == (counts[0], counts[1] + 1)
+        with db.engine.connect() as connection:
+            assert find_drift(connection) == []
+
+
+def test_shows_window_converts_offsets_to_utc(client, window_shows):
+    body = client.get('/shows', query_string={'from': WINDOW[0], 'to': WINDOW[1]}).get_data(as_text=True)
+    assert 'The Wild Sax Band' in body
+    assert 'Matt Quevedo' not in body